@@ -0,0 +1,21 @@
+"""
+Блокировка записи в SQLite.
+
+В SQLite транзакция, начатая чтением, не может перейти к записи, пока
+пишет другая: она сразу получает database is locked, без ожидания
+(ожидание timeout соединения действует только на первую блокировку).
+Транзакции, которые читают и по прочитанному пишут (оформление заказа,
+сводки продаж), начинаются с begin_write(): пустой UPDATE сразу берет
+блокировку записи, и одновременные транзакции ждут друг друга по очереди.
+В других базах блокировки строк берет select_for_update(), а
+begin_write() ничего не делает.
+"""
+from django.db import connection
+
+
+def begin_write():
+    """Берет блокировку записи в начале транзакции, до первого чтения"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # Таблица миграций есть всегда; WHERE 0 не меняет ни одной строки
+            cursor.execute('UPDATE django_migrations SET id = id WHERE 0')
@@ -0,0 +1,240 @@
+"""
+Замеры запросов: время ответа, запросы к базе и время отрисовки шаблонов
+по представлениям.
+
+Запрос попадает в выборку с вероятностью REQUEST_METRICS_SAMPLE_RATE.
+Для него считаются время ответа, число и время SQL-запросов, время
+отрисовки шаблонов и запросы, выполненные во время отрисовки (ленивые
+QuerySet в шаблонах), а также отпечатки повторяющихся запросов: SQL с
+подстановками вместо значений, одинаковый для всех итераций цикла N+1.
+Итоги копятся по имени представления (snapshot()) и пишутся в журнал
+flower_shop.middleware; при REQUEST_METRICS_SERVER_TIMING они же
+отдаются в заголовке Server-Timing.
+
+REQUEST_METRICS_QUERY_BUDGETS задает предельное число запросов для
+представлений ({'profile': 15}); запросы к ним считаются всегда, а при
+превышении пишется предупреждение или, при REQUEST_METRICS_BUDGET_ACTION
+= 'raise', выбрасывается QueryBudgetExceeded - удобно в тестах.
+
+Если выборка выключена и предельных значений нет (так настроено вне
+режима отладки), middleware отключается при запуске (MiddlewareNotUsed).
+Иначе каждый запрос оборачивает выполнение SQL, а отрисовка шаблонов
+замеряется во всем процессе. Запросы, выполненные при отдаче потокового
+ответа, не учитываются.
+
+ProfilingMiddleware снимает профиль запроса сотрудника с подписанным
+токеном (см. flower_shop/profiling.py); ему нужен request.user, поэтому
+он стоит после AuthenticationMiddleware.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+from . import profiling
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+_stats = {}
+_stats_lock = threading.Lock()
+
+# Списки значений IN (%s, %s, ...) разной длины дают один отпечаток
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов, чем разрешено"""
+
+
+def fingerprint(sql):
+    """SQL-запрос без значений: одинаков для запросов, отличающихся только параметрами"""
+    return _IN_LIST.sub('(%s, ...)', sql)
+
+
+class Collector:
+    """Замеры одного запроса"""
+
+    def __init__(self, detailed):
+        self.detailed = detailed
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.template_queries = 0
+        self.template_depth = 0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if self.template_depth:
+            self.template_queries += 1
+        if not self.detailed:
+            return execute(sql, params, many, context)
+        self.fingerprints[fingerprint(sql)] += 1
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - started
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+
+_template_render = Template.render
+
+
+def _timed_render(self, context=None, request=None):
+    collector = _current.get()
+    if collector is None:
+        return _template_render(self, context, request)
+    # Вложенные render_to_string() уже входят во время внешнего шаблона
+    collector.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context, request)
+    finally:
+        collector.template_depth -= 1
+        if not collector.template_depth:
+            collector.template_time += time.perf_counter() - started
+
+
+def _record(view_name, elapsed, collector):
+    with _stats_lock:
+        stats = _stats.setdefault(view_name, {
+            'requests': 0, 'time': 0.0, 'max_time': 0.0, 'queries': 0, 'max_queries': 0,
+            'query_time': 0.0, 'template_time': 0.0, 'template_queries': 0, 'duplicates': Counter(),
+        })
+        stats['requests'] += 1
+        stats['time'] += elapsed
+        stats['max_time'] = max(stats['max_time'], elapsed)
+        stats['queries'] += collector.queries
+        stats['max_queries'] = max(stats['max_queries'], collector.queries)
+        stats['query_time'] += collector.query_time
+        stats['template_time'] += collector.template_time
+        stats['template_queries'] += collector.template_queries
+        for sql, count in collector.duplicates(settings.REQUEST_METRICS_DUPLICATE_THRESHOLD):
+            stats['duplicates'][sql] = max(stats['duplicates'][sql], count)
+
+
+def snapshot():
+    """Итоги по представлениям с начала работы процесса (время в миллисекундах)"""
+    with _stats_lock:
+        items = [(name, dict(stats, duplicates=stats['duplicates'].copy())) for name, stats in _stats.items()]
+    result = {}
+    for name, stats in sorted(items):
+        requests = stats['requests']
+        result[name] = {
+            'requests': requests,
+            'mean_ms': round(stats['time'] / requests * 1000, 2),
+            'max_ms': round(stats['max_time'] * 1000, 2),
+            'queries_mean': round(stats['queries'] / requests, 2),
+            'queries_max': stats['max_queries'],
+            'query_ms_mean': round(stats['query_time'] / requests * 1000, 2),
+            'template_ms_mean': round(stats['template_time'] / requests * 1000, 2),
+            'template_queries_mean': round(stats['template_queries'] / requests, 2),
+            'duplicates': stats['duplicates'].most_common(10),
+        }
+    return result
+
+
+def reset():
+    """Сбрасывает накопленные итоги"""
+    with _stats_lock:
+        _stats.clear()
+
+
+class RequestMetricsMiddleware:
+    """Считает запросы к базе, время ответа и отрисовки шаблонов по представлениям"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.REQUEST_METRICS_SAMPLE_RATE
+        self.budgets = settings.REQUEST_METRICS_QUERY_BUDGETS
+        if not self.sample_rate and not self.budgets:
+            raise MiddlewareNotUsed
+        Template.render = _timed_render
+
+    def __call__(self, request):
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        if not sampled and not self.budgets:
+            return self.get_response(request)
+
+        collector = Collector(detailed=sampled)
+        token = _current.set(collector)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(collector))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        if sampled:
+            self.report(request, response, view_name, elapsed, collector)
+        self.check_budget(request, view_name, collector)
+        return response
+
+    def report(self, request, response, view_name, elapsed, collector):
+        _record(view_name, elapsed, collector)
+        duplicates = collector.duplicates(settings.REQUEST_METRICS_DUPLICATE_THRESHOLD)
+        logger.info(
+            '%s %s %s %s: %.1f мс, запросов %d (%.1f мс, из шаблонов %d), шаблоны %.1f мс%s',
+            view_name, request.method, request.path, response.status_code, elapsed * 1000,
+            collector.queries, collector.query_time * 1000, collector.template_queries,
+            collector.template_time * 1000,
+            ''.join(f'\n  повторов {count}: {sql}' for sql, count in duplicates[:5]),
+        )
+        if settings.REQUEST_METRICS_SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={collector.query_time * 1000:.1f};desc="SQL x{collector.queries}"',
+                f'tpl;dur={collector.template_time * 1000:.1f};desc="templates"',
+                f'total;dur={elapsed * 1000:.1f}',
+            ])
+
+    def check_budget(self, request, view_name, collector):
+        budget = self.budgets.get(view_name)
+        if budget is None or collector.queries <= budget:
+            return
+        message = f'{view_name} ({request.path}): {collector.queries} запросов к базе при допустимых {budget}'
+        if settings.REQUEST_METRICS_BUDGET_ACTION == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class ProfilingMiddleware:
+    """Профилирует запрос сотрудника, если в нем есть действующий токен профилирования"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        token = request.META.get(profiling.TOKEN_HEADER) or request.GET.get(profiling.TOKEN_PARAM)
+        if not token or not profiling.check_token(token, request):
+            return self.get_response(request)
+
+        sampler = profiling.Sampler(
+            threading.get_ident(), settings.PROFILING_INTERVAL, settings.PROFILING_MAX_SECONDS,
+        )
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        response['X-Profile-Id'] = profiling.save(sampler, request, response)
+        return response
@@ -0,0 +1,204 @@
+"""
+Профилирование отдельных запросов на боевом сервере.
+
+Сотрудник получает на странице /admin/profiles/ подписанный токен для
+пути (например /orders/checkout/) и повторяет запрос с заголовком
+X-Profile-Token или параметром ?_profile=<токен>. Токен действует
+PROFILING_TOKEN_MAX_AGE секунд, только для своего пути и только в сессии
+выдавшего его сотрудника: утекший токен без этой сессии бесполезен.
+
+Для такого запроса запускается поток, который каждые PROFILING_INTERVAL
+секунд снимает стек потока, обрабатывающего запрос (sys._current_frames).
+Остальные запросы не замедляются, а профилируемый - на доли процента.
+Результат сохраняется в PROFILING_ROOT/<id>/: стеки в формате collapsed
+(flamegraph.pl, speedscope) и профиль speedscope JSON. Хранятся последние
+PROFILING_KEEP профилей.
+"""
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+TOKEN_HEADER = 'HTTP_X_PROFILE_TOKEN'
+TOKEN_PARAM = '_profile'
+COLLAPSED_NAME = 'stacks.collapsed'
+SPEEDSCOPE_NAME = 'profile.speedscope.json'
+META_NAME = 'meta.json'
+PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+_signer = signing.TimestampSigner(salt='flower_shop.profiling')
+
+
+def make_token(path, user):
+    """Подписанный токен сотрудника user для профилирования запросов к пути path"""
+    return _signer.sign_object({'user': user.pk, 'path': path})
+
+
+def check_token(token, request):
+    """True, если токен не просрочен, подписан для пути запроса и выдан
+    вошедшему сотруднику, который его отправил"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_active or not user.is_staff:
+        return False
+    try:
+        data = _signer.unsign_object(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return isinstance(data, dict) and data.get('user') == user.pk and data.get('path') == request.path
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    # Самый длинный подходящий префикс: site-packages, а не каталог Python
+    for prefix in sorted((str(settings.BASE_DIR), *sys.path), key=len, reverse=True):
+        if prefix and filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class Sampler:
+    """Снимает стек одного потока через равные промежутки времени"""
+
+    def __init__(self, thread_id, interval, max_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.started = self.finished = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        names = {}
+        deadline = self.started + self.max_seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in names:
+                    names[code] = _frame_name(code)
+                stack.append(names[code])
+                frame = frame.f_back
+            if stack:
+                # Корень стека - первым, как в формате collapsed
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.finished = time.perf_counter()
+
+    @property
+    def duration(self):
+        return self.finished - self.started
+
+    def collapsed(self):
+        """Стеки в формате collapsed: "корень;...;лист число" на строку"""
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in self.stacks.most_common())
+
+    def speedscope(self, name):
+        """Профиль в формате speedscope (sampled, вес выборки - в секундах)"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.stacks.most_common():
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame})
+                sample.append(index[frame])
+            samples.append(sample)
+            weights.append(round(count * self.interval, 6))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 6),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': name,
+            'exporter': 'flower_shop',
+        }
+
+
+def _root():
+    return Path(settings.PROFILING_ROOT)
+
+
+def save(sampler, request, response):
+    """Сохраняет профиль запроса; возвращает его id"""
+    now = datetime.now(timezone.utc)
+    profile_id = f'{now:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+    match = request.resolver_match
+    meta = {
+        'id': profile_id,
+        'created_at': now.isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'user': request.user.get_username() if getattr(request, 'user', None) else None,
+        'duration_ms': round(sampler.duration * 1000, 1),
+        'samples': sum(sampler.stacks.values()),
+        'interval_ms': sampler.interval * 1000,
+    }
+    directory = _root() / profile_id
+    directory.mkdir(parents=True)
+    (directory / COLLAPSED_NAME).write_text(sampler.collapsed())
+    name = f'{request.method} {request.path}'
+    (directory / SPEEDSCOPE_NAME).write_text(json.dumps(sampler.speedscope(name), ensure_ascii=False))
+    # meta.json пишется последним: профиль без него не показывается в списке
+    (directory / META_NAME).write_text(json.dumps(meta, ensure_ascii=False))
+    _prune()
+    return profile_id
+
+
+def _prune():
+    directories = sorted(path for path in _root().iterdir() if PROFILE_ID.match(path.name))
+    for directory in directories[:-settings.PROFILING_KEEP]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def list_profiles():
+    """Сохраненные профили, новые первыми"""
+    root = _root()
+    if not root.is_dir():
+        return []
+    profiles = []
+    for directory in sorted(root.iterdir(), reverse=True):
+        if not PROFILE_ID.match(directory.name):
+            continue
+        try:
+            profiles.append(json.loads((directory / META_NAME).read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_file(profile_id, name):
+    """Путь к файлу профиля или None"""
+    if not PROFILE_ID.match(profile_id) or name not in (COLLAPSED_NAME, SPEEDSCOPE_NAME):
+        return None
+    path = _root() / profile_id / name
+    return path if path.is_file() else None
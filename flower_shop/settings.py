@@ -40,17 +40,21 @@ INSTALLED_APPS = [
     'main',
     'user_auth',
     'orders',
+    'jobs',
     'crispy_forms',
     'crispy_bootstrap5',
     'widget_tweaks',
 ]
 
 MIDDLEWARE = [
+    'flower_shop.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'flower_shop.middleware.ProfilingMiddleware',
+    'orders.middleware.CartCountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -83,6 +87,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Тестовая база - файл, а не память: в общей памяти SQLite одновременные
+        # транзакции сразу получают ошибку вместо ожидания, как на сервере
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -127,6 +134,127 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Уменьшенные копии изображений товаров и слайдов (см. main/images.py)
+IMAGE_DERIVATIVES_ROOT = MEDIA_ROOT / 'derivatives'
+IMAGE_DERIVATIVES_URL = MEDIA_URL + 'derivatives/'
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'flowlow',
+    }
+}
+
+# Кеш данных витрины: сбрасывается сменой поколения при изменении каталога
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Хранилище корзин (см. orders/cart.py): CacheCartStorage держит корзины в кеше
+# и записывает их в таблицу Cart пачками - не реже раза в CART_FLUSH_INTERVAL
+# секунд или по CART_FLUSH_BATCH_SIZE корзин; DatabaseCartStorage пишет сразу.
+# Кеш в памяти процесса (LocMemCache) у каждого процесса свой и пропадает при
+# перезапуске вместе с незаписанными корзинами, поэтому CacheCartStorage включается
+# только с общим кешем (Redis, Memcached)
+CART_CACHE_ALIAS = 'default'
+CART_STORAGE = (
+    'orders.cart.DatabaseCartStorage'
+    if CACHES[CART_CACHE_ALIAS]['BACKEND'] in (
+        'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+    )
+    else 'orders.cart.CacheCartStorage'
+)
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+CART_FLUSH_INTERVAL = 30
+CART_FLUSH_BATCH_SIZE = 200
+
+# Условные GET-запросы страниц витрины: изменить при выкладке новых шаблонов,
+# чтобы браузеры не получили 304 на страницы со старой разметкой
+PAGE_ETAG_VERSION = '1'
+
+# Поиск по товарам
+SEARCH_INDEX_PATH = BASE_DIR / 'var' / 'search_index.pickle'
+SEARCH_RESULT_LIMIT = 500
+# Изменения индекса из сигналов сбрасываются на диск не чаще раза в N секунд
+SEARCH_INDEX_SAVE_DELAY = 5
+
+# Фасеты каталога: индекс в памяти процесса полностью перестраивается раз в N секунд
+FACET_INDEX_TTL = 300
+
+# Замеры запросов по представлениям (см. flower_shop/middleware.py): доля
+# запросов в выборке, предельное число запросов к базе по имени представления
+# и действие при превышении - 'log' или 'raise'. Предельные значения проверяются
+# в каждом запросе, поэтому на боевом сервере они выключены вместе с выборкой -
+# и middleware отключается при запуске
+REQUEST_METRICS_SAMPLE_RATE = 1.0 if DEBUG else 0.0
+REQUEST_METRICS_QUERY_BUDGETS = {
+    'home': 10,
+    'catalog': 10,
+    'product_detail': 10,
+    'cart': 10,
+    'checkout': 15,
+    'profile': 15,
+} if DEBUG else {}
+REQUEST_METRICS_BUDGET_ACTION = 'log'
+# Отпечаток попадает в отчет, если запрос повторился не меньше N раз
+REQUEST_METRICS_DUPLICATE_THRESHOLD = 3
+REQUEST_METRICS_SERVER_TIMING = DEBUG
+
+# Профилирование отдельных запросов сотрудников по подписанному токену (см. flower_shop/profiling.py);
+# на боевом сервере включается явно
+PROFILING_ENABLED = DEBUG
+PROFILING_ROOT = BASE_DIR / 'var' / 'profiles'
+PROFILING_INTERVAL = 0.005
+PROFILING_MAX_SECONDS = 60
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+PROFILING_KEEP = 100
+
+# Фоновые задачи (см. jobs/queue.py): срок аренды задачи воркером, число попыток,
+# задержка перед повтором (удваивается с каждой попыткой) и срок хранения выполненных.
+# При JOBS_EAGER задачи выполняются сразу после коммита, без воркеров run_workers
+JOBS_EAGER = DEBUG
+JOBS_VISIBILITY_TIMEOUT = 5 * 60
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BACKOFF = 10
+JOBS_RETRY_BACKOFF_MAX = 60 * 60
+JOBS_KEEP_DAYS = 7
+
+# Докатка снимков склада (см. orders/inventory.py): изменения остатков за
+# STOCK_ROLL_INTERVAL секунд докатываются одной задачей
+STOCK_ROLL_INTERVAL = 5
+
+# Сводки продаж для админки (см. orders/analytics.py): события заказов сводятся
+# задачей, которая ставится не чаще раза в SALES_ROLLUP_INTERVAL секунд; события моложе
+# SALES_ROLLUP_LAG секунд ждут следующего раза: транзакция, начатая раньше, может
+# закоммитить событие с меньшим id позже
+SALES_ROLLUP_INTERVAL = 60
+SALES_ROLLUP_LAG = 0 if DEBUG else 30
+SALES_ROLLUP_BATCH_SIZE = 2000
+
+# Архив заказов (см. orders/archive.py): подтвержденные и отмененные заказы старше
+# ORDERS_ARCHIVE_AFTER_DAYS дней команда archive_orders переносит в архив пачками по
+# ORDERS_ARCHIVE_BATCH_SIZE заказов, каждая пачка - отдельная короткая транзакция
+ORDERS_ARCHIVE_AFTER_DAYS = 365
+ORDERS_ARCHIVE_BATCH_SIZE = 500
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # INFO - строка с замерами на каждый запрос из выборки
+        'flower_shop.middleware': {'handlers': ['console'], 'level': 'WARNING'},
+        'jobs': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
+# Заказов на странице личного кабинета
+PROFILE_ORDERS_PER_PAGE = 10
+
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
@@ -0,0 +1,127 @@
+import json
+import tempfile
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from user_auth.models import CustomUser
+from . import middleware, profiling
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        # Страница из кеша не делает запросов к базе
+        cache.clear()
+        middleware.reset()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            middleware.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = %s'),
+            'SELECT * FROM t WHERE id IN (%s, ...) AND x = %s',
+        )
+        self.assertEqual(middleware.fingerprint('... IN (%s, %s)'), middleware.fingerprint('... IN (%s, %s, %s)'))
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1.0, REQUEST_METRICS_SERVER_TIMING=True)
+    def test_sampled_request(self):
+        response = self.client.get('/catalog/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        stats = middleware.snapshot()['catalog']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries_mean'], 0)
+
+    @override_settings(
+        REQUEST_METRICS_SAMPLE_RATE=0.0, REQUEST_METRICS_QUERY_BUDGETS={'catalog': 0},
+        REQUEST_METRICS_BUDGET_ACTION='raise',
+    )
+    def test_budget_raise(self):
+        with self.assertRaisesMessage(middleware.QueryBudgetExceeded, 'catalog (/catalog/): '):
+            self.client.get('/catalog/')
+        # Без выборки запросы только считаются, в итоги они не попадают
+        self.assertEqual(middleware.snapshot(), {})
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0, REQUEST_METRICS_QUERY_BUDGETS={'catalog': 0})
+    def test_budget_log(self):
+        with self.assertLogs('flower_shop.middleware', 'WARNING') as logs:
+            self.assertEqual(self.client.get('/catalog/').status_code, 200)
+        self.assertIn('при допустимых 0', logs.output[0])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0, REQUEST_METRICS_QUERY_BUDGETS={'catalog': 100})
+    def test_within_budget(self):
+        with self.assertNoLogs('flower_shop.middleware', 'WARNING'):
+            self.client.get('/catalog/')
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0.0, REQUEST_METRICS_QUERY_BUDGETS={})
+    def test_disabled(self):
+        response = self.client.get('/catalog/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(middleware.snapshot(), {})
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PROFILING_ENABLED=True, PROFILING_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.staff = CustomUser.objects.create_user('staff', 'staff@example.com', 'secret-pass-1', is_staff=True)
+
+    def request(self, path, user):
+        request = RequestFactory().get(path)
+        request.user = user
+        return request
+
+    def test_token_binding(self):
+        token = profiling.make_token('/catalog/', self.staff)
+        self.assertTrue(profiling.check_token(token, self.request('/catalog/', self.staff)))
+        # Другой путь, другой сотрудник, покупатель, аноним, испорченная подпись
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'secret-pass-1', is_staff=True)
+        buyer = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1')
+        buyer.pk = self.staff.pk
+        for path, user, value in (
+            ('/orders/checkout/', self.staff, token),
+            ('/catalog/', other, token),
+            ('/catalog/', buyer, token),
+            ('/catalog/', AnonymousUser(), token),
+            ('/catalog/', self.staff, token[:-1]),
+            ('/catalog/', self.staff, 'garbage'),
+        ):
+            with self.subTest(path=path, user=user, value=value):
+                self.assertFalse(profiling.check_token(value, self.request(path, user)))
+        with override_settings(PROFILING_TOKEN_MAX_AGE=-1):
+            self.assertFalse(profiling.check_token(token, self.request('/catalog/', self.staff)))
+
+    def test_profiled_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.post('/admin/profiles/', {'path': 'catalog/'})
+        token = response.context['token']
+        self.assertEqual(response.context['path'], '/catalog/')
+
+        response = self.client.get('/catalog/', HTTP_X_PROFILE_TOKEN=token)
+        profile_id = response['X-Profile-Id']
+        [meta] = profiling.list_profiles()
+        self.assertEqual(
+            {key: meta[key] for key in ('id', 'path', 'view', 'status', 'user')},
+            {'id': profile_id, 'path': '/catalog/', 'view': 'catalog', 'status': 200, 'user': 'staff'},
+        )
+        response = self.client.get(f'/admin/profiles/{profile_id}/speedscope/')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['exporter'], 'flower_shop')
+        self.assertEqual(self.client.get(f'/admin/profiles/{profile_id}/other/').status_code, 404)
+        self.assertEqual(self.client.get('/admin/profiles/../speedscope/').status_code, 404)
+
+        # Токен для другого пути и токен без сессии сотрудника не действуют
+        self.assertNotIn('X-Profile-Id', self.client.get('/', {profiling.TOKEN_PARAM: token}))
+        self.client.logout()
+        self.assertNotIn('X-Profile-Id', self.client.get('/catalog/', {profiling.TOKEN_PARAM: token}))
+        self.assertEqual(len(profiling.list_profiles()), 1)
+
+    @override_settings(PROFILING_KEEP=2)
+    def test_keep_last_profiles(self):
+        self.client.force_login(self.staff)
+        token = profiling.make_token('/catalog/', self.staff)
+        ids = {self.client.get('/catalog/', HTTP_X_PROFILE_TOKEN=token)['X-Profile-Id'] for _ in range(3)}
+        kept = {meta['id'] for meta in profiling.list_profiles()}
+        self.assertEqual(len(kept), 2)
+        self.assertLess(kept, ids)
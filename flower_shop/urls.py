@@ -21,8 +21,15 @@ from django.conf.urls.static import static
 
 # Импортируем настройки кастомной админ-панели
 from . import admin as custom_admin
+from . import views
 
 urlpatterns = [
+    path('admin/profiles/', admin.site.admin_view(views.profile_list), name='admin_profiles'),
+    path(
+        'admin/profiles/<str:profile_id>/<str:fmt>/',
+        admin.site.admin_view(views.profile_download),
+        name='admin_profile_download',
+    ),
     path('admin/', admin.site.urls),
     path('', include('main.urls')),
     path('auth/', include('user_auth.urls')),
@@ -0,0 +1,36 @@
+"""
+Страницы профилей запросов для сотрудников (см. flower_shop/profiling.py)
+"""
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+
+from . import profiling
+
+
+def profile_list(request):
+    """Список сохраненных профилей и выдача токена для пути"""
+    path = request.POST.get('path', '').strip() if request.method == 'POST' else ''
+    token = None
+    if path:
+        if not path.startswith('/'):
+            path = '/' + path
+        token = profiling.make_token(path, request.user)
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Профили запросов',
+        'profiles': profiling.list_profiles(),
+        'path': path,
+        'token': token,
+        'token_param': profiling.TOKEN_PARAM,
+    }
+    return render(request, 'admin/profiles.html', context)
+
+
+def profile_download(request, profile_id, fmt):
+    """Файл профиля: collapsed или speedscope"""
+    name = {'speedscope': profiling.SPEEDSCOPE_NAME, 'collapsed': profiling.COLLAPSED_NAME}.get(fmt)
+    path = profiling.profile_file(profile_id, name) if name else None
+    if path is None:
+        raise Http404('Профиль не найден')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{profile_id}-{name}')
@@ -0,0 +1,42 @@
+from django.contrib import admin
+from django.utils import timezone
+from . import queue
+from .models import Job
+
+
+class TaskNameFilter(admin.SimpleListFilter):
+    """Фильтр по задаче: варианты берутся из зарегистрированных задач, а не
+    SELECT DISTINCT по всей очереди"""
+    title = 'Задача'
+    parameter_name = 'name'
+    
+    def lookups(self, request, model_admin):
+        return [(name, name) for name in queue.task_names()]
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(name=self.value())
+        return queryset
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at', 'finished_at']
+    list_filter = ['status', TaskNameFilter]
+    search_fields = ['name', 'idempotency_key']
+    readonly_fields = [
+        'name', 'payload', 'idempotency_key', 'attempts', 'locked_by', 'locked_until', 'last_error',
+        'created_at', 'finished_at',
+    ]
+    actions = ['retry_jobs']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_jobs(self, request, queryset):
+        """Повтор задач, завершившихся ошибкой"""
+        updated = queryset.filter(status='failed').update(
+            status='queued', attempts=0, run_at=timezone.now(), finished_at=None,
+        )
+        self.message_user(request, f'Поставлено в очередь повторно: {updated}')
+    retry_jobs.short_description = "Повторить задачи с ошибкой"
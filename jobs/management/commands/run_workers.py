@@ -0,0 +1,85 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from jobs import queue
+
+# Как часто главный процесс проверяет, живы ли воркеры, а воркер - флаг остановки (секунды)
+RESTART_CHECK_INTERVAL = 1
+STOP_POLL_INTERVAL = 0.1
+
+
+class StopFlag:
+    """Флаг остановки воркеров в общей памяти с интерфейсом Event (is_set, wait).
+
+    multiprocessing.Event держит внутренние семафоры: воркер, убитый внутри
+    wait(), оставляет их занятыми, и set() в главном процессе зависает.
+    """
+
+    def __init__(self):
+        self._value = multiprocessing.RawValue('b', 0)
+
+    def set(self):
+        self._value.value = 1
+
+    def is_set(self):
+        return bool(self._value.value)
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.is_set() and time.monotonic() < deadline:
+            time.sleep(min(STOP_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+        return self.is_set()
+
+
+def _worker(stop, batch_size, poll_interval):
+    # Сигналы остановки обрабатывает главный процесс: воркер доделывает текущую пачку
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    queue.work(stop, batch_size, poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры фоновых задач (jobs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Параллельных процессов')
+        parser.add_argument('--batch-size', type=int, default=10, help='Задач, забираемых за раз')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Пауза при пустой очереди, с')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        if options['once']:
+            processed = queue.run_pending(batch_size=batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {processed}'))
+            return
+
+        stop = StopFlag()
+
+        def start():
+            # Соединения с базой не должны достаться дочерним процессам
+            connections.close_all()
+            process = multiprocessing.Process(target=_worker, args=(stop, batch_size, options['poll_interval']))
+            process.start()
+            return process
+
+        processes = [start() for _ in range(max(options['workers'], 1))]
+        self.stdout.write(f'Воркеров: {len(processes)}; остановка - Ctrl+C или SIGTERM')
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        # Упавший воркер заменяется новым, чтобы пул не таял
+        while not stop.wait(RESTART_CHECK_INTERVAL):
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write(f'Воркер {process.pid} завершился с кодом {process.exitcode}, запускаем новый')
+                    processes[index] = start()
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Воркеры остановлены'))
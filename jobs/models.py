@@ -0,0 +1,37 @@
+from django.db import models
+
+
+class Job(models.Model):
+    """Фоновая задача (см. jobs/queue.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', verbose_name='Статус')
+    # Повторная постановка задачи с тем же ключом возвращает уже созданную
+    idempotency_key = models.CharField(max_length=200, null=True, blank=True, unique=True, verbose_name='Ключ идемпотентности')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(verbose_name='Выполнить не раньше')
+    # Задача в работе у воркера locked_by до locked_until, потом ее может забрать другой воркер
+    locked_by = models.CharField(max_length=64, blank=True, verbose_name='Воркер')
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Занята до')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+    
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.get_status_display()})"
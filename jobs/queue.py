@@ -0,0 +1,186 @@
+"""
+Очередь фоновых задач в базе данных.
+
+enqueue() добавляет строку Job в текущей транзакции: задача появляется в
+очереди только вместе с изменениями, которые ее породили, и не теряется,
+если процесс упадет сразу после коммита. Воркеры (команда run_workers)
+забирают задачи пачками: один UPDATE ставит метку воркера и срок аренды
+(JOBS_VISIBILITY_TIMEOUT). Задачу, не завершенную к этому сроку, забирает
+другой воркер, поэтому задача может выполниться больше одного раза и
+обработчики должны быть идемпотентными. Упавшая задача повторяется с
+экспоненциально растущей задержкой, после max_attempts попыток остается
+со статусом failed (повторить можно из админки).
+
+Обработчики регистрируются декоратором task() в модулях tasks.py
+приложений. При JOBS_EAGER задачи не попадают в таблицу, а выполняются
+сразу после коммита в том же процессе - для разработки без воркеров.
+"""
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name, max_attempts=None):
+    """Регистрирует обработчик задачи name; параметры задачи передаются ему именованными аргументами"""
+    def decorator(func):
+        _registry[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def task_names():
+    """Имена зарегистрированных задач"""
+    return sorted(_registry)
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """Ставит задачу в очередь в текущей транзакции.
+
+    Задача с ключом идемпотентности key ставится один раз: повторный вызов
+    с тем же ключом возвращает уже созданную задачу.
+    """
+    if name not in _registry:
+        raise LookupError(f'Неизвестная задача: {name}')
+    payload = payload or {}
+    if settings.JOBS_EAGER:
+        transaction.on_commit(lambda: _registry[name][0](**payload))
+        return None
+    job = Job(
+        name=name, payload=payload, idempotency_key=key,
+        max_attempts=max_attempts or _registry[name][1] or settings.JOBS_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if key is None:
+        job.save()
+        return job
+    # Повторная постановка с тем же ключом - частый случай: один SELECT вместо неудачной вставки
+    existing = Job.objects.filter(idempotency_key=key).first()
+    if existing is not None:
+        return existing
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=key)
+    return job
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim(worker, limit):
+    """Забирает до limit готовых задач: новые и повторные, срок которых
+    подошел, и задачи, аренда которых истекла"""
+    now = timezone.now()
+    until = now + timedelta(seconds=settings.JOBS_VISIBILITY_TIMEOUT)
+    ready = Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+    candidates = Job.objects.filter(ready).order_by('run_at', 'id').values('id')[:limit]
+    if connection.features.has_select_for_update_skip_locked:
+        # Воркеры не ждут друг друга на одних и тех же строках
+        candidates = candidates.select_for_update(skip_locked=True)
+    with transaction.atomic():
+        # Один UPDATE без предварительного чтения: в SQLite транзакция сразу
+        # берет блокировку записи, а не повышает ее после чтения (database is locked)
+        claimed = Job.objects.filter(ready, id__in=candidates).update(
+            status='running', locked_by=worker, locked_until=until, attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return []
+        return list(Job.objects.filter(status='running', locked_by=worker, locked_until=until).order_by('run_at', 'id'))
+
+
+def backoff(attempts):
+    """Задержка перед повторной попыткой (секунды): удваивается с каждой попыткой, со случайным разбросом"""
+    delay = min(settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOBS_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def _finish(job, worker, **fields):
+    """Записывает результат задачи. Если база недоступна (database is locked),
+    задача остается за воркером до конца аренды и выполнится еще раз"""
+    # Аренду могли перехватить, пока задача ждала в пачке: результат записывается только своей
+    try:
+        Job.objects.filter(id=job.id, status='running', locked_by=worker).update(**fields)
+    except DatabaseError:
+        logger.warning('Не удалось записать результат задачи %s #%s', job.name, job.id, exc_info=True)
+
+
+def execute(job, worker):
+    """Выполняет забранную задачу; True - если успешно"""
+    try:
+        func, _ = _registry[job.name]
+        func(**job.payload)
+    except Exception:
+        logger.exception('Задача %s #%s завершилась ошибкой (попытка %s)', job.name, job.id, job.attempts)
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            _finish(job, worker, status='failed', last_error=traceback.format_exc(), locked_until=None, finished_at=now)
+        else:
+            _finish(
+                job, worker, status='queued', last_error=traceback.format_exc(), locked_until=None,
+                run_at=now + timedelta(seconds=backoff(job.attempts)),
+            )
+        return False
+    _finish(job, worker, status='done', locked_until=None, finished_at=timezone.now())
+    return True
+
+
+def run_pending(worker=None, batch_size=10):
+    """Выполняет все готовые задачи; возвращает их число"""
+    worker = worker or worker_id()
+    processed = 0
+    while True:
+        jobs = claim(worker, batch_size)
+        if not jobs:
+            return processed
+        for job in jobs:
+            execute(job, worker)
+        processed += len(jobs)
+
+
+def purge_finished():
+    """Удаляет выполненные задачи старше JOBS_KEEP_DAYS дней"""
+    cutoff = timezone.now() - timedelta(days=settings.JOBS_KEEP_DAYS)
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def work(stop, batch_size=10, poll_interval=1.0):
+    """Цикл воркера: выполняет задачи, пока не выставлено событие stop"""
+    worker = worker_id()
+    purged_at = 0
+    while not stop.is_set():
+        try:
+            jobs = claim(worker, batch_size)
+        except DatabaseError:
+            logger.warning('Не удалось забрать задачи', exc_info=True)
+            jobs = []
+        for job in jobs:
+            execute(job, worker)
+        if jobs:
+            continue
+        if time.monotonic() - purged_at > 60 * 60:
+            try:
+                purge_finished()
+            except DatabaseError:
+                logger.warning('Не удалось удалить выполненные задачи', exc_info=True)
+            # Неудачная очистка повторится через час, а не на каждом круге
+            purged_at = time.monotonic()
+        stop.wait(poll_interval)
@@ -0,0 +1,91 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+calls = []
+
+
+@queue.task('tests.flaky', max_attempts=3)
+def flaky(fail=False):
+    calls.append(fail)
+    if fail:
+        raise RuntimeError('boom')
+
+
+@override_settings(JOBS_EAGER=False, JOBS_RETRY_BACKOFF=10, JOBS_RETRY_BACKOFF_MAX=30)
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def make_due(self):
+        Job.objects.update(run_at=timezone.now() - timedelta(seconds=1))
+
+    def test_backoff_doubles_up_to_max(self):
+        with mock.patch('random.uniform', return_value=1):
+            self.assertEqual([queue.backoff(attempts) for attempts in range(1, 5)], [10, 20, 30, 30])
+        for attempts in range(1, 5):
+            # Случайный разброс - от половины до полной задержки
+            self.assertTrue(5 <= queue.backoff(attempts) <= 30)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = queue.enqueue('tests.flaky', {'fail': True})
+        for attempt in range(1, 3):
+            started = timezone.now()
+            self.assertEqual(queue.run_pending(), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', attempt))
+            self.assertIn('RuntimeError: boom', job.last_error)
+            delay = min(10 * 2 ** (attempt - 1), 30)
+            self.assertGreaterEqual(job.run_at, started + timedelta(seconds=delay / 2))
+            self.assertLessEqual(job.run_at, timezone.now() + timedelta(seconds=delay))
+            # До срока повтора задача не выполняется
+            self.assertEqual(queue.run_pending(), 0)
+            self.make_due()
+
+        self.assertEqual(queue.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(queue.run_pending(), 0)
+        self.assertEqual(len(calls), 3)
+
+    def test_success(self):
+        job = queue.enqueue('tests.flaky')
+        self.assertEqual(queue.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ('done', 1, ''))
+
+    def test_idempotency_key(self):
+        first = queue.enqueue('tests.flaky', key='tests.flaky:1')
+        second = queue.enqueue('tests.flaky', key='tests.flaky:1')
+        self.assertEqual(first.id, second.id)
+        queue.run_pending()
+        self.assertEqual(calls, [False])
+        with self.assertRaises(LookupError):
+            queue.enqueue('tests.unknown')
+
+    def test_expired_lease_is_reclaimed(self):
+        queue.enqueue('tests.flaky')
+        [job] = queue.claim('worker-1', 10)
+        self.assertEqual(queue.claim('worker-2', 10), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        [reclaimed] = queue.claim('worker-2', 10)
+        # Результат воркера, потерявшего аренду, не записывается
+        queue.execute(job, 'worker-1')
+        self.assertEqual(Job.objects.get().status, 'running')
+        queue.execute(reclaimed, 'worker-2')
+        self.assertEqual(Job.objects.get().status, 'done')
+
+    def test_database_error_on_finish_keeps_job_leased(self):
+        queue.enqueue('tests.flaky')
+        [job] = queue.claim('worker-1', 10)
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=OperationalError('database is locked')):
+            self.assertTrue(queue.execute(job, 'worker-1'))
+        # Задача выполнится еще раз после конца аренды
+        self.assertEqual(Job.objects.get().status, 'running')
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.admin import actions
 from .models import Category, Product
+from . import search
 
 
 @admin.register(Category)
@@ -20,6 +21,18 @@ class ProductAdmin(admin.ModelAdmin):
     list_editable = ['price', 'stock_quantity', 'is_available']
     actions = [actions.delete_selected]
     
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем через общий полнотекстовый индекс вместо LIKE по каждому полю
+        if not search_term.strip():
+            return queryset, False
+        # Десять страниц самых релевантных товаров: все совпадения частого слова
+        # на большом каталоге дали бы огромный IN (...)
+        product_ids = search.search_products(search_term, limit=self.list_per_page * 10)
+        if product_ids:
+            return queryset.filter(id__in=product_ids), False
+        # Части слова (например, артикула) индекс не знает - обычный поиск по полям
+        return super().get_search_results(request, queryset, search_term)
+    
     def save_model(self, request, obj, form, change):
         # Валидация цены - не может быть отрицательной
         if obj.price < 0:
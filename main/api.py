@@ -0,0 +1,226 @@
+"""
+JSON API каталога (только чтение).
+
+    GET api/products/            товары с фильтрами и сортировками каталога
+    GET api/products/<id>/       один товар
+    GET api/products/bulk/?ids=  товары по списку id
+    GET api/categories/          категории с количеством товаров в наличии
+    GET api/stock/               остатки (все товары или ?ids=)
+
+Параметр fields ограничивает набор полей (fields=id,name,price). Список
+товаров без limit и остатки отдаются потоком: строки читаются из базы
+курсором по STREAM_CHUNK_SIZE и сразу пишутся в ответ, так что память не
+растет с размером каталога. С limit список разбит на страницы курсором,
+как в каталоге; ссылка на следующую страницу - в поле next.
+"""
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from . import facets
+from .models import Category, Product
+from .pagination import InvalidCursor
+from .views import CATALOG_DEFAULT_SORT, CATALOG_SORTS, catalog_paginator, catalog_products
+
+# Поле ответа -> поле запроса к базе
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'price': 'price',
+    'category': 'category_id',
+    'category_name': 'category__name',
+    'country': 'country',
+    'year': 'year',
+    'model': 'model',
+    'stock_quantity': 'stock_quantity',
+    'is_available': 'is_available',
+    'image': 'image',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at',
+}
+STOCK_FIELDS = ['id', 'stock_quantity', 'is_available']
+
+STREAM_CHUNK_SIZE = 2000
+# Строк в одном куске ответа: меньше системных вызовов на запись
+WRITE_BATCH = 200
+MAX_PAGE_SIZE = 500
+MAX_BULK_IDS = 500
+
+
+class ApiError(Exception):
+    """Некорректный запрос: текст уходит клиенту с кодом 400"""
+
+
+def _parse_fields(params, allowed):
+    raw = params.get('fields')
+    if not raw:
+        return list(allowed)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def _parse_ids(params):
+    try:
+        ids = [int(value) for value in params.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        raise ApiError('ids - список целых чисел через запятую')
+    if not ids:
+        raise ApiError('Не указан параметр ids')
+    if len(ids) > MAX_BULK_IDS:
+        raise ApiError(f'Не больше {MAX_BULK_IDS} id за запрос')
+    return ids
+
+
+def _convert(field, value):
+    if field == 'image':
+        return default_storage.url(value) if value else None
+    return value
+
+
+def _rows(queryset, fields):
+    """Словари с выбранными полями; модели не создаются"""
+    lookups = [PRODUCT_FIELDS[name] for name in fields]
+    for values in queryset.values_list(*lookups).iterator(chunk_size=STREAM_CHUNK_SIZE):
+        yield {name: _convert(name, value) for name, value in zip(fields, values)}
+
+
+def _row(product, fields):
+    """Словарь с выбранными полями для загруженного товара"""
+    row = {}
+    for name in fields:
+        value = product
+        for attr in PRODUCT_FIELDS[name].split('__'):
+            value = getattr(value, attr)
+        row[name] = _convert(name, value.name if name == 'image' else value)
+    return row
+
+
+def _stream(rows):
+    """Ответ {"results": [...]}, который пишется по мере чтения строк"""
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    def chunks():
+        yield '{"results": ['
+        batch = []
+        first = True
+        for row in rows:
+            batch.append(encoder.encode(row))
+            if len(batch) >= WRITE_BATCH:
+                yield ('' if first else ',') + ','.join(batch)
+                first, batch = False, []
+        if batch:
+            yield ('' if first else ',') + ','.join(batch)
+        yield ']}'
+
+    return StreamingHttpResponse(chunks(), content_type='application/json; charset=utf-8')
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def _error(message, status=400):
+    return _json({'error': message}, status=status)
+
+
+@require_GET
+def product_list(request):
+    """Товары каталога: те же фильтры (category, country, year, price, q) и сортировки (sort)"""
+    try:
+        fields = _parse_fields(request.GET, PRODUCT_FIELDS)
+        limit = request.GET.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ApiError('limit должен быть числом')
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ApiError(f'limit должен быть от 1 до {MAX_PAGE_SIZE}')
+    except ApiError as exc:
+        return _error(str(exc))
+
+    products, _, _, ranked_ids = catalog_products(request.GET)
+    sort_by = request.GET.get('sort')
+
+    if limit is None and ranked_ids is None:
+        # Полная выгрузка: курсор по базе в порядке сортировки, как в каталоге
+        ordering = CATALOG_SORTS.get(sort_by, CATALOG_DEFAULT_SORT)
+        pk_order = '-id' if ordering[-1].startswith('-') else 'id'
+        return _stream(_rows(products.order_by(*ordering, pk_order), fields))
+
+    paginator = catalog_paginator(products, ranked_ids, sort_by, per_page=limit or len(ranked_ids) or 1)
+    try:
+        page = paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return _error('Некорректный cursor')
+    return _json({
+        'results': [_row(product, fields) for product in page],
+        'next': page.next_cursor,
+        'previous': page.prev_cursor,
+    })
+
+
+@require_GET
+def product_detail(request, product_id):
+    """Один товар, в том числе отсутствующий в продаже"""
+    try:
+        fields = _parse_fields(request.GET, PRODUCT_FIELDS)
+    except ApiError as exc:
+        return _error(str(exc))
+    row = next(_rows(Product.objects.filter(id=product_id), fields), None)
+    if row is None:
+        return _error('Товар не найден', status=404)
+    return _json(row)
+
+
+@require_GET
+def product_bulk(request):
+    """Товары по списку id в порядке запроса; ненайденные id - в поле missing"""
+    try:
+        fields = _parse_fields(request.GET, PRODUCT_FIELDS)
+        ids = _parse_ids(request.GET)
+    except ApiError as exc:
+        return _error(str(exc))
+    lookup_fields = fields if 'id' in fields else ['id', *fields]
+    found = {row['id']: row for row in _rows(Product.objects.filter(id__in=ids), lookup_fields)}
+    results = []
+    for product_id in dict.fromkeys(ids):
+        row = found.get(product_id)
+        if row is not None:
+            results.append({name: row[name] for name in fields})
+    return _json({
+        'results': results,
+        'missing': [product_id for product_id in dict.fromkeys(ids) if product_id not in found],
+    })
+
+
+@require_GET
+def category_list(request):
+    """Категории с количеством товаров в наличии (по индексу фасетов)"""
+    counts = facets.get_index().counts({})['category']
+    return _json({'results': [
+        {
+            'id': category_id,
+            'name': name,
+            'description': description,
+            'product_count': counts.get(category_id, 0),
+        }
+        for category_id, name, description in Category.objects.values_list('id', 'name', 'description')
+    ]})
+
+
+@require_GET
+def stock(request):
+    """Остатки товаров: все потоком или только ?ids="""
+    queryset = Product.objects.order_by('id')
+    if 'ids' in request.GET:
+        try:
+            queryset = queryset.filter(id__in=_parse_ids(request.GET))
+        except ApiError as exc:
+            return _error(str(exc))
+    return _stream(_rows(queryset, STOCK_FIELDS))
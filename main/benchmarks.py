@@ -0,0 +1,193 @@
+"""
+Нагрузочные сценарии для команды run_benchmarks.
+
+Сценарии ходят по настоящему URLconf через django.test.Client - без сети,
+но со всеми middleware, шаблонами и запросами к базе. Каждый процесс пула
+выполняет сценарии своей копией клиента и возвращает замеры: имя точки,
+код ответа, время и число запросов к базе. Исключение в представлении
+превращается в ответ 500, исключение вне его - в замер с кодом 0; и то и
+другое считается ошибкой, а прогон продолжается. Итоги по точкам
+(перцентили, пропускная способность, запросы) сводит summarize().
+
+Сценарий purchase оформляет заказы, поэтому запускать его стоит на
+отдельной базе, например заполненной generate_load_data.
+"""
+import html
+import random
+import re
+import time
+
+import django
+from django.apps import apps
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+SCENARIOS = ('browse', 'purchase', 'admin')
+PERCENTILES = (50, 95, 99)
+# Ссылка "Вперед" в пагинации каталога
+NEXT_PAGE_LINK = re.compile(r'href="\?([^"]*cursor=[^"]*)"[^>]*>\s*Вперед')
+# Код замера, если запрос или сценарий завершился исключением, а не ответом
+EXCEPTION_STATUS = 0
+
+
+class Session:
+    """Клиент, замеряющий каждый запрос"""
+
+    def __init__(self, host, samples):
+        # Исключение в представлении дает ответ 500 вместо остановки прогона
+        self.client = Client(HTTP_HOST=host, raise_request_exception=False)
+        self.samples = samples
+
+    def request(self, name, method, path, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            try:
+                response = getattr(self.client, method)(path, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            except Exception:
+                self.samples.append((name, EXCEPTION_STATUS, time.perf_counter() - started, len(queries)))
+                raise
+            elapsed = time.perf_counter() - started
+        self.samples.append((name, response.status_code, elapsed, len(queries)))
+        return response
+
+    def get(self, name, path, **kwargs):
+        return self.request(name, 'get', path, **kwargs)
+
+    def post(self, name, path, data=None, **kwargs):
+        return self.request(name, 'post', path, data=data, **kwargs)
+
+
+def browse(session, rng, data):
+    """Анонимный посетитель: главная, каталог, фильтры, поиск, товар"""
+    session.get('home', reverse('home'))
+    catalog = reverse('catalog')
+    response = session.get('catalog', catalog)
+    next_link = NEXT_PAGE_LINK.search(response.content.decode())
+    if next_link:
+        session.get('catalog?cursor', f'{catalog}?{html.unescape(next_link.group(1))}')
+    if data['categories']:
+        session.get('catalog?category', f'{catalog}?category={rng.choice(data["categories"])}&sort=price')
+    session.get('catalog?q', f'{catalog}?q={rng.choice(data["queries"])}')
+    session.get('product_detail', reverse('product_detail', args=[rng.choice(data['products'])]))
+
+
+def purchase(session, rng, data):
+    """Покупатель: каталог, товар, корзина, оформление заказа, личный кабинет"""
+    session.client.force_login(data['users_by_id'][rng.choice(data['users'])])
+    session.get('home', reverse('home'))
+    session.get('catalog', reverse('catalog'))
+    for product_id in rng.sample(data['products'], min(2, len(data['products']))):
+        session.get('product_detail', reverse('product_detail', args=[product_id]))
+        session.post('add_to_cart', reverse('add_to_cart', args=[product_id]), {'quantity': 1})
+    session.get('cart', reverse('cart'))
+    session.get('checkout', reverse('checkout'))
+    session.post('checkout:post', reverse('checkout'), {'password': data['password']})
+    session.get('profile', reverse('profile'))
+    session.client.logout()
+
+
+def admin(session, rng, data):
+    """Сотрудник: списки товаров, заказов, пользователей и категорий в админке"""
+    session.client.force_login(data['staff'])
+    for name in ('main_product', 'orders_order', 'user_auth_customuser', 'main_category'):
+        session.get(f'admin:{name}', reverse(f'admin:{name}_changelist'))
+    session.get('admin:orders_order?status', reverse('admin:orders_order_changelist') + '?status__exact=new')
+    session.client.logout()
+
+
+def init_worker():
+    """Инициализация процесса пула, запущенного без fork"""
+    if not apps.ready:
+        django.setup()
+
+
+def run_worker(worker, scenarios, iterations, warmup, seed, host, data):
+    """Выполняет сценарии в процессе пула; возвращает список замеров"""
+    from django.contrib.auth import get_user_model
+    User = get_user_model()
+    data = dict(data)
+    data['users_by_id'] = User.objects.in_bulk(data['users'])
+    data['staff'] = User.objects.get(id=data['staff']) if data['staff'] else None
+
+    rng = random.Random(f'{seed}:{worker}')
+    samples = []
+    for iteration in range(warmup + iterations):
+        session = Session(host, samples if iteration >= warmup else [])
+        for name in scenarios:
+            recorded = len(session.samples)
+            try:
+                SCENARIO_FUNCTIONS[name](session, rng, data)
+            except Exception:
+                # Остаток сценария пропускается; сбой вне запроса записывается на сам сценарий
+                if all(status != EXCEPTION_STATUS for _, status, _, _ in session.samples[recorded:]):
+                    session.samples.append((f'scenario:{name}', EXCEPTION_STATUS, 0.0, 0))
+                session.client.logout()
+    connections.close_all()
+    return samples
+
+
+SCENARIO_FUNCTIONS = {
+    'browse': browse,
+    'purchase': purchase,
+    'admin': admin,
+}
+
+
+def percentile(values, p):
+    """Перцентиль p (0-100) отсортированного списка с интерполяцией"""
+    if not values:
+        return None
+    position = (len(values) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(samples, wall_time):
+    """Итоги по точкам: число запросов, ошибки, пропускная способность,
+    перцентили времени в миллисекундах, запросы к базе"""
+    by_endpoint = {}
+    for name, status, elapsed, queries in samples:
+        by_endpoint.setdefault(name, []).append((status, elapsed, queries))
+
+    def stats(rows):
+        latencies = sorted(elapsed * 1000 for _, elapsed, _ in rows)
+        queries = [count for _, _, count in rows]
+        result = {
+            'requests': len(rows),
+            'errors': sum(1 for status, _, _ in rows if status >= 400 or status == EXCEPTION_STATUS),
+            'throughput': round(len(rows) / wall_time, 2) if wall_time else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+        }
+        for p in PERCENTILES:
+            result[f'p{p}_ms'] = round(percentile(latencies, p), 2)
+        result['queries_mean'] = round(sum(queries) / len(queries), 2)
+        result['queries_max'] = max(queries)
+        return result
+
+    all_rows = [row for rows in by_endpoint.values() for row in rows]
+    return {
+        'endpoints': {name: stats(rows) for name, rows in sorted(by_endpoint.items())},
+        'total': stats(all_rows) if all_rows else {},
+    }
+
+
+def compare(current, baseline, threshold):
+    """Точки, где p95 или среднее число запросов выросли больше чем на
+    threshold процентов: список (точка, метрика, было, стало)"""
+    regressions = []
+    for name, stats in current['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old:
+            continue
+        for metric in ('p95_ms', 'queries_mean'):
+            before, after = old.get(metric), stats.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + threshold / 100) and after - before > (0.5 if metric == 'queries_mean' else 1):
+                regressions.append((name, metric, before, after))
+    return regressions
@@ -0,0 +1,38 @@
+"""
+Обновление производных данных после массовых изменений товаров.
+
+bulk_create(), bulk_update() и QuerySet.update() не вызывают сигналы, поэтому
+поисковый индекс, фасеты, похожие товары и кеш витрины (см. main/signals.py)
+после них нужно обновить явно - вызовом products_changed() после коммита.
+"""
+from . import cache, facets, recommendations, search
+
+# Начиная с этого числа товаров дешевле пересчитать все целиком
+FULL_REFRESH_THRESHOLD = 500
+
+
+def products_changed(product_ids=None):
+    """Обновляет производные данные для товаров product_ids (None - для всех)"""
+    if product_ids is None or len(product_ids) > FULL_REFRESH_THRESHOLD:
+        search.rebuild_index()
+        recommendations.rebuild_all()
+    else:
+        search.index_products(product_ids)
+        for product_id in product_ids:
+            recommendations.refresh_product(product_id)
+    facets.invalidate()
+    cache.bump_generation()
+
+
+def stock_changed(product_ids, availability_changed=()):
+    """Обновляет производные данные после изменения остатков: страницы витрины
+    показывают остаток, а товары, ушедшие из продажи или вернувшиеся в нее,
+    меняют фасеты и похожие товары"""
+    if availability_changed:
+        if len(availability_changed) > FULL_REFRESH_THRESHOLD:
+            recommendations.rebuild_all()
+        else:
+            for product_id in availability_changed:
+                recommendations.refresh_product(product_id)
+        facets.invalidate()
+    cache.bump_generation()
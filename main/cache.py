@@ -0,0 +1,82 @@
+"""
+Кеш данных витрины.
+
+Ключи содержат номер поколения каталога. Любое изменение товаров,
+категорий, слайдов или контактов увеличивает номер (см. main/signals.py),
+и все старые записи перестают читаться сами собой - удалять их по одной
+не нужно, они вытесняются по таймауту. Номер поколения входит и в ETag
+страниц витрины (см. main/conditional.py). Работает с любым бэкендом кеша
+Django; чтобы сброс был виден всем процессам, в продакшене нужен общий
+бэкенд (Redis, Memcached, база данных).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+GENERATION_KEY = 'catalog:generation'
+# Время последнего изменения каталога - для заголовка Last-Modified
+MODIFIED_KEY = 'catalog:modified'
+
+_MISSING = object()
+
+
+def _cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_generation():
+    """Текущее поколение каталога"""
+    cache = _cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # После вытеснения ключа начинаем с метки времени, а не с 1,
+        # чтобы не совпасть со старыми поколениями, еще лежащими в кеше
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Делает все закешированные данные каталога устаревшими"""
+    cache = _cache()
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+        generation = cache.incr(GENERATION_KEY)
+    cache.set(MODIFIED_KEY, time.time(), timeout=None)
+    return generation
+
+
+def get_modified():
+    """Время последнего изменения каталога (секунды с начала эпохи)
+
+    Если ключ вытеснен, отсчет начинается заново с текущего момента:
+    клиенты лишний раз получат полную страницу, но не устаревшую.
+    """
+    cache = _cache()
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        cache.add(MODIFIED_KEY, time.time(), timeout=None)
+        modified = cache.get(MODIFIED_KEY)
+    return modified
+
+
+def make_key(name, params=None):
+    """Ключ кеша для набора данных name с параметрами params"""
+    raw = repr(sorted((params or {}).items()))
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'catalog:{get_generation()}:{name}:{digest}'
+
+
+def cached(name, params, build, timeout=None):
+    """Возвращает данные из кеша или строит их вызовом build()"""
+    cache = _cache()
+    key = make_key(name, params)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = build()
+        cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
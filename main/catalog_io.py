@@ -0,0 +1,237 @@
+"""
+Импорт и экспорт каталога в CSV и JSON Lines.
+
+Одна строка файла - один товар с колонками COLUMNS; категория задается
+названием. Строки с id обновляют товар с этим id (или создают его), строки
+без id создают новые товары, так что выгрузка export_catalog загружается
+обратно import_catalog без изменений.
+
+Файл читается потоком, строки проверяются и записываются пачками: проверка -
+те же clean_fields() и Product.clean(), что и в админке, запись - один
+INSERT ... ON CONFLICT DO UPDATE на пачку в своей транзакции, так что
+блокировка записи SQLite не держится весь импорт, а ошибка базы отменяет
+только одну пачку. Сигналы при этом не вызываются, поэтому после импорта
+производные данные обновляются через main/bulk.py.
+"""
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, transaction
+
+from flower_shop import db
+from .models import Category, Product
+
+COLUMNS = ['id', 'name', 'description', 'price', 'category', 'country', 'year', 'model', 'stock_quantity', 'image']
+# Поля, которые импорт перезаписывает у существующих товаров
+UPDATE_FIELDS = [
+    'name', 'description', 'price', 'category', 'country', 'year', 'model',
+    'stock_quantity', 'is_available', 'image', 'updated_at',
+]
+FORMATS = ('csv', 'jsonl')
+
+
+class RowError(Exception):
+    """Строка файла не прошла проверку"""
+
+    def __init__(self, line, message):
+        super().__init__(f'строка {line}: {message}')
+        self.line = line
+
+
+def detect_format(path, fmt=None):
+    """Формат файла: явно заданный или по расширению"""
+    if fmt:
+        return fmt
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(file, fmt):
+    """Строки файла: пары (номер строки, словарь или RowError)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as exc:
+            yield line, RowError(line, f'некорректный JSON: {exc}')
+            continue
+        if not isinstance(row, dict):
+            yield line, RowError(line, 'ожидается объект JSON')
+            continue
+        yield line, row
+
+
+def _format_errors(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+class ProductImporter:
+    """Проверка и пакетная запись товаров из строк файла"""
+
+    def __init__(self, batch_size=1000, create_categories=True, dry_run=False):
+        self.batch_size = batch_size
+        self.create_categories = create_categories
+        self.dry_run = dry_run
+        self.categories = dict(Category.objects.values_list('name', 'id'))
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.product_ids = set()
+        self.explicit_ids = False
+
+    @property
+    def processed(self):
+        return self.created + self.updated
+
+    def _category_id(self, line, name):
+        name = (name or '').strip()
+        if not name:
+            raise RowError(line, 'category: не указана категория')
+        if name not in self.categories:
+            if not self.create_categories:
+                raise RowError(line, f'category: категория "{name}" не найдена')
+            category = Category(name=name)
+            try:
+                category.full_clean()
+            except ValidationError as exc:
+                raise RowError(line, f'category: {_format_errors(exc)}')
+            if not self.dry_run:
+                category.save()
+            self.categories[name] = category.id
+        return self.categories[name]
+
+    def _product_id(self, line, value):
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            return None
+        try:
+            # true и 1.5 из JSON int() принял бы молча
+            if isinstance(value, (bool, float)):
+                raise ValueError
+            product_id = int(value)
+        except (TypeError, ValueError):
+            raise RowError(line, f'id: "{value}" - не целое число')
+        if product_id <= 0:
+            raise RowError(line, f'id: {product_id} - ожидается положительное число')
+        return product_id
+
+    def build(self, line, row):
+        """Проверенный (не сохраненный) товар из строки файла"""
+        unknown = sorted(str(name) for name in row if name not in COLUMNS)
+        if unknown:
+            raise RowError(line, f'неизвестные колонки: {", ".join(unknown)}')
+        values = {
+            name: value.strip() if isinstance(value, str) else value
+            for name, value in row.items() if name not in ('id', 'category')
+        }
+        values['image'] = values.get('image') or ''
+        product = Product(**values)
+        product.id = self._product_id(line, row.get('id'))
+        product.category_id = self._category_id(line, row.get('category'))
+        try:
+            # Как в админке, но без запросов на строку: категория уже найдена,
+            # изображение необязательно (поставщики часто присылают товары без фото)
+            product.clean_fields(exclude=['category', 'image'])
+            product.clean()
+        except ValidationError as exc:
+            raise RowError(line, _format_errors(exc))
+        # То же, что делает Product.save()
+        product.is_available = product.stock_quantity > 0
+        return product
+
+    def write(self, batch):
+        """Записывает пачку проверенных товаров (пары номер строки, товар) в отдельной транзакции"""
+        # Повторы id внутри пачки: побеждает последняя строка
+        with_id = list({product.id: product for _, product in batch if product.id is not None}.values())
+        without_id = [product for _, product in batch if product.id is None]
+        try:
+            with transaction.atomic():
+                if not self.dry_run:
+                    db.begin_write()
+                existing = set(
+                    Product.objects.filter(id__in=[product.id for product in with_id]).values_list('id', flat=True)
+                )
+                if not self.dry_run:
+                    if with_id:
+                        Product.objects.bulk_create(
+                            with_id, update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS,
+                        )
+                    if without_id:
+                        Product.objects.bulk_create(without_id)
+        except DatabaseError as exc:
+            first, last = batch[0][0], batch[-1][0]
+            self.errors.append(RowError(first, f'строки {first}-{last} не записаны: {exc}'))
+            return
+        self.created += len(with_id) - len(existing) + len(without_id)
+        self.updated += len(existing)
+        if self.dry_run:
+            return
+        self.explicit_ids |= bool(with_id)
+        for product in (*with_id, *without_id):
+            if product.id is None:
+                # База не вернула id новых строк - обновлять придется все целиком
+                self.product_ids = None
+                break
+            if self.product_ids is not None:
+                self.product_ids.add(product.id)
+
+    def run(self, rows, progress=None):
+        """Импортирует строки из read_rows(); progress(importer) - после каждой пачки"""
+        batch = []
+        for line, row in rows:
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append((line, self.build(line, row)))
+            except RowError as exc:
+                self.errors.append(exc)
+                continue
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                if progress:
+                    progress(self)
+        if batch:
+            self.write(batch)
+            if progress:
+                progress(self)
+
+    def finish(self):
+        """Сдвигает последовательность id после вставки строк с явными id"""
+        if self.explicit_ids and not self.dry_run:
+            statements = connection.ops.sequence_reset_sql(no_style(), [Product])
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+
+def export_products(file, fmt, queryset=None, chunk_size=2000):
+    """Пишет товары в файл потоком; возвращает число строк"""
+    queryset = Product.objects.all() if queryset is None else queryset
+    lookups = ['category__name' if name == 'category' else name for name in COLUMNS]
+    rows = queryset.order_by('id').values_list(*lookups).iterator(chunk_size=chunk_size)
+
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for values in rows:
+            writer.writerow(values)
+            count += 1
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        for values in rows:
+            file.write(encoder.encode(dict(zip(COLUMNS, values))) + '\n')
+            count += 1
+    return count
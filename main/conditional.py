@@ -0,0 +1,76 @@
+"""
+Условные GET-запросы для страниц витрины.
+
+Страница зависит от данных каталога и от того, кто ее смотрит (шапка с
+именем пользователя, ссылка на админку). Поэтому ETag строится из
+поколения кеша каталога (см. main/cache.py) и данных пользователя из
+шапки, а Last-Modified - из времени последнего изменения каталога и
+отдается только анонимам: для вошедшего пользователя время изменения
+каталога ничего не говорит о его шапке.
+
+Если в запросе есть непоказанные сообщения (django.contrib.messages),
+валидаторы не вычисляются и страница всегда отдается целиком - иначе
+сообщение потерялось бы в ответе 304.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import cache
+
+
+def _has_pending_messages(request):
+    # len() не помечает сообщения прочитанными, в отличие от перебора
+    return bool(len(get_messages(request)))
+
+
+def _user_key(user):
+    if not user.is_authenticated:
+        return 'anonymous'
+    return f'{user.pk}:{user.username}:{user.get_full_name()}:{user.is_staff}'
+
+
+def page_etag(request, *args, **kwargs):
+    """Слабый ETag страницы витрины или None"""
+    if _has_pending_messages(request):
+        return None
+    raw = '|'.join([
+        settings.PAGE_ETAG_VERSION,
+        str(cache.get_generation()),
+        request.get_full_path(),
+        _user_key(request.user),
+    ])
+    return 'W/"%s"' % hashlib.md5(raw.encode()).hexdigest()
+
+
+def page_last_modified(request, *args, **kwargs):
+    """Время изменения страницы для анонимов или None"""
+    if request.user.is_authenticated or _has_pending_messages(request):
+        return None
+    return datetime.fromtimestamp(cache.get_modified(), tz=timezone.utc)
+
+
+def conditional_page(view):
+    """Отвечает 304 на повторный запрос неизмененной страницы витрины"""
+    conditional_view = condition(etag_func=page_etag, last_modified_func=page_last_modified)(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # Проверяем до вызова view: при выводе сообщения будут прочитаны
+        personal = request.user.is_authenticated or _has_pending_messages(request)
+        response = conditional_view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            # Страница зависит от сессии, поэтому общий кеш может хранить
+            # только анонимную версию; перед показом - всегда проверка
+            patch_vary_headers(response, ['Cookie'])
+            if personal:
+                patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+            else:
+                patch_cache_control(response, public=True, max_age=0, must_revalidate=True)
+        return response
+    return wrapper
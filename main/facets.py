@@ -0,0 +1,262 @@
+"""
+Фасетная навигация по каталогу.
+
+Для каждого значения фасета (категория, страна, год, ценовой диапазон)
+хранится битовая маска товаров в наличии: бит с номером id товара
+установлен, если товар подходит. Количество товаров для любого сочетания
+фильтров считается пересечением масок в памяти, без GROUP BY в базе.
+
+Маски обновляются сигналами Product (см. main/signals.py), а раз в
+FACET_INDEX_TTL секунд индекс перестраивается целиком - так подхватываются
+изменения из других процессов и массовые update(). Перестройка идет в
+фоновом потоке: пока она не закончилась, запросы получают прежний индекс,
+а изменения из сигналов за это время переносятся в новый.
+"""
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(mask):
+        return bin(mask).count('1')
+
+
+# Ценовые диапазоны: ключ -> (от, до, подпись); верхняя граница не включается
+PRICE_BUCKETS = {
+    '0-1000': (None, Decimal('1000'), 'до 1 000 ₽'),
+    '1000-2000': (Decimal('1000'), Decimal('2000'), '1 000 – 2 000 ₽'),
+    '2000-5000': (Decimal('2000'), Decimal('5000'), '2 000 – 5 000 ₽'),
+    '5000-': (Decimal('5000'), None, 'от 5 000 ₽'),
+}
+
+# Фасеты в порядке вывода: параметр запроса -> заголовок
+FACETS = {
+    'category': 'Категории',
+    'country': 'Страна',
+    'year': 'Год выпуска',
+    'price': 'Цена',
+}
+
+
+def price_bucket(price):
+    """Ключ ценового диапазона для цены"""
+    for key, (low, high, _) in PRICE_BUCKETS.items():
+        if (low is None or price >= low) and (high is None or price < high):
+            return key
+    return None
+
+
+def product_facets(category_id, country, year, price):
+    """Значения фасетов товара"""
+    return {
+        'category': category_id,
+        'country': country,
+        'year': year,
+        'price': price_bucket(price),
+    }
+
+
+def selected_facets(params):
+    """Выбранные значения фасетов из GET-параметров; некорректные пропускаются"""
+    selected = {}
+    for name in ('category', 'year'):
+        value = params.get(name)
+        if value:
+            try:
+                selected[name] = int(value)
+            except ValueError:
+                pass
+    if params.get('country'):
+        selected['country'] = params['country']
+    if params.get('price') in PRICE_BUCKETS:
+        selected['price'] = params['price']
+    return selected
+
+
+def filter_products(queryset, selected):
+    """Применяет выбранные фасеты к queryset товаров"""
+    if 'category' in selected:
+        queryset = queryset.filter(category_id=selected['category'])
+    if 'country' in selected:
+        queryset = queryset.filter(country=selected['country'])
+    if 'year' in selected:
+        queryset = queryset.filter(year=selected['year'])
+    if 'price' in selected:
+        low, high, _ = PRICE_BUCKETS[selected['price']]
+        if low is not None:
+            queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    return queryset
+
+
+class FacetIndex:
+    """Битовые маски товаров в наличии по значениям фасетов"""
+
+    def __init__(self):
+        self.masks = {name: {} for name in FACETS}
+        self.values = {}  # id товара -> значения фасетов
+        self.all = 0
+        self.built_at = time.monotonic()
+
+    def add(self, product_id, values):
+        """Добавляет товар в наличии (или обновляет его значения)"""
+        self.remove(product_id)
+        bit = 1 << product_id
+        for name, value in values.items():
+            if value is not None:
+                masks = self.masks[name]
+                masks[value] = masks.get(value, 0) | bit
+        self.values[product_id] = values
+        self.all |= bit
+
+    def remove(self, product_id):
+        """Убирает товар из индекса"""
+        values = self.values.pop(product_id, None)
+        if values is None:
+            return
+        bit = 1 << product_id
+        for name, value in values.items():
+            masks = self.masks[name]
+            if value in masks:
+                masks[value] &= ~bit
+                if not masks[value]:
+                    del masks[value]
+        self.all &= ~bit
+
+    def _mask(self, selected, exclude=None, restrict_ids=None):
+        mask = self.all
+        for name, value in selected.items():
+            if name != exclude:
+                mask &= self.masks[name].get(value, 0)
+        if restrict_ids is not None:
+            restrict = 0
+            for product_id in restrict_ids:
+                restrict |= 1 << product_id
+            mask &= restrict
+        return mask
+
+    def counts(self, selected, restrict_ids=None):
+        """Количество товаров по каждому значению каждого фасета
+
+        Для фасета учитываются выбранные значения всех остальных фасетов,
+        поэтому внутри одного фасета можно переключаться между значениями.
+        """
+        restrict = self._mask({}, restrict_ids=restrict_ids) if restrict_ids is not None else self.all
+        result = {}
+        for name in FACETS:
+            base = self._mask(selected, exclude=name) & restrict
+            result[name] = {
+                value: _popcount(base & mask)
+                for value, mask in self.masks[name].items()
+            }
+        return result
+
+    def count(self, selected, restrict_ids=None):
+        """Количество товаров, подходящих под все выбранные фасеты"""
+        return _popcount(self._mask(selected, restrict_ids=restrict_ids))
+
+
+_lock = threading.Lock()
+_index = None
+# Изменения из сигналов во время фоновой перестройки: [(id товара, значения или None)];
+# None - перестройка не идет
+_pending = None
+# Растет при invalidate(): результат перестройки, начатой раньше, отбрасывается
+_generation = 0
+
+
+def build_index():
+    """Строит индекс по товарам в наличии"""
+    from .models import Product
+
+    index = FacetIndex()
+    rows = Product.objects.filter(is_available=True).values_list(
+        'id', 'category_id', 'country', 'year', 'price'
+    )
+    for product_id, category_id, country, year, price in rows.iterator(chunk_size=5000):
+        index.add(product_id, product_facets(category_id, country, year, price))
+    return index
+
+
+def _refresh(generation):
+    """Перестраивает индекс в фоновом потоке и подменяет им прежний"""
+    global _index, _pending
+    try:
+        index = build_index()
+    except Exception:
+        logger.exception('Не удалось перестроить индекс фасетов')
+        index = None
+    finally:
+        connection.close()
+    with _lock:
+        if index is not None and generation == _generation:
+            for product_id, values in _pending:
+                if values is None:
+                    index.remove(product_id)
+                else:
+                    index.add(product_id, values)
+            _index = index
+        elif index is None and _index is not None:
+            # Следующая попытка - через FACET_INDEX_TTL, а не на каждом запросе
+            _index.built_at = time.monotonic()
+        _pending = None
+
+
+def get_index():
+    """Индекс фасетов этого процесса.
+
+    Первый раз индекс строится сразу. Индекс старше FACET_INDEX_TTL секунд
+    перестраивается в фоне, а запрос получает прежний.
+    """
+    global _index, _pending
+    with _lock:
+        if _index is None:
+            _index = build_index()
+        elif _pending is None and time.monotonic() - _index.built_at > settings.FACET_INDEX_TTL:
+            _pending = []
+            threading.Thread(target=_refresh, args=(_generation,), name='facet-index', daemon=True).start()
+        return _index
+
+
+def invalidate():
+    """Сбрасывает индекс; он будет перестроен при следующем обращении"""
+    global _index, _generation
+    with _lock:
+        _index = None
+        _generation += 1
+
+
+def _apply(product_id, values):
+    # Вызывается под _lock
+    if _index is None:
+        return
+    if values is None:
+        _index.remove(product_id)
+    else:
+        _index.add(product_id, values)
+    if _pending is not None:
+        _pending.append((product_id, values))
+
+
+def update_product(product):
+    """Обновляет маски после изменения наличия, цены, категории и т.п."""
+    values = None
+    if product.is_available:
+        values = product_facets(product.category_id, product.country, product.year, product.price)
+    with _lock:
+        _apply(product.id, values)
+
+
+def remove_product(product_id):
+    """Убирает удаленный товар из масок"""
+    with _lock:
+        _apply(product_id, None)
@@ -0,0 +1,248 @@
+"""
+Производные изображения товаров и слайдов.
+
+Для загруженного изображения строятся уменьшенные копии фиксированных
+ширин (IMAGE_WIDTHS) в исходном формате (JPEG или PNG для картинок с
+прозрачностью) и в WebP, а если Pillow собран с AVIF - еще и в AVIF.
+
+Копии лежат на диске в IMAGE_DERIVATIVES_ROOT в каталоге, имя которого -
+SHA-1 содержимого исходного файла, рядом с manifest.json. Одинаковые
+файлы обрабатываются один раз, а замена файла дает новый каталог, так что
+копии можно отдавать с долгим сроком кеширования. Имя исходного файла
+связано с каталогом указателем в names/, его проверяют по размеру и
+времени изменения файла.
+
+Копии строятся сигналами Product и SliderImage после сохранения, для уже
+загруженных файлов - командой generate_image_derivatives.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+# Ширины уменьшенных копий; шире исходного изображения копии не строятся
+IMAGE_WIDTHS = (160, 320, 640, 960, 1600)
+# Меняется при изменении параметров обработки, чтобы копии перестроились
+PIPELINE_VERSION = 1
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+AVIF_QUALITY = 60
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+
+Image.init()
+HAS_AVIF = 'AVIF' in Image.SAVE
+
+
+def _root():
+    return str(settings.IMAGE_DERIVATIVES_ROOT)
+
+
+def _name_pointer(root, name):
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(root, 'names', digest[:2], digest + '.json')
+
+
+def _content_dir(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _file_digest(path):
+    sha = hashlib.sha1(f'v{PIPELINE_VERSION}:'.encode())
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _write_json(path, data):
+    """Атомарная запись JSON: читатели не видят недописанный файл"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_variant(image, path, fmt):
+    if fmt == 'jpeg':
+        image.convert('RGB').save(path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif fmt == 'png':
+        image.save(path, 'PNG', optimize=True)
+    elif fmt == 'webp':
+        image.save(path, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif fmt == 'avif':
+        image.save(path, 'AVIF', quality=AVIF_QUALITY)
+
+
+def render_derivatives(source_path, target_dir):
+    """Строит копии изображения в target_dir и возвращает манифест"""
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    formats = (['avif'] if HAS_AVIF else []) + ['webp', 'png' if has_alpha else 'jpeg']
+
+    width, height = image.size
+    widths = [w for w in IMAGE_WIDTHS if w < width] + [width]
+    variants = {fmt: [] for fmt in formats}
+    for target_width in widths:
+        target_height = max(round(height * target_width / width), 1)
+        resized = image if target_width == width else image.resize(
+            (target_width, target_height), Image.Resampling.LANCZOS
+        )
+        for fmt in formats:
+            filename = f'{target_width}.{EXTENSIONS[fmt]}'
+            _save_variant(resized, os.path.join(target_dir, filename), fmt)
+            variants[fmt].append([target_width, target_height, filename])
+    return {'width': width, 'height': height, 'formats': formats, 'variants': variants}
+
+
+def generate(name, source_path, root=None, force=False):
+    """Строит копии файла name, если их еще нет; возвращает манифест
+
+    Не обращается к ORM и подходит для запуска в пуле процессов.
+    """
+    root = root or _root()
+    pointer_path = _name_pointer(root, name)
+    stamp = _stamp(source_path)
+    pointer = _read_json(pointer_path)
+    if not force and pointer and pointer['stamp'] == stamp:
+        manifest = _read_json(os.path.join(_content_dir(root, pointer['digest']), 'manifest.json'))
+        if manifest is not None:
+            return manifest
+
+    digest = _file_digest(source_path)
+    target_dir = _content_dir(root, digest)
+    manifest_path = os.path.join(target_dir, 'manifest.json')
+    manifest = None if force else _read_json(manifest_path)
+    if manifest is None:
+        # Строим во временном каталоге и переносим целиком: параллельный
+        # процесс либо не видит каталог, либо видит его готовым
+        os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+        work_dir = tempfile.mkdtemp(dir=os.path.dirname(target_dir), prefix='.tmp-')
+        try:
+            manifest = render_derivatives(source_path, work_dir)
+            manifest['digest'] = digest
+            _write_json(os.path.join(work_dir, 'manifest.json'), manifest)
+            if force:
+                shutil.rmtree(target_dir, ignore_errors=True)
+            try:
+                os.rename(work_dir, target_dir)
+            except OSError:
+                # Каталог уже построен другим процессом
+                manifest = _read_json(manifest_path) or manifest
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    _write_json(pointer_path, {'name': name, 'stamp': stamp, 'digest': digest})
+    return manifest
+
+
+def _source_path(field_file):
+    try:
+        return field_file.path
+    except NotImplementedError:
+        # Хранилище не на локальном диске
+        return None
+
+
+def generate_for(field_file, force=False):
+    """Строит копии для значения ImageField; None, если файла нет"""
+    if not field_file:
+        return None
+    path = _source_path(field_file)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        manifest = generate(field_file.name, path, force=force)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # Файл не читается Pillow - страницы покажут исходное изображение
+        return None
+    with _lookup_lock:
+        _lookup_cache.pop(field_file.name, None)
+    return manifest
+
+
+_lookup_lock = threading.Lock()
+_lookup_cache = {}  # имя файла -> (отметка файла, манифест)
+
+
+def get_manifest(field_file):
+    """Манифест готовых копий для значения ImageField или None
+
+    Копии при этом не строятся: страница не должна ждать Pillow.
+    """
+    if not field_file:
+        return None
+    path = _source_path(field_file)
+    if path is None:
+        return None
+    try:
+        stamp = _stamp(path)
+    except OSError:
+        return None
+
+    name = field_file.name
+    with _lookup_lock:
+        cached = _lookup_cache.get(name)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    root = _root()
+    pointer = _read_json(_name_pointer(root, name))
+    manifest = None
+    if pointer and pointer['stamp'] == stamp:
+        manifest = _read_json(os.path.join(_content_dir(root, pointer['digest']), 'manifest.json'))
+    if manifest is not None:
+        # Отсутствие копий не запоминаем: их может построить другой процесс
+        with _lookup_lock:
+            _lookup_cache[name] = (stamp, manifest)
+    return manifest
+
+
+def variant_url(manifest, filename):
+    digest = manifest['digest']
+    return f'{settings.IMAGE_DERIVATIVES_URL}{digest[:2]}/{digest}/{filename}'
+
+
+def srcset(manifest, fmt):
+    """Значение атрибута srcset для формата fmt"""
+    return ', '.join(
+        f'{variant_url(manifest, filename)} {width}w'
+        for width, _, filename in manifest['variants'].get(fmt, [])
+    )
+
+
+def closest_variant(manifest, width, fmt=None):
+    """Копия не уже width (или самая широкая): (url, ширина, высота)"""
+    fmt = fmt or manifest['formats'][-1]
+    variants = manifest['variants'][fmt]
+    chosen = next((v for v in variants if v[0] >= width), variants[-1])
+    return variant_url(manifest, chosen[2]), chosen[0], chosen[1]
@@ -0,0 +1,170 @@
+"""
+Генерация синтетических данных для нагрузочного тестирования.
+
+Функции *_rows строят строки таблиц кусками (chunk) и не обращаются к базе,
+поэтому их можно выполнять в пуле процессов. Случайные числа каждого куска
+берутся из собственного генератора, заданного (seed, таблица, номер куска),
+так что результат не зависит от числа процессов и порядка их работы.
+
+Популярность товаров и активность покупателей распределены по закону Ципфа:
+несколько товаров покупают очень часто, большинство - редко.
+"""
+import bisect
+import itertools
+import random
+from decimal import Decimal
+
+FIRST_NAMES = {
+    'm': ['Александр', 'Дмитрий', 'Максим', 'Сергей', 'Андрей', 'Алексей', 'Артём', 'Илья', 'Кирилл',
+          'Михаил', 'Никита', 'Матвей', 'Роман', 'Егор', 'Арсений', 'Иван', 'Денис', 'Евгений',
+          'Тимофей', 'Владимир', 'Павел', 'Глеб', 'Фёдор', 'Степан', 'Лев'],
+    'f': ['Анастасия', 'Мария', 'Анна', 'Виктория', 'Екатерина', 'Наталья', 'Марина', 'Полина',
+          'София', 'Дарья', 'Алиса', 'Ксения', 'Александра', 'Елена', 'Ольга', 'Татьяна', 'Юлия',
+          'Ирина', 'Светлана', 'Вера', 'Ева', 'Варвара', 'Людмила', 'Галина', 'Алёна'],
+}
+# Фамилии в мужской форме; женская образуется окончанием -а
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов',
+              'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров',
+              'Павлов', 'Козлов', 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин',
+              'Захаров', 'Зайцев', 'Соловьёв', 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьёв']
+# Основы отчеств: + "ович"/"овна", после "е" - + "вич"/"вна"
+PATRONYMIC_STEMS = ['Александр', 'Иван', 'Сергее', 'Петр', 'Михайл', 'Андрее', 'Владимир',
+                    'Николае', 'Павл', 'Дмитрие', 'Алексее', 'Роман', 'Максим', 'Евгенье']
+
+FLOWERS = ['Розы', 'Тюльпаны', 'Лилии', 'Хризантемы', 'Герберы', 'Пионы', 'Орхидеи', 'Гортензии',
+           'Ромашки', 'Ирисы', 'Гвоздики', 'Альстромерии', 'Эустомы', 'Каллы', 'Подсолнухи',
+           'Фрезии', 'Ранункулюсы', 'Анемоны', 'Сирень', 'Лаванда']
+ADJECTIVES = ['Нежный', 'Яркий', 'Весенний', 'Летний', 'Осенний', 'Зимний', 'Праздничный',
+              'Классический', 'Романтичный', 'Солнечный', 'Пышный', 'Свадебный', 'Изящный', 'Душистый']
+COLORS = ['алых', 'белых', 'розовых', 'жёлтых', 'кремовых', 'сиреневых', 'красных', 'оранжевых',
+          'бордовых', 'персиковых']
+NOUNS = ['букет', 'композиция', 'корзина', 'букет-комплимент', 'моно-букет']
+DESCRIPTIONS = [
+    'Свежие цветы с доставкой в день заказа.',
+    'Собран флористом вручную, упакован в крафт-бумагу.',
+    'Подходит для дня рождения, юбилея и просто так.',
+    'Стойкие цветы, простоят не меньше недели.',
+    'Дополнен сезонной зеленью и атласной лентой.',
+]
+COUNTRIES = [('Россия', 30), ('Эквадор', 20), ('Нидерланды', 20), ('Колумбия', 10), ('Кения', 10),
+             ('Израиль', 5), ('Китай', 5)]
+ORDER_STATUSES = [('confirmed', 70), ('new', 20), ('cancelled', 10)]
+CANCELLATION_REASONS = ['Нет нужного количества товара', 'Покупатель отказался от заказа',
+                        'Не удалось связаться с покупателем']
+
+DAY = 24 * 60 * 60
+
+
+def category_names(count):
+    """Названия категорий: сначала цветы, затем с номером серии"""
+    names = []
+    for i in range(count):
+        base = FLOWERS[i % len(FLOWERS)]
+        names.append(base if i < len(FLOWERS) else f'{base} {i // len(FLOWERS) + 1}')
+    return names
+
+
+def zipf_cum_weights(count, exponent):
+    """Накопленные веса распределения Ципфа для рангов 1..count"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def _rng(seed, table, chunk):
+    return random.Random(f'{seed}:{table}:{chunk}')
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def _joined_at(seed, user_id, end, days):
+    """Дата регистрации покупателя; одна и та же во всех кусках"""
+    return end - days * DAY * random.Random(f'{seed}:joined:{user_id}').random()
+
+
+def user_rows(seed, chunk, first_id, count, password, end, days):
+    """Строки пользователей: (id, username, email, фамилия, имя, отчество, пароль, дата регистрации)"""
+    rng = _rng(seed, 'users', chunk)
+    rows = []
+    for user_id in range(first_id, first_id + count):
+        gender = rng.choice('mf')
+        last_name = rng.choice(LAST_NAMES) + ('а' if gender == 'f' else '')
+        stem = rng.choice(PATRONYMIC_STEMS)
+        male, female = ('вич', 'вна') if stem.endswith('е') else ('ович', 'овна')
+        patronymic = stem + (male if gender == 'm' else female)
+        rows.append((
+            user_id, f'load-{user_id}', f'load-{user_id}@example.com',
+            last_name, rng.choice(FIRST_NAMES[gender]), patronymic, password,
+            _joined_at(seed, user_id, end, days),
+        ))
+    return rows
+
+
+def product_rows(seed, chunk, first_id, count, category_ids, end, days):
+    """Строки товаров: (id, название, описание, цена, категория, страна, год, модель, остаток, дата)"""
+    rng = _rng(seed, 'products', chunk)
+    rows = []
+    for product_id in range(first_id, first_id + count):
+        flowers = rng.randint(3, 101)
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} из {flowers} {rng.choice(COLORS)} цветов'
+        # Цены - логнормальное распределение с медианой около 3000 рублей
+        price = Decimal(max(round(rng.lognormvariate(8, 0.6), -1), 100)).quantize(Decimal('0.01'))
+        stock = 0 if rng.random() < 0.15 else rng.randint(1, 200)
+        rows.append((
+            product_id, name, ' '.join(rng.sample(DESCRIPTIONS, 2)), price,
+            rng.choice(category_ids), _weighted(rng, COUNTRIES), rng.randint(2015, 2025),
+            f'FL-{product_id:07d}', stock, end - days * DAY * rng.random(),
+        ))
+    return rows
+
+
+class OrderGenerator:
+    """Заказы и корзины; веса Ципфа строятся один раз на процесс"""
+
+    def __init__(self, seed, user_ids, product_ids, prices, end, days):
+        self.seed = seed
+        self.end = end
+        self.days = days
+        # Ранги перемешаны: самый популярный товар - не обязательно первый по id
+        ranking = random.Random(f'{seed}:ranking')
+        self.products = list(zip(product_ids, prices))
+        ranking.shuffle(self.products)
+        self.users = list(user_ids)
+        ranking.shuffle(self.users)
+        self.product_weights = zipf_cum_weights(len(self.products), 1.1)
+        self.user_weights = zipf_cum_weights(len(self.users), 0.8)
+
+    def _pick(self, rng, population, cum_weights, k=1):
+        total, last = cum_weights[-1], len(population) - 1
+        return [population[min(bisect.bisect(cum_weights, rng.random() * total), last)] for _ in range(k)]
+
+    def order_rows(self, chunk, first_id, count):
+        """Заказы (id, пользователь, статус, причина отмены, дата) и позиции
+        (заказ, товар, количество, цена)"""
+        rng = _rng(self.seed, 'orders', chunk)
+        orders, items = [], []
+        for order_id in range(first_id, first_id + count):
+            user_id = self._pick(rng, self.users, self.user_weights)[0]
+            joined = _joined_at(self.seed, user_id, self.end, self.days)
+            status = _weighted(rng, ORDER_STATUSES)
+            reason = rng.choice(CANCELLATION_REASONS) if status == 'cancelled' else ''
+            orders.append((order_id, user_id, status, reason, joined + (self.end - joined) * rng.random()))
+            # Позиций в заказе: 1-6, чаще одна-две
+            size = min(int(rng.expovariate(0.7)) + 1, 6)
+            picked = {}
+            for product_id, price in self._pick(rng, self.products, self.product_weights, size):
+                picked[product_id] = price
+            for product_id, price in picked.items():
+                items.append((order_id, product_id, rng.choice((1, 1, 1, 2, 3)), price))
+        return orders, items
+
+    def cart_rows(self, chunk, user_ids):
+        """Корзины: (пользователь, товар, количество)"""
+        rng = _rng(self.seed, 'carts', chunk)
+        rows = []
+        for user_id in user_ids:
+            picked = self._pick(rng, self.products, self.product_weights, rng.randint(1, 4))
+            products = {product_id for product_id, _ in picked}
+            rows.extend((user_id, product_id, rng.randint(1, 3)) for product_id in sorted(products))
+        return rows
@@ -0,0 +1,197 @@
+import re
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from main.models import Product, Category
+
+User = get_user_model()
+
+# Справочники из нескольких строк: полный просмотр для них нормален
+SMALL_TABLES = {'main_category', 'main_sliderimage', 'main_contact'}
+# Таблица не больше чем из SMALL_TABLE_ROWS строк читается целиком при любом плане (а список
+# админки с такой таблицей - вовсе без LIMIT); на базе из таких таблиц проверка ничего не
+# скажет о больших, поэтому запускать ее нужно на данных generate_load_data
+SMALL_TABLE_ROWS = 100
+_PK_ORDER_LIMIT = re.compile(r'ORDER BY "\w+"\."id"(?: ASC| DESC)? LIMIT \d+$')
+# Кеш витрины на время проверки: с настоящим кешем второй проход не выполнил бы
+# запросов каталога, и проверять было бы нечего
+NO_CACHE_ALIAS = 'check_query_plans'
+# Списки админки, которые проверяются под суперпользователем
+ADMIN_CHANGELISTS = [
+    'main_product', 'main_category', 'orders_order', 'orders_archivedorder', 'orders_stockmovement', 'jobs_job',
+]
+
+
+def _full_scans(sql):
+    """Таблицы, которые запрос читает полным просмотром"""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            # Обход по первичному ключу без условий с LIMIT (списки админки: ORDER BY id DESC LIMIT 100)
+            # читает только LIMIT строк, хотя план и называет его SCAN
+            if ' WHERE ' not in sql and _PK_ORDER_LIMIT.search(sql):
+                return []
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            details = [row[-1] for row in cursor.fetchall()]
+            # "SCAN t" - полный просмотр, "SCAN t USING INDEX" - обход индекса
+            return [
+                m.group(1) for m in (re.match(r'SCAN (\w+)(?: AS \w+)?$', d) for d in details) if m
+            ]
+        if vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            return re.findall(r'Seq Scan on (\w+)', plan)
+        if vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [col[0] for col in cursor.description]
+            return [
+                row[columns.index('table')] for row in cursor.fetchall()
+                if row[columns.index('type')] == 'ALL'
+            ]
+    raise CommandError(f'EXPLAIN для базы {vendor} не поддерживается')
+
+
+def _is_small(table):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT 1 FROM {connection.ops.quote_name(table)} LIMIT 1 OFFSET {SMALL_TABLE_ROWS}')
+        return cursor.fetchone() is None
+
+
+class Command(BaseCommand):
+    help = 'Проверяет планы запросов страниц витрины: падает, если есть полный просмотр таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Пользователь для страниц, требующих авторизации')
+        parser.add_argument('--host', default='localhost', help='Значение заголовка Host')
+        parser.add_argument(
+            '--allow-table', action='append', default=[],
+            help='Таблица, для которой полный просмотр допустим (можно указать несколько раз)',
+        )
+
+    def get_urls(self):
+        urls = [
+            ('home', reverse('home')),
+            ('catalog', reverse('catalog')),
+            ('contacts', reverse('contacts')),
+        ]
+        for sort in ('year', 'name', 'price'):
+            urls.append((f'catalog?sort={sort}', f"{reverse('catalog')}?sort={sort}"))
+        category = Category.objects.first()
+        if category:
+            urls.append(('catalog?category', f"{reverse('catalog')}?category={category.id}"))
+        product = Product.objects.filter(is_available=True).first()
+        if product:
+            urls.append(('product_detail', reverse('product_detail', args=[product.id])))
+        return urls
+
+    def get_api_urls(self):
+        # Полные выгрузки (api/products/ без limit, api/stock/ без ids) читают всю таблицу намеренно
+        urls = [
+            ('api_product_list', f"{reverse('api_product_list')}?limit=50"),
+            ('api_product_list?sort=price', f"{reverse('api_product_list')}?limit=50&sort=price"),
+            ('api_category_list', reverse('api_category_list')),
+        ]
+        ids = ','.join(str(product_id) for product_id in Product.objects.order_by('-id').values_list('id', flat=True)[:5])
+        if ids:
+            urls += [
+                ('api_product_detail', reverse('api_product_detail', args=[ids.split(',')[0]])),
+                ('api_product_bulk', f"{reverse('api_product_bulk')}?ids={ids}"),
+                ('api_stock?ids', f"{reverse('api_stock')}?ids={ids}"),
+            ]
+        return urls
+
+    def get_admin_urls(self):
+        urls = [(f'admin:{name}', reverse(f'admin:{name}_changelist')) for name in ADMIN_CHANGELISTS]
+        urls.append(('admin:orders_order?status', f"{reverse('admin:orders_order_changelist')}?status__exact=new"))
+        return urls
+
+    def get_user_urls(self):
+        return [
+            ('cart', reverse('cart')),
+            ('checkout', reverse('checkout')),
+            ('profile', reverse('profile')),
+        ]
+
+    def fetch(self, client, url):
+        response = client.get(url)
+        if response.status_code >= 400:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        # Потоковый ответ выполняет запросы при чтении
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {username} не найден')
+        return User.objects.filter(order__isnull=False).first() or User.objects.first()
+
+    def handle(self, *args, **options):
+        caches = {**settings.CACHES, NO_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=caches, CATALOG_CACHE_ALIAS=NO_CACHE_ALIAS):
+            self.check_plans(options)
+
+    def check_plans(self, options):
+        allowed = SMALL_TABLES | set(options['allow_table'])
+        client = Client(HTTP_HOST=options['host'])
+        pages = [(client, name, url) for name, url in self.get_urls() + self.get_api_urls()]
+
+        user = self.get_user(options['username'])
+        if user:
+            client.force_login(user)
+            pages += [(client, name, url) for name, url in self.get_user_urls()]
+        else:
+            self.stdout.write(self.style.WARNING('Нет пользователей: страницы с авторизацией пропущены'))
+
+        admin = User.objects.filter(is_superuser=True, is_active=True).first()
+        if admin:
+            admin_client = Client(HTTP_HOST=options['host'])
+            admin_client.force_login(admin)
+            pages += [(admin_client, name, url) for name, url in self.get_admin_urls()]
+        else:
+            self.stdout.write(self.style.WARNING('Нет суперпользователя: списки админки пропущены'))
+
+        # Следующие страницы каталога: запросы с условием курсора
+        response = client.get(reverse('catalog'))
+        next_query = response.context and response.context.get('next_query')
+        if next_query:
+            pages.append((client, 'catalog?cursor', f"{reverse('catalog')}?{next_query}"))
+
+        failures, small = 0, set()
+        for page_client, name, url in pages:
+            # Первый проход прогревает индексы в памяти, проверяется второй
+            self.fetch(page_client, url)
+            with CaptureQueriesContext(connection) as captured:
+                self.fetch(page_client, url)
+
+            seen = set()
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT') or sql in seen:
+                    continue
+                seen.add(sql)
+                scans = [table for table in _full_scans(sql) if table not in allowed]
+                small.update(table for table in scans if _is_small(table))
+                scans = [table for table in scans if table not in small]
+                if scans:
+                    failures += 1
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: полный просмотр {", ".join(scans)}\n    {sql}'
+                    ))
+            self.stdout.write(f'{name}: проверено запросов {len(seen)}')
+
+        if small:
+            self.stdout.write(self.style.WARNING(
+                f'Полный просмотр не проверен для таблиц меньше {SMALL_TABLE_ROWS} строк: {", ".join(sorted(small))}'
+            ))
+        if failures:
+            raise CommandError(f'Запросов с полным просмотром таблиц: {failures}')
+        self.stdout.write(self.style.SUCCESS('Полных просмотров таблиц не найдено'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product', type=int, action='append', default=[],
+            help='Пересчитать только указанный товар и его соседей (можно указать несколько раз)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['product']:
+            for product_id in options['product']:
+                recommendations.refresh_product(product_id)
+            count = len(options['product'])
+        else:
+            count = recommendations.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие товары пересчитаны для {count} товаров за {time.monotonic() - started:.1f} с'
+        ))
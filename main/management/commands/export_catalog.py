@@ -0,0 +1,39 @@
+import contextlib
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from main import catalog_io
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Выгружает товары в CSV или JSON Lines (формат import_catalog)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для выгрузки; "-" - стандартный вывод')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--available', action='store_true', help='Только товары в наличии')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = catalog_io.detect_format(path, options['format'])
+        queryset = Product.objects.all()
+        if options['available']:
+            queryset = queryset.filter(is_available=True)
+
+        started = time.monotonic()
+        try:
+            # Стандартный вывод команда не открывала - и не закрывает
+            stream = contextlib.nullcontext(sys.stdout) if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(f'Не удалось открыть файл: {exc}')
+        with stream as file:
+            count = catalog_io.export_products(file, fmt, queryset)
+        elapsed = time.monotonic() - started
+
+        # При выводе в stdout итог пишем в stderr, чтобы не испортить выгрузку
+        out = self.stderr if path == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f'Выгружено товаров: {count} за {elapsed:.1f} с ({count / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
@@ -0,0 +1,65 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from main import images
+from main.models import Product, SliderImage
+
+
+def _generate(name, path, root, force):
+    try:
+        images.generate(name, path, root=root, force=force)
+    except Exception as exc:  # битый файл не должен останавливать остальные
+        return name, f'{type(exc).__name__}: {exc}'
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии и WebP для уже загруженных изображений товаров и слайдов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов (по умолчанию - число ядер)',
+        )
+        parser.add_argument('--force', action='store_true', help='Перестроить уже готовые копии')
+
+    def get_files(self):
+        """Имена и пути исходных файлов без повторов"""
+        names = set()
+        for model in (Product, SliderImage):
+            names.update(model.objects.exclude(image='').values_list('image', flat=True).iterator())
+        files = []
+        for name in sorted(names):
+            try:
+                path = default_storage.path(name)
+            except NotImplementedError:
+                path = None
+            if path is None or not os.path.exists(path):
+                self.stdout.write(self.style.WARNING(f'Файл не найден: {name}'))
+                continue
+            files.append((name, path))
+        return files
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        files = self.get_files()
+        root = str(settings.IMAGE_DERIVATIVES_ROOT)
+        errors = 0
+        with ProcessPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+            futures = [
+                pool.submit(_generate, name, path, root, options['force'])
+                for name, path in files
+            ]
+            for future in as_completed(futures):
+                name, error = future.result()
+                if error:
+                    errors += 1
+                    self.stdout.write(self.style.ERROR(f'{name}: {error}'))
+
+        elapsed = time.monotonic() - started
+        message = f'Обработано файлов: {len(files) - errors} из {len(files)} за {elapsed:.1f} с'
+        self.stdout.write(self.style.SUCCESS(message) if not errors else self.style.WARNING(message))
@@ -0,0 +1,257 @@
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from main import bulk, loadgen
+from main.models import Category, Product
+from orders import analytics, inventory
+from orders.models import Cart, Order, OrderItem
+
+User = get_user_model()
+
+_generator = None
+
+
+def _init_order_worker(*args):
+    global _generator
+    _generator = loadgen.OrderGenerator(*args)
+
+
+def _order_chunk(chunk, first_id, count):
+    return _generator.order_rows(chunk, first_id, count)
+
+
+def _cart_chunk(chunk, user_ids):
+    return _generator.cart_rows(chunk, user_ids)
+
+
+def _ordered(pool, fn, tasks, window):
+    """Результаты задач по порядку; одновременно в работе не больше window
+    задач, чтобы готовые куски не копились в памяти, пока идет запись"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    """Отключает auto_now/auto_now_add, чтобы сохранить даты из генератора"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Создает пользователей, товары, заказы и корзины для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Число покупателей')
+        parser.add_argument('--products', type=int, default=5000, help='Число товаров')
+        parser.add_argument('--orders', type=int, default=20000, help='Число заказов')
+        parser.add_argument('--categories', type=int, default=20, help='Число категорий')
+        parser.add_argument('--carts', type=float, default=0.1, help='Доля покупателей с непустой корзиной')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней распределить заказы')
+        parser.add_argument(
+            '--end-date', help='Последний день периода, ГГГГ-ММ-ДД (по умолчанию - сегодня); '
+                               'при одинаковых seed и дате данные совпадают',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов для генерации строк')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк в одном куске и одном INSERT')
+        parser.add_argument('--password', default='loadtest', help='Пароль всех созданных покупателей')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не перестраивать поисковый индекс и похожие товары после загрузки',
+        )
+
+    def report(self, name, count, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{name}: {count} за {elapsed:.1f} с ({count / max(elapsed, 1e-6):.0f} строк/с)')
+
+    def chunks(self, total, first_id):
+        size = self.batch_size
+        return [
+            (chunk, first_id + start, min(size, total - start))
+            for chunk, start in enumerate(range(0, total, size))
+        ]
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['products'], options['categories']) < 1 and options['orders']:
+            raise CommandError('Для заказов нужны покупатели, товары и категории')
+        if options['end_date']:
+            try:
+                end_day = datetime.strptime(options['end_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+            except ValueError:
+                raise CommandError('--end-date в формате ГГГГ-ММ-ДД')
+            self.end = end_day.timestamp() + loadgen.DAY
+        else:
+            self.end = float(int(time.time()))
+        self.seed = options['seed']
+        self.days = options['days']
+        self.batch_size = max(options['batch_size'], 1)
+        workers = max(options['workers'], 1)
+        started = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            category_ids = self.create_categories(options['categories'])
+            product_ids, prices = self.create_products(pool, workers, options['products'], category_ids)
+            user_ids = self.create_users(pool, workers, options['users'], options['password'])
+
+        if (options['orders'] or options['carts']) and len(user_ids) and len(product_ids):
+            # Пул с готовыми весами Ципфа в каждом процессе
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_order_worker,
+                initargs=(self.seed, user_ids, product_ids, prices, self.end, self.days),
+            ) as pool:
+                self.create_orders(pool, workers, options['orders'])
+                self.create_carts(pool, workers, user_ids, options['carts'])
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Product, User, Order]):
+                cursor.execute(sql)
+
+        if not options['skip_derived']:
+            derived_started = time.monotonic()
+            bulk.products_changed()
+            self.report('Поисковый индекс, фасеты и похожие товары', len(product_ids), derived_started)
+
+        self.stdout.write(self.style.SUCCESS(f'Готово за {time.monotonic() - started:.1f} с'))
+
+    def create_categories(self, count):
+        names = loadgen.category_names(count)
+        existing = dict(Category.objects.filter(name__in=names).values_list('name', 'id'))
+        Category.objects.bulk_create([
+            Category(name=name, description=f'{name} для нагрузочного тестирования')
+            for name in names if name not in existing
+        ])
+        ids = dict(Category.objects.filter(name__in=names).values_list('name', 'id'))
+        return [ids[name] for name in names]
+
+    def create_products(self, pool, workers, total, category_ids):
+        started = time.monotonic()
+        first_id = _next_id(Product)
+        tasks = [
+            (self.seed, chunk, start, count, category_ids, self.end, self.days)
+            for chunk, start, count in self.chunks(total, first_id)
+        ]
+        prices = []
+        with _explicit_timestamps(Product), transaction.atomic():
+            for rows in _ordered(pool, loadgen.product_rows, tasks, workers * 2):
+                products = []
+                for product_id, name, description, price, category_id, country, year, model, stock, created in rows:
+                    created = _datetime(created)
+                    products.append(Product(
+                        id=product_id, name=name, description=description, price=price,
+                        category_id=category_id, country=country, year=year, model=model,
+                        stock_quantity=stock, is_available=stock > 0, image='',
+                        created_at=created, updated_at=created,
+                    ))
+                    prices.append(price)
+                Product.objects.bulk_create(products)
+        self.report('Товары', total, started)
+        ledger_started = time.monotonic()
+        inventory.record_untracked_changes(range(first_id, first_id + total))
+        self.report('Начальные остатки на складе', total, ledger_started)
+        return range(first_id, first_id + total), prices
+
+    def create_users(self, pool, workers, total, password):
+        started = time.monotonic()
+        first_id = _next_id(User)
+        # Хеш считается один раз: PBKDF2 на каждого пользователя занял бы часы
+        password_hash = make_password(password)
+        tasks = [
+            (self.seed, chunk, start, count, password_hash, self.end, self.days)
+            for chunk, start, count in self.chunks(total, first_id)
+        ]
+        with transaction.atomic():
+            for rows in _ordered(pool, loadgen.user_rows, tasks, workers * 2):
+                User.objects.bulk_create([
+                    User(
+                        id=user_id, username=username, email=email, last_name=last_name,
+                        first_name=first_name, patronymic=patronymic, password=password,
+                        date_joined=_datetime(joined),
+                    )
+                    for user_id, username, email, last_name, first_name, patronymic, password, joined in rows
+                ])
+        self.report('Покупатели', total, started)
+        return range(first_id, first_id + total)
+
+    def create_orders(self, pool, workers, total):
+        started = time.monotonic()
+        first_id = _next_id(Order)
+        item_count = 0
+        with _explicit_timestamps(Order), transaction.atomic():
+            for orders, items in _ordered(pool, _order_chunk, self.chunks(total, first_id), workers * 2):
+                # Итоги считаются здесь: bulk_create() позиций не вызывает сигналы
+                totals = {}
+                for order_id, _, quantity, price in items:
+                    total_price, total_quantity, order_items = totals.get(order_id, (0, 0, 0))
+                    totals[order_id] = (total_price + quantity * price, total_quantity + quantity, order_items + 1)
+                Order.objects.bulk_create([
+                    Order(
+                        id=order_id, user_id=user_id, status=status, cancellation_reason=reason,
+                        created_at=_datetime(created), updated_at=_datetime(created),
+                        total_price=totals[order_id][0], total_quantity=totals[order_id][1],
+                        item_count=totals[order_id][2], stock_deducted=status == 'confirmed',
+                    )
+                    for order_id, user_id, status, reason, created in orders
+                ])
+                OrderItem.objects.bulk_create([
+                    OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, price=price)
+                    for order_id, product_id, quantity, price in items
+                ], batch_size=self.batch_size)
+                item_count += len(items)
+        self.report('Заказы', total, started)
+        self.report('Позиции заказов', item_count, started)
+        events_started = time.monotonic()
+        # Сводки продаж досчитает задача orders.aggregate_sales или команда aggregate_sales
+        analytics.record_history(range(first_id, first_id + total))
+        self.report('События заказов', total, events_started)
+
+    def create_carts(self, pool, workers, user_ids, share):
+        started = time.monotonic()
+        rng = random.Random(f'{self.seed}:cart-users')
+        users = sorted(rng.sample(user_ids, int(len(user_ids) * min(max(share, 0), 1))))
+        size = self.batch_size
+        tasks = [(chunk, users[start:start + size]) for chunk, start in enumerate(range(0, len(users), size))]
+        count = 0
+        with _explicit_timestamps(Cart), transaction.atomic():
+            now = _datetime(self.end)
+            for rows in _ordered(pool, _cart_chunk, tasks, workers * 2):
+                Cart.objects.bulk_create([
+                    Cart(user_id=user_id, product_id=product_id, quantity=quantity, created_at=now, updated_at=now)
+                    for user_id, product_id, quantity in rows
+                ], batch_size=self.batch_size)
+                count += len(rows)
+        self.report('Позиции корзин', count, started)
@@ -0,0 +1,68 @@
+import contextlib
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from main import bulk, catalog_io
+from orders import inventory
+
+
+class Command(BaseCommand):
+    help = 'Загружает товары из CSV или JSON Lines (обновление по id, создание новых)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для загрузки; "-" - стандартный ввод')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Строк в одном запросе к базе')
+        parser.add_argument(
+            '--no-create-categories', action='store_true',
+            help='Не создавать отсутствующие категории, а считать такие строки ошибочными',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывая')
+        parser.add_argument(
+            '--max-errors', type=int, default=20, help='Сколько ошибочных строк вывести подробно',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = catalog_io.detect_format(path, options['format'])
+        importer = catalog_io.ProductImporter(
+            batch_size=options['batch_size'],
+            create_categories=not options['no_create_categories'],
+            dry_run=options['dry_run'],
+        )
+        started = time.monotonic()
+
+        def progress(importer):
+            if options['verbosity'] > 1:
+                rate = importer.processed / max(time.monotonic() - started, 1e-6)
+                self.stdout.write(f'Обработано строк: {importer.processed} ({rate:.0f} строк/с)')
+
+        try:
+            # Стандартный ввод команда не открывала - и не закрывает
+            stream = contextlib.nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(f'Не удалось открыть файл: {exc}')
+        # Каждая пачка записывается в своей транзакции (см. ProductImporter.write)
+        with stream as file:
+            importer.run(catalog_io.read_rows(file, fmt), progress=progress)
+            importer.finish()
+        elapsed = time.monotonic() - started
+
+        for error in importer.errors[:options['max_errors']]:
+            self.stdout.write(self.style.ERROR(str(error)))
+        if len(importer.errors) > options['max_errors']:
+            self.stdout.write(self.style.ERROR(f'... и еще {len(importer.errors) - options["max_errors"]}'))
+
+        if not options['dry_run'] and importer.processed:
+            # Остатки записаны в обход save(): в журнал склада они попадают корректировками
+            inventory.record_untracked_changes(importer.product_ids)
+            bulk.products_changed(importer.product_ids)
+
+        rate = importer.processed / max(elapsed, 1e-6)
+        message = (
+            f'{"Проверено" if options["dry_run"] else "Загружено"} товаров: {importer.processed} '
+            f'(новых {importer.created}, обновлено {importer.updated}), '
+            f'ошибок: {len(importer.errors)}, {elapsed:.1f} с, {rate:.0f} строк/с'
+        )
+        self.stdout.write(self.style.WARNING(message) if importer.errors else self.style.SUCCESS(message))
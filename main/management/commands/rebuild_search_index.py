@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main import search
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс товаров или догоняет изменения, прошедшие мимо сигналов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--catch-up', action='store_true',
+            help='Только догнать изменения товаров, прошедшие мимо сигналов (сверкой текста всех товаров с индексом)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['catch_up']:
+            indexed = search.catch_up_index()
+        else:
+            indexed = len(search.rebuild_index())
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано товаров: {indexed} за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,142 @@
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from main import benchmarks
+from main.models import Category, Product
+
+User = get_user_model()
+
+# Поисковые запросы сценария browse: точные, с окончаниями и с опечатками
+QUERIES = ['розы', 'букет', 'тюльпан', 'белых роз', 'нежный букет', 'пионы', 'хризантема', 'букит']
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочные сценарии по страницам магазина: время ответа, пропускная способность, запросы к базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', choices=benchmarks.SCENARIOS,
+            help='Сценарий (можно указать несколько раз; по умолчанию - все)',
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Параллельных процессов')
+        parser.add_argument('--iterations', type=int, default=10, help='Повторов сценариев на процесс')
+        parser.add_argument('--warmup', type=int, default=1, help='Повторов без замеров перед началом')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--host', default='localhost', help='Значение заголовка Host')
+        parser.add_argument('--password', default='loadtest', help='Пароль покупателей для оформления заказа')
+        parser.add_argument('--users', type=int, default=200, help='Сколько покупателей задействовать')
+        parser.add_argument('--output', help='Файл для результатов в JSON ("-" - стандартный вывод)')
+        parser.add_argument('--baseline', help='JSON предыдущего запуска для сравнения')
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Допустимый рост p95 и числа запросов к базе относительно baseline, %%',
+        )
+
+    def get_data(self, scenarios, options):
+        products = list(
+            Product.objects.filter(is_available=True).order_by('?').values_list('id', flat=True)[:1000]
+        )
+        if not products:
+            raise CommandError('Нет товаров в наличии: заполните базу (generate_load_data)')
+        users = list(
+            User.objects.filter(is_staff=False, is_active=True).order_by('id').values_list('id', flat=True)[:options['users']]
+        )
+        staff = User.objects.filter(is_staff=True, is_active=True).order_by('id').values_list('id', flat=True).first()
+        if 'purchase' in scenarios and not users:
+            raise CommandError('Для сценария purchase нужны покупатели')
+        if 'admin' in scenarios and not staff:
+            self.stdout.write(self.style.WARNING('Нет сотрудников: сценарий admin пропущен'))
+            scenarios.remove('admin')
+        return {
+            'products': products,
+            'categories': list(Category.objects.values_list('id', flat=True)),
+            'queries': QUERIES,
+            'users': users,
+            'staff': staff,
+            'password': options['password'],
+        }
+
+    def print_table(self, result):
+        header = f'{"точка":<28}{"запросов":>9}{"ошибок":>8}{"в сек":>8}{"p50 мс":>9}{"p95 мс":>9}{"p99 мс":>9}{"к базе":>8}'
+        self.stdout.write(header)
+        rows = list(result['endpoints'].items()) + [('ИТОГО', result['total'])]
+        for name, stats in rows:
+            self.stdout.write(
+                f'{name:<28}{stats["requests"]:>9}{stats["errors"]:>8}{stats["throughput"]:>8.1f}'
+                f'{stats["p50_ms"]:>9.1f}{stats["p95_ms"]:>9.1f}{stats["p99_ms"]:>9.1f}{stats["queries_mean"]:>8.1f}'
+            )
+
+    def handle(self, *args, **options):
+        scenarios = list(dict.fromkeys(options['scenario'] or benchmarks.SCENARIOS))
+        workers = max(options['workers'], 1)
+        data = self.get_data(scenarios, options)
+        if not scenarios:
+            raise CommandError('Нечего запускать')
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Не удалось прочитать baseline: {exc}')
+
+        # Процессы пула открывают собственные соединения с базой
+        connections.close_all()
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers, initializer=benchmarks.init_worker) as pool:
+            futures = [
+                pool.submit(
+                    benchmarks.run_worker, worker, scenarios, options['iterations'],
+                    options['warmup'], options['seed'], options['host'], data,
+                )
+                for worker in range(workers)
+            ]
+            samples = []
+            for worker, future in enumerate(futures):
+                # Упавший процесс не отменяет замеры остальных
+                try:
+                    samples.extend(future.result())
+                except Exception as exc:
+                    self.stderr.write(f'Процесс {worker} завершился с ошибкой: {exc!r}')
+        wall_time = time.monotonic() - started
+        if not samples:
+            raise CommandError('Нет ни одного замера')
+
+        result = benchmarks.summarize(samples, wall_time)
+        result['meta'] = {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'scenarios': scenarios,
+            'workers': workers,
+            'iterations': options['iterations'],
+            'wall_time_s': round(wall_time, 2),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+        }
+        self.print_table(result)
+
+        if options['output']:
+            text = json.dumps(result, ensure_ascii=False, indent=2)
+            if options['output'] == '-':
+                sys.stdout.write(text + '\n')
+            else:
+                with open(options['output'], 'w') as file:
+                    file.write(text + '\n')
+
+        if baseline is not None:
+            regressions = benchmarks.compare(result, baseline, options['threshold'])
+            for name, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(f'{name}: {metric} {before} -> {after}'))
+            if regressions:
+                raise CommandError(f'Ухудшений относительно baseline: {len(regressions)}')
+            self.stdout.write(self.style.SUCCESS('Ухудшений относительно baseline нет'))
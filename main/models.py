@@ -55,6 +55,20 @@ class Product(models.Model):
         if self.stock_quantity < 0:
             raise ValidationError({'stock_quantity': 'Количество на складе не может быть отрицательным'})
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем значения из базы, чтобы после сохранения понять, что изменилось
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def fields_changed(self, *names):
+        """Изменилось ли хотя бы одно из полей с момента загрузки из базы"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(loaded.get(name) != getattr(self, name) for name in names)
+    
     def save(self, *args, **kwargs):
         """Автоматическое обновление статуса наличия"""
         # Обновляем статус наличия в зависимости от количества
@@ -65,11 +79,49 @@ class Product(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['-created_at']
+        indexes = [
+            # Витрина всегда фильтрует по наличию и сортирует по одному из полей;
+            # id в конце - для курсорной пагинации
+            models.Index(fields=['is_available', 'created_at', 'id'], name='product_avail_created_idx'),
+            models.Index(fields=['is_available', 'name', 'id'], name='product_avail_name_idx'),
+            models.Index(fields=['is_available', 'price', 'id'], name='product_avail_price_idx'),
+            models.Index(fields=['is_available', 'year', 'id'], name='product_avail_year_idx'),
+            # Похожие товары и фильтр по категории
+            models.Index(fields=['category', 'is_available', 'created_at'], name='product_cat_avail_idx'),
+            # Догоняющее обновление поискового индекса
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            # Соседи по цене для расчета похожих товаров
+            models.Index(fields=['category', 'price'], name='product_cat_price_idx'),
+            models.Index(fields=['country', 'price'], name='product_country_price_idx'),
+        ]
     
     def __str__(self):
         return self.name
 
 
+class SimilarProduct(models.Model):
+    """Предрасчитанные похожие товары (см. main/recommendations.py)"""
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='similar_links', verbose_name='Товар'
+    )
+    similar = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='recommended_for', verbose_name='Похожий товар'
+    )
+    rank = models.PositiveSmallIntegerField(verbose_name='Позиция')
+    score = models.FloatField(verbose_name='Оценка')
+    
+    class Meta:
+        verbose_name = 'Похожий товар'
+        verbose_name_plural = 'Похожие товары'
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='similar_product_rank_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} -> {self.similar_id}"
+
+
 class SliderImage(models.Model):
     """Модель для слайдера на главной странице"""
     title = models.CharField(max_length=200, verbose_name='Заголовок')
@@ -0,0 +1,155 @@
+"""
+Курсорная (keyset) пагинация.
+
+Вместо OFFSET страница выбирается условием "строго после последней
+показанной строки" по ключу сортировки, поэтому стоимость запроса не
+зависит от глубины страницы. К сортировке всегда добавляется первичный
+ключ, чтобы порядок был однозначным и курсоры оставались стабильными.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """Курсор не удалось разобрать"""
+
+
+class KeysetPage:
+    """Страница результатов с курсорами соседних страниц"""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Пагинатор по ключу сортировки"""
+
+    def __init__(self, queryset, ordering, per_page=12):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = self._normalize_ordering(queryset.model, ordering)
+
+    @staticmethod
+    def _normalize_ordering(model, ordering):
+        """Возвращает список пар (поле, по убыванию) с первичным ключом в конце"""
+        pk = model._meta.pk
+        keys = []
+        for item in ordering:
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            field = pk if name == 'pk' else model._meta.get_field(name)
+            keys.append((field, descending))
+        if keys[-1][0] != pk:
+            # Направление совпадает с последним полем, чтобы хватало одного индекса
+            keys.append((pk, keys[-1][1]))
+        return keys
+
+    def _order_by(self, reverse=False):
+        return [
+            ('-' if descending != reverse else '') + field.attname
+            for field, descending in self.ordering
+        ]
+
+    def _seek(self, values, reverse=False):
+        """Условие "строго после" строки с заданными значениями ключа"""
+        condition = Q()
+        for i, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{field.attname}__{lookup}': values[i]})
+            for j, (prev_field, _) in enumerate(self.ordering[:i]):
+                step &= Q(**{prev_field.attname: values[j]})
+            condition |= step
+        return condition
+
+    def _encode(self, direction, obj):
+        values = [field.value_to_string(obj) for field, _ in self.ordering]
+        payload = json.dumps([direction, values], ensure_ascii=False)
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def _decode(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in ('next', 'prev') or len(raw) != len(self.ordering):
+                raise InvalidCursor(cursor)
+            values = [field.to_python(value) for (field, _), value in zip(self.ordering, raw)]
+        except (ValueError, TypeError, binascii.Error, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+        return direction, values
+
+    def get_page(self, cursor=None):
+        """Страница после (или перед) курсором; без курсора - первая страница"""
+        direction, values = self._decode(cursor) if cursor else ('next', None)
+        backwards = direction == 'prev'
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse=backwards))
+        rows = list(queryset.order_by(*self._order_by(reverse=backwards))[:self.per_page + 1])
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else values is not None
+        return KeysetPage(
+            rows,
+            next_cursor=self._encode('next', rows[-1]) if has_next else None,
+            prev_cursor=self._encode('prev', rows[0]) if has_previous else None,
+        )
+
+
+class RankedPaginator:
+    """Пагинация по заранее упорядоченному списку id (например, по релевантности)
+
+    Курсор - позиция в списке. Порядок берется из ranked_ids, а queryset
+    отсекает id, не прошедшие остальные фильтры.
+    """
+
+    def __init__(self, queryset, ranked_ids, per_page=12):
+        self.queryset = queryset
+        self.ranked_ids = ranked_ids
+        self.per_page = per_page
+
+    def get_page(self, cursor=None):
+        try:
+            offset = max(int(cursor), 0) if cursor else 0
+        except ValueError as exc:
+            raise InvalidCursor(cursor) from exc
+
+        allowed = set(self.queryset.filter(pk__in=self.ranked_ids).values_list('pk', flat=True))
+        ordered = [pk for pk in self.ranked_ids if pk in allowed]
+        page_ids = ordered[offset:offset + self.per_page]
+        objects = self.queryset.in_bulk(page_ids)
+        rows = [objects[pk] for pk in page_ids if pk in objects]
+
+        end = offset + self.per_page
+        return KeysetPage(
+            rows,
+            next_cursor=str(end) if end < len(ordered) else None,
+            prev_cursor=str(max(offset - self.per_page, 0)) if offset > 0 else None,
+        )
@@ -0,0 +1,229 @@
+"""
+Похожие товары.
+
+Оценка пары товаров складывается из совпадения категории, близости цены,
+совпадения страны и числа заказов, в которых товары покупали вместе.
+Кандидаты для товара - соседи по цене в его категории и стране плюс
+товары из тех же заказов, поэтому полный расчет не перебирает все пары.
+
+Результат хранится в SimilarProduct (до SIMILAR_PRODUCTS_LIMIT строк на
+товар), и страница товара получает рекомендации одним запросом по индексу.
+Полный пересчет - команда compute_similar_products; при изменении цены,
+категории или страны товара пересчитываются только он и его соседи.
+"""
+import bisect
+from collections import Counter, defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Product, SimilarProduct
+
+SIMILAR_PRODUCTS_LIMIT = 8
+# Соседей по цене с каждой стороны в категории и в стране
+PRICE_NEIGHBOURS = 10
+# Заказы с большим числом позиций почти ничего не говорят о связи товаров
+MAX_ORDER_SIZE = 50
+
+WEIGHT_CATEGORY = 3.0
+WEIGHT_PRICE = 2.0
+WEIGHT_COUNTRY = 1.0
+WEIGHT_CO_PURCHASE = 6.0
+# Число совместных покупок, после которого вклад больше не растет
+CO_PURCHASE_SATURATION = 5
+
+Item = namedtuple('Item', ['id', 'category_id', 'country', 'price'])
+ITEM_FIELDS = Item._fields
+
+
+def score(a, b, co_purchases=0):
+    """Оценка похожести товаров a и b"""
+    result = 0.0
+    if a.category_id == b.category_id:
+        result += WEIGHT_CATEGORY
+    if a.country == b.country:
+        result += WEIGHT_COUNTRY
+    top = max(a.price, b.price)
+    if top > 0:
+        result += WEIGHT_PRICE * (1 - abs(a.price - b.price) / top)
+    else:
+        result += WEIGHT_PRICE
+    if co_purchases:
+        result += WEIGHT_CO_PURCHASE * min(co_purchases / CO_PURCHASE_SATURATION, 1.0)
+    return result
+
+
+def _item(row):
+    product_id, category_id, country, price = row
+    return Item(product_id, category_id, country, float(price))
+
+
+def _top(item, candidates, co_purchases):
+    """Лучшие кандидаты для товара: список пар (id, оценка)"""
+    scored = [
+        (candidate.id, score(item, candidate, co_purchases.get(candidate.id, 0)))
+        for candidate in candidates if candidate.id != item.id
+    ]
+    scored.sort(key=lambda pair: (-pair[1], pair[0]))
+    return scored[:SIMILAR_PRODUCTS_LIMIT]
+
+
+def _rows(product_id, ranked):
+    return [
+        SimilarProduct(product_id=product_id, similar_id=similar_id, rank=rank, score=value)
+        for rank, (similar_id, value) in enumerate(ranked)
+    ]
+
+
+class _PriceIndex:
+    """Товары группы, отсортированные по цене, для поиска соседей"""
+
+    def __init__(self):
+        self.items = []
+        self.prices = []
+
+    def finish(self):
+        self.items.sort(key=lambda item: item.price)
+        self.prices = [item.price for item in self.items]
+
+    def neighbours(self, item, k=PRICE_NEIGHBOURS):
+        position = bisect.bisect_left(self.prices, item.price)
+        return self.items[max(position - k, 0):position + k + 1]
+
+
+def _all_co_purchases():
+    """Совместные покупки по всем заказам: id -> Counter(id -> число заказов)"""
+    from orders.models import OrderItem
+
+    pairs = defaultdict(Counter)
+    rows = OrderItem.objects.values_list('order_id', 'product_id').order_by('order_id')
+
+    def flush(products):
+        if 1 < len(products) <= MAX_ORDER_SIZE:
+            for a in products:
+                for b in products:
+                    if a != b:
+                        pairs[a][b] += 1
+
+    current_order, products = None, set()
+    for order_id, product_id in rows.iterator(chunk_size=5000):
+        if order_id != current_order:
+            flush(products)
+            current_order, products = order_id, set()
+        products.add(product_id)
+    flush(products)
+    return pairs
+
+
+def _co_purchases(product_id):
+    """Совместные покупки одного товара: id -> число заказов"""
+    from orders.models import OrderItem
+
+    orders = OrderItem.objects.filter(product_id=product_id).values('order_id')
+    rows = (
+        OrderItem.objects.filter(order_id__in=orders)
+        .exclude(product_id=product_id)
+        .values('product_id')
+        .annotate(orders=Count('order_id', distinct=True))
+        .values_list('product_id', 'orders')
+    )
+    return dict(rows)
+
+
+def rebuild_all(batch_size=5000):
+    """Полностью пересчитывает похожие товары; возвращает число товаров"""
+    by_category = defaultdict(_PriceIndex)
+    by_country = defaultdict(_PriceIndex)
+    items = {}
+    rows = Product.objects.filter(is_available=True).values_list(*ITEM_FIELDS)
+    for row in rows.iterator(chunk_size=5000):
+        item = _item(row)
+        items[item.id] = item
+        by_category[item.category_id].items.append(item)
+        by_country[item.country].items.append(item)
+    for index in (*by_category.values(), *by_country.values()):
+        index.finish()
+
+    co_purchases = _all_co_purchases()
+    with transaction.atomic():
+        SimilarProduct.objects.all().delete()
+        batch = []
+        for item in items.values():
+            related = co_purchases.get(item.id, {})
+            candidates = {
+                candidate.id: candidate
+                for candidate in (
+                    *by_category[item.category_id].neighbours(item),
+                    *by_country[item.country].neighbours(item),
+                    *(items[pid] for pid in related if pid in items),
+                )
+            }
+            batch.extend(_rows(item.id, _top(item, candidates.values(), related)))
+            if len(batch) >= batch_size:
+                SimilarProduct.objects.bulk_create(batch)
+                batch = []
+        SimilarProduct.objects.bulk_create(batch)
+    return len(items)
+
+
+def _neighbours_from_db(item, co_purchases):
+    """Кандидаты для одного товара, выбранные запросами по индексам"""
+    available = Product.objects.filter(is_available=True).exclude(id=item.id)
+    querysets = []
+    for field in ('category_id', 'country'):
+        group = available.filter(**{field: getattr(item, field)})
+        querysets.append(group.filter(price__gte=item.price).order_by('price')[:PRICE_NEIGHBOURS])
+        querysets.append(group.filter(price__lt=item.price).order_by('-price')[:PRICE_NEIGHBOURS])
+    querysets.append(available.filter(id__in=list(co_purchases)))
+
+    candidates = {}
+    for queryset in querysets:
+        for row in queryset.values_list(*ITEM_FIELDS):
+            candidate = _item(row)
+            candidates[candidate.id] = candidate
+    return candidates
+
+
+def refresh_product(product_id):
+    """Пересчитывает похожие товары для товара и для его соседей
+
+    Соседям не нужен полный пересчет: в их списках меняется только оценка
+    этого товара, остальные оценки от него не зависят.
+    """
+    row = Product.objects.filter(id=product_id).values_list(*ITEM_FIELDS, 'is_available').first()
+    with transaction.atomic():
+        # Списки, где товар был, но больше не будет пересчитан - оценка там устарела
+        stale = SimilarProduct.objects.filter(similar_id=product_id)
+        if row is None or not row[-1]:
+            stale.delete()
+            SimilarProduct.objects.filter(product_id=product_id).delete()
+            return
+
+        item = _item(row[:-1])
+        co_purchases = _co_purchases(product_id)
+        candidates = _neighbours_from_db(item, co_purchases)
+        stale.exclude(product_id__in=list(candidates)).delete()
+
+        current = defaultdict(list)
+        existing = SimilarProduct.objects.filter(product_id__in=list(candidates)).exclude(similar_id=product_id)
+        for owner_id, similar_id, value in existing.values_list('product_id', 'similar_id', 'score'):
+            current[owner_id].append((similar_id, value))
+
+        new_rows = _rows(product_id, _top(item, candidates.values(), co_purchases))
+        for candidate in candidates.values():
+            ranked = current[candidate.id]
+            ranked.append((product_id, score(candidate, item, co_purchases.get(candidate.id, 0))))
+            ranked.sort(key=lambda pair: (-pair[1], pair[0]))
+            new_rows.extend(_rows(candidate.id, ranked[:SIMILAR_PRODUCTS_LIMIT]))
+
+        SimilarProduct.objects.filter(product_id__in=[product_id, *candidates]).delete()
+        SimilarProduct.objects.bulk_create(new_rows)
+
+
+def similar_products(product, limit=4):
+    """Похожие товары в наличии - один запрос по индексу (product, rank)"""
+    return list(
+        Product.objects.filter(recommended_for__product=product, is_available=True)
+        .select_related('category')
+        .order_by('recommended_for__rank')[:limit]
+    )
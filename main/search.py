@@ -0,0 +1,467 @@
+"""
+Полнотекстовый поиск по товарам.
+
+Инвертированный индекс по полям name, description, model и country
+хранится в памяти процесса и сохраняется на диск. Слова приводятся к
+основе упрощенным стеммером Портера для русского языка, опечатки
+прощаются через индекс удалений (как в SymSpell): слово запроса и слово
+индекса совпадают, если они равны после удаления не более одной буквы.
+
+Индекс обновляется сигналами модели Product (см. main/signals.py) сразу,
+а на диск изменения сбрасываются не чаще раза в SEARCH_INDEX_SAVE_DELAY
+секунд: файл переписывается под файловой блокировкой поверх версии,
+сохраненной другими процессами. Процесс загружает индекс с диска как есть,
+без запросов к базе. Изменения, прошедшие мимо сигналов (QuerySet.update(),
+правки в базе напрямую), догоняет команда rebuild_search_index --catch-up:
+она сверяет подписи текста всех товаров с индексом и переиндексирует только
+изменившиеся - полная перестройка для этого не нужна.
+"""
+import atexit
+import contextlib
+import hashlib
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: файл пишет один процесс сервера разработки
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# --- Стемминг ---------------------------------------------------------------
+
+_PERFECTIVE_GERUND = re.compile(r'(?:(?<=[ая])(?:в|вши|вшись)|ив|ивши|ившись|ыв|ывши|ывшись)$')
+_REFLEXIVE = re.compile(r'(?:ся|сь)$')
+_ADJECTIVE = re.compile(
+    r'(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+_PARTICIPLE = re.compile(r'(?:(?<=[ая])(?:ем|нн|вш|ющ|щ)|ивш|ывш|ующ)$')
+_VERB = re.compile(
+    r'(?:(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)'
+    r'|ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)$'
+)
+_NOUN = re.compile(
+    r'(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_SUPERLATIVE = re.compile(r'(?:ейше|ейш)$')
+_DERIVATIONAL = re.compile(r'[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_WORD = re.compile(r'[0-9a-zа-яё]+')
+
+
+def stem(word):
+    """Основа русского слова; слова на латинице возвращаются как есть"""
+    word = word.lower().replace('ё', 'е')
+    match = _RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    # Шаг 1: деепричастия, возвратные формы, прилагательные, глаголы, существительные
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    # Шаг 2: окончание "и"
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс "ост(ь)"
+    if _DERIVATIONAL.search(rv):
+        rv = re.sub(r'ость?$', '', rv)
+
+    # Шаг 4: мягкий знак, превосходная степень, двойное "н"
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text):
+    """Основы слов текста"""
+    return [stem(word) for word in _WORD.findall(text.lower())]
+
+
+def _deletes(term):
+    """Варианты слова без одной буквы (для поиска с опечатками)"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+# --- Индекс -----------------------------------------------------------------
+
+# Вес совпадения в зависимости от поля товара
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'model': 2.0,
+    'country': 1.5,
+    'description': 1.0,
+}
+# Короткие слова не участвуют в поиске с опечатками: слишком много ложных совпадений
+FUZZY_MIN_LENGTH = 4
+FUZZY_PENALTY = 0.5
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class SearchIndex:
+    """Инвертированный индекс с ранжированием BM25"""
+
+    VERSION = 2
+
+    def __init__(self):
+        # основа -> {id товара: вклад в релевантность без учета idf}
+        self.postings = defaultdict(dict)
+        # вариант с удаленной буквой -> основы, из которых он получен
+        self.deletes = defaultdict(set)
+        # id товара -> (основы документа, подпись текста)
+        self.documents = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    @staticmethod
+    def _signature(fields):
+        text = '\x00'.join(fields.get(name) or '' for name in FIELD_WEIGHTS)
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def add(self, doc_id, fields):
+        """Индексирует (или переиндексирует) документ; True, если индекс изменился"""
+        signature = self._signature(fields)
+        current = self.documents.get(doc_id)
+        if current is not None and current[1] == signature:
+            return False
+        self.remove(doc_id)
+
+        weights = defaultdict(float)
+        length = 0
+        for name, weight in FIELD_WEIGHTS.items():
+            tokens = tokenize(fields.get(name) or '')
+            length += len(tokens)
+            for token in tokens:
+                weights[token] += weight
+
+        self.total_length += length
+        avg_length = self.total_length / (len(self.documents) + 1)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / max(avg_length, 1))
+        for term, tf in weights.items():
+            if term not in self.postings:
+                self._add_deletes(term)
+            self.postings[term][doc_id] = tf * (BM25_K1 + 1) / (tf + norm)
+        self.documents[doc_id] = (tuple(weights), signature, length)
+        return True
+
+    def remove(self, doc_id):
+        """Удаляет документ из индекса"""
+        current = self.documents.pop(doc_id, None)
+        if current is None:
+            return False
+        terms, _, length = current
+        self.total_length -= length
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+                self._discard_deletes(term)
+        return True
+
+    def _add_deletes(self, term):
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for variant in _deletes(term):
+                self.deletes[variant].add(term)
+
+    def _discard_deletes(self, term):
+        if len(term) >= FUZZY_MIN_LENGTH:
+            for variant in _deletes(term):
+                terms = self.deletes.get(variant)
+                if terms is not None:
+                    terms.discard(term)
+                    if not terms:
+                        del self.deletes[variant]
+
+    def expand(self, term):
+        """Основы индекса, соответствующие основе запроса, с весом совпадения"""
+        if term in self.postings:
+            return {term: 1.0}
+        if len(term) < FUZZY_MIN_LENGTH:
+            return {}
+        # Пропущенная, лишняя или замененная буква
+        candidates = set(self.deletes.get(term, ()))
+        for variant in _deletes(term):
+            if variant in self.postings:
+                candidates.add(variant)
+            candidates.update(self.deletes.get(variant, ()))
+        return {candidate: FUZZY_PENALTY for candidate in candidates}
+
+    def search(self, query, limit=100):
+        """Список пар (id товара, релевантность) по убыванию релевантности"""
+        groups = []
+        for term in dict.fromkeys(tokenize(query)):
+            expanded = self.expand(term)
+            if expanded:
+                groups.append(expanded)
+        if not groups:
+            return []
+
+        total = len(self.documents)
+        scores = defaultdict(float)
+        matched = defaultdict(int)
+        for group in groups:
+            seen = set()
+            for term, penalty in group.items():
+                postings = self.postings[term]
+                idf = _idf(total, len(postings)) * penalty
+                for doc_id, impact in postings.items():
+                    scores[doc_id] += impact * idf
+                    if doc_id not in seen:
+                        seen.add(doc_id)
+                        matched[doc_id] += 1
+
+        # Товары, в которых нашлись все слова запроса, идут первыми
+        return heapq.nlargest(
+            limit,
+            scores.items(),
+            key=lambda item: (matched[item[0]], item[1]),
+        )
+
+    def dump(self, path):
+        """Атомарно сохраняет индекс в файл"""
+        state = {
+            'version': self.VERSION,
+            'postings': dict(self.postings),
+            'documents': self.documents,
+            'total_length': self.total_length,
+        }
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Загружает индекс из файла; None, если файла нет или он устарел"""
+        try:
+            with open(path, 'rb') as fh:
+                state = pickle.load(fh)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if state.get('version') != cls.VERSION:
+            return None
+        index = cls()
+        index.postings = defaultdict(dict, state['postings'])
+        index.documents = state['documents']
+        index.total_length = state['total_length']
+        for term in index.postings:
+            index._add_deletes(term)
+        return index
+
+
+def _idf(total, frequency):
+    return math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+
+# --- Индекс товаров ---------------------------------------------------------
+
+SEARCH_FIELDS = ('id', 'name', 'description', 'model', 'country')
+
+_lock = threading.RLock()
+_index = None
+_index_mtime = None
+# Изменения, еще не сохраненные на диск: id товара -> поля товара или None (удален)
+_unsaved = {}
+_save_timer = None
+
+
+def _index_path():
+    return str(settings.SEARCH_INDEX_PATH)
+
+
+@contextlib.contextmanager
+def _file_lock():
+    """Блокировка файла индекса между процессами на время чтения-изменения-записи"""
+    path = _index_path() + '.lock'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        yield
+
+
+def _apply(index, changes):
+    """Применяет изменения товаров к индексу; True, если что-то изменилось"""
+    changed = False
+    for doc_id, fields in changes.items():
+        changed |= index.remove(doc_id) if fields is None else index.add(doc_id, fields)
+    return changed
+
+
+def _catch_up(index):
+    """Сверяет индекс со всеми товарами базы; True, если что-то изменилось.
+
+    Текст товара токенизируется, только если его подпись не совпала с
+    сохраненной, поэтому неизменившиеся товары обходятся дешево.
+    """
+    from .models import Product
+
+    changed = False
+    existing = set()
+    for row in Product.objects.values(*SEARCH_FIELDS).iterator(chunk_size=2000):
+        existing.add(row['id'])
+        changed |= index.add(row['id'], row)
+    for doc_id in set(index.documents) - existing:
+        changed |= index.remove(doc_id)
+    return changed
+
+
+def _save(index):
+    """Сохраняет индекс; вызывается под _file_lock()"""
+    global _index_mtime
+    path = _index_path()
+    index.dump(path)
+    _index_mtime = os.stat(path).st_mtime_ns
+    _unsaved.clear()
+
+
+def _current_mtime():
+    try:
+        return os.stat(_index_path()).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load():
+    """Индекс с диска с несохраненными изменениями этого процесса"""
+    global _index, _index_mtime
+    mtime = _current_mtime()
+    index = SearchIndex.load(_index_path()) if mtime is not None else None
+    if index is None:
+        logger.warning('Поисковый индекс %s не найден или устарел: запустите rebuild_search_index', _index_path())
+        index = SearchIndex()
+    _apply(index, _unsaved)
+    _index, _index_mtime = index, mtime
+    return index
+
+
+def get_index():
+    """Индекс товаров этого процесса
+
+    При первом обращении индекс загружается с диска, а если файл с тех пор
+    переписал другой процесс - перечитывается. Без файла индекс пуст, пока
+    его не построит rebuild_search_index.
+    """
+    with _lock:
+        mtime = _current_mtime()
+        if _index is not None and (mtime is None or mtime == _index_mtime):
+            return _index
+        return _load()
+
+
+def flush_index():
+    """Сохраняет на диск изменения индекса, сделанные в этом процессе"""
+    global _save_timer
+    with _lock:
+        _save_timer = None
+        if not _unsaved:
+            return
+        with _file_lock():
+            # Файл мог переписать другой процесс: наши изменения ложатся поверх его версии
+            index = get_index()
+            _save(index)
+
+
+def _schedule_save(changes):
+    """Запоминает изменения и сохраняет индекс не раньше чем через SEARCH_INDEX_SAVE_DELAY секунд"""
+    global _save_timer
+    _unsaved.update(changes)
+    if _save_timer is None:
+        _save_timer = threading.Timer(settings.SEARCH_INDEX_SAVE_DELAY, flush_index)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+
+# Изменения последних секунд не теряются при остановке процесса
+atexit.register(flush_index)
+
+
+def catch_up_index():
+    """Догоняет изменения товаров, прошедшие мимо сигналов; число товаров в индексе"""
+    with _lock, _file_lock():
+        index = get_index()
+        if _catch_up(index) or _index_mtime is None or _unsaved:
+            _save(index)
+        return len(index)
+
+
+def rebuild_index():
+    """Полностью перестраивает индекс товаров"""
+    global _index
+    with _lock, _file_lock():
+        index = SearchIndex()
+        _catch_up(index)
+        _index = index
+        _save(index)
+        return index
+
+
+def _change(changes):
+    with _lock:
+        if _apply(get_index(), changes):
+            _schedule_save(changes)
+
+
+def index_products(product_ids):
+    """Переиндексирует товары с заданными id (в том числе удаленные)"""
+    from .models import Product
+
+    changes = dict.fromkeys(product_ids)
+    for row in Product.objects.filter(id__in=changes).values(*SEARCH_FIELDS):
+        changes[row['id']] = row
+    _change(changes)
+
+
+def index_product(product):
+    """Переиндексирует один товар"""
+    _change({product.id: {name: getattr(product, name) for name in SEARCH_FIELDS}})
+
+
+def unindex_product(product_id):
+    """Удаляет товар из индекса"""
+    _change({product_id: None})
+
+
+def search_products(query, limit=None):
+    """id товаров, найденных по запросу, в порядке релевантности"""
+    if limit is None:
+        limit = settings.SEARCH_RESULT_LIMIT
+    return [doc_id for doc_id, _ in get_index().search(query, limit=limit)]
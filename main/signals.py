@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Product, Category, SliderImage, Contact
+from . import cache, facets, images, recommendations, search
+
+
+@receiver(post_save, sender=Product)
+def update_search_index_on_save(sender, instance, **kwargs):
+    """Переиндексирует товар после сохранения"""
+    transaction.on_commit(lambda: search.index_product(instance))
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_save(sender, instance, **kwargs):
+    """Обновляет маски фасетов при изменении наличия, цены или категории"""
+    transaction.on_commit(lambda: facets.update_product(instance))
+
+
+@receiver(post_save, sender=Product)
+def update_similar_products(sender, instance, created, **kwargs):
+    """Пересчитывает похожие товары, если изменились влияющие на них поля"""
+    if created or instance.fields_changed('category_id', 'price', 'country', 'is_available'):
+        product_id = instance.id
+        transaction.on_commit(lambda: recommendations.refresh_product(product_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=SliderImage)
+def generate_image_derivatives(sender, instance, **kwargs):
+    """Строит уменьшенные копии загруженного изображения"""
+    if sender is Product and not instance.fields_changed('image'):
+        return
+    image = instance.image
+    transaction.on_commit(lambda: images.generate_for(image))
+
+
+@receiver(post_delete, sender=Product)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    """Удаляет товар из поискового индекса"""
+    product_id = instance.id
+    transaction.on_commit(lambda: search.unindex_product(product_id))
+
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_delete(sender, instance, **kwargs):
+    """Убирает удаленный товар из фасетов"""
+    product_id = instance.id
+    transaction.on_commit(lambda: facets.remove_product(product_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=SliderImage)
+@receiver(post_delete, sender=SliderImage)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def bump_catalog_cache(sender, **kwargs):
+    """Сбрасывает кеш и ETag страниц витрины после изменения каталога"""
+    transaction.on_commit(cache.bump_generation)
@@ -0,0 +1,42 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from main import images
+
+register = template.Library()
+
+# Показывается, если у записи нет изображения
+PLACEHOLDER = 'images/logo.png'
+
+
+@register.simple_tag
+def picture(image, alt='', sizes='100vw', width=640, loading='lazy', **attrs):
+    """Тег <picture> с srcset уменьшенных копий изображения
+
+    Пример: {% picture product.image alt=product.name sizes="(min-width: 992px) 25vw, 50vw" class="card-img-top" %}
+    width - ширина, под которую выбирается src для браузеров без srcset.
+    Пока копии не построены, выводится исходный файл.
+    """
+    extra = format_html_join('', ' {}="{}"', sorted(attrs.items()))
+    if loading:
+        extra = format_html('{} loading="{}"', extra, loading)
+
+    if not image:
+        return format_html('<img src="{}" alt="{}"{}>', static(PLACEHOLDER), alt, extra)
+    manifest = images.get_manifest(image)
+    if manifest is None:
+        return format_html('<img src="{}" alt="{}"{}>', image.url, alt, extra)
+
+    fallback = manifest['formats'][-1]
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        (
+            (images.MIME_TYPES[fmt], images.srcset(manifest, fmt), sizes)
+            for fmt in manifest['formats'] if fmt != fallback
+        ),
+    )
+    src, _, _ = images.closest_variant(manifest, int(width))
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}"{}></picture>',
+        sources, src, images.srcset(manifest, fallback), sizes, alt, extra,
+    )
@@ -1,3 +1,693 @@
-from django.test import TestCase
-
-# Create your tests here.
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import Context, Template
+from django.db import IntegrityError
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+
+from orders.models import Order, OrderItem
+
+from . import api, cache as catalog_cache, facets, images, recommendations, search
+from .models import Category, Product, SimilarProduct
+from .pagination import InvalidCursor, KeysetPaginator
+
+
+def create_product(category, **fields):
+    values = {
+        'name': 'Букет', 'description': 'Описание', 'price': Decimal('100'), 'category': category,
+        'country': 'Россия', 'year': 2024, 'model': 'M1', 'stock_quantity': 3, 'image': 'products/p.jpg',
+    }
+    values.update(fields)
+    return Product.objects.create(**values)
+
+
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Розы')
+        # Много одинаковых цен и названий: порядок внутри них задает id
+        self.products = [
+            create_product(category, name=f'Букет {i % 3}', price=Decimal(100 + i % 4))
+            for i in range(23)
+        ]
+
+    def walk_forward(self, paginator):
+        pages = [paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return pages
+
+    def test_forward_and_back_with_ties(self):
+        queryset = Product.objects.all()
+        for ordering in (['price'], ['-price'], ['name', '-price'], ['-created_at']):
+            with self.subTest(ordering=ordering):
+                paginator = KeysetPaginator(queryset, ordering, per_page=5)
+                tiebreak = '-id' if paginator.ordering[-1][1] else 'id'
+                expected = list(queryset.order_by(*ordering, tiebreak))
+
+                pages = self.walk_forward(paginator)
+                self.assertEqual([product for page in pages for product in page], expected)
+                self.assertEqual([len(page) for page in pages], [5, 5, 5, 5, 3])
+                self.assertFalse(pages[0].has_previous)
+
+                # Курсор "назад" возвращает ровно предыдущую страницу
+                for previous, page in zip(pages, pages[1:]):
+                    self.assertEqual(list(paginator.get_page(page.prev_cursor)), list(previous))
+
+    def test_cursor_survives_inserts_before_it(self):
+        paginator = KeysetPaginator(Product.objects.all(), ['price'], per_page=5)
+        first = paginator.get_page()
+        second = list(paginator.get_page(first.next_cursor))
+        # Новый товар в начале списка не сдвигает следующую страницу, как сдвинул бы OFFSET
+        create_product(Category.objects.get(), price=Decimal('1'))
+        self.assertEqual(list(paginator.get_page(first.next_cursor)), second)
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Product.objects.all(), ['price'], per_page=5)
+        for cursor in ('garbage', 'WyJuZXh0Il0', paginator.get_page().next_cursor[:-4]):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginator.get_page(cursor)
+
+    def test_catalog_pages(self):
+        cache.clear()
+        response = self.client.get('/catalog/', {'sort': 'price'})
+        first = [product.id for product in response.context['products']]
+        response = self.client.get('/catalog/?' + response.context['next_query'])
+        second = [product.id for product in response.context['products']]
+        self.assertEqual(first + second, list(Product.objects.order_by('price', 'id').values_list('id', flat=True)))
+        # Испорченный курсор - первая страница, а не ошибка
+        response = self.client.get('/catalog/', {'sort': 'price', 'cursor': 'garbage'})
+        self.assertEqual([product.id for product in response.context['products']], first)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Розы')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = create_product(category)
+
+    def test_not_modified(self):
+        for url in ('/', '/catalog/', f'/product/{self.product.id}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_if_modified_since(self):
+        response = self.client.get('/catalog/')
+        response = self.client.get('/catalog/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_change_invalidates(self):
+        etag = self.client.get(f'/product/{self.product.id}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('150')
+            self.product.save()
+        response = self.client.get(f'/product/{self.product.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '150')
+
+
+class GenerateLoadDataTests(TestCase):
+    def test_reported_counts(self):
+        out = StringIO()
+        call_command(
+            'generate_load_data', users=5, products=10, orders=30, categories=2, carts=0,
+            workers=1, batch_size=7, skip_derived=True, end_date='2024-06-30', stdout=out,
+        )
+        report = {
+            line.split(':')[0]: int(line.split(':')[1].split()[0])
+            for line in out.getvalue().splitlines() if ':' in line
+        }
+        self.assertEqual(report['Заказы'], Order.objects.count())
+        self.assertEqual(report['Позиции заказов'], OrderItem.objects.count())
+        self.assertGreater(report['Позиции заказов'], report['Заказы'])
+
+
+class SearchIndexTests(TestCase):
+    def make_index(self, *documents):
+        index = search.SearchIndex()
+        for doc_id, fields in enumerate(documents, 1):
+            index.add(doc_id, fields)
+        return index
+
+    def test_stem(self):
+        self.assertEqual({search.stem(word) for word in ('роза', 'розы', 'розами', 'розой')}, {'роз'})
+        self.assertEqual(search.stem('Ёлочные'), search.stem('елочный'))
+        self.assertEqual(search.tokenize('Пион-микс, Premium 2024'), ['пион', 'микс', 'premium', '2024'])
+
+    def test_typo(self):
+        index = self.make_index({'name': 'Ромашки'}, {'name': 'Пионы'})
+        # Пропущенная, лишняя и замененная буква
+        for query in ('рмашки', 'ромашкии', 'ромашки', 'рамашки'):
+            with self.subTest(query=query):
+                self.assertEqual([doc_id for doc_id, _ in index.search(query)], [1])
+        # Короткие слова с опечатками не ищутся
+        self.assertEqual(index.search('пони'), [])
+
+    def test_ranking(self):
+        index = self.make_index(
+            {'name': 'Букет', 'description': 'пионы и розы'},
+            {'name': 'Ромашки', 'description': 'полевые'},
+            {'name': 'Пионы', 'description': 'нежные'},
+            {'name': 'Пионы и розы'},
+        )
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual([doc_id for doc_id, _ in index.search('пионы')], [3, 4, 1])
+        # Товары со всеми словами запроса идут первыми
+        self.assertEqual([doc_id for doc_id, _ in index.search('роза пион')], [4, 1, 3])
+        self.assertEqual(len(index.search('роза пион', limit=2)), 2)
+
+    def test_reindex_and_remove(self):
+        index = self.make_index({'name': 'Пионы'}, {'name': 'Розы'})
+        self.assertFalse(index.add(1, {'name': 'Пионы'}))
+        self.assertTrue(index.add(1, {'name': 'Тюльпаны'}))
+        self.assertEqual(index.search('пионы'), [])
+        self.assertTrue(index.remove(2))
+        self.assertEqual(index.search('розы'), [])
+        self.assertEqual((len(index), index.total_length), (1, 1))
+
+    def test_dump_and_load(self):
+        index = self.make_index({'name': 'Пионы', 'description': 'нежные'}, {'name': 'Ромашки'})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index', 'search.pickle')
+            index.dump(path)
+            loaded = search.SearchIndex.load(path)
+            self.assertEqual(loaded.search('нежный пион'), index.search('нежный пион'))
+            # Индекс удалений восстанавливается при загрузке
+            self.assertEqual([doc_id for doc_id, _ in loaded.search('рмашки')], [2])
+            with mock.patch.object(search.SearchIndex, 'VERSION', 0):
+                self.assertIsNone(search.SearchIndex.load(path))
+            self.assertIsNone(search.SearchIndex.load(os.path.join(directory, 'missing.pickle')))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'search.pickle')
+        settings_override = override_settings(SEARCH_INDEX_PATH=self.path, SEARCH_INDEX_SAVE_DELAY=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.reset()
+        self.addCleanup(self.reset)
+        self.category = Category.objects.create(name='Розы')
+
+    def reset(self):
+        # Состояние процесса: индекс в памяти и несохраненные изменения
+        if search._save_timer is not None:
+            search._save_timer.cancel()
+        search._index = search._index_mtime = search._save_timer = None
+        search._unsaved.clear()
+
+    def found(self, query):
+        return search.search_products(query)
+
+    def test_signals_update_index_and_save_once(self):
+        search.rebuild_index()
+        with mock.patch.object(search.SearchIndex, 'dump', wraps=search.get_index().dump) as dump:
+            with self.captureOnCommitCallbacks(execute=True):
+                products = [create_product(self.category, name=f'Пионы {i}') for i in range(5)]
+            self.assertEqual(len(self.found('пионы')), 5)
+            dump.assert_not_called()
+            search.flush_index()
+            self.assertEqual(dump.call_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            products[0].delete()
+        search.flush_index()
+        self.assertEqual(len(search.SearchIndex.load(self.path)), 4)
+
+    def test_flush_keeps_changes_of_other_process(self):
+        search.rebuild_index()
+        # Другой процесс успел сохранить свой товар
+        other = search.SearchIndex.load(self.path)
+        other.add(1000, {'name': 'Ромашки'})
+        other.dump(self.path)
+        os.utime(self.path, ns=(0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.category, name='Пионы')
+        search.flush_index()
+        saved = search.SearchIndex.load(self.path)
+        self.assertEqual({doc_id for doc_id, _ in saved.search('ромашки пионы')}, {1000, product.id})
+
+    def test_reload_keeps_unsaved_changes(self):
+        search.rebuild_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.category, name='Пионы')
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(self.found('пионы'), [product.id])
+
+    def test_catch_up_after_update(self):
+        product = create_product(self.category, name='Пионы')
+        create_product(self.category, name='Ромашки')
+        index = search.rebuild_index()
+        # Товар, удаленный из базы в обход сигналов
+        index.add(1000, {'name': 'Ромашки'})
+        search.flush_index()
+        # update() не вызывает сигналы и не меняет updated_at
+        Product.objects.filter(id=product.id).update(name='Тюльпаны')
+        self.assertEqual(self.found('тюльпаны'), [])
+
+        self.reset()
+        with mock.patch.object(search, 'tokenize', wraps=search.tokenize) as tokenize:
+            self.assertEqual(search.catch_up_index(), 2)
+        # Токенизирован только изменившийся товар - по разу на каждое поле
+        self.assertEqual(tokenize.call_count, len(search.FIELD_WEIGHTS))
+        self.assertEqual(self.found('тюльпаны'), [product.id])
+        self.assertEqual(self.found('пионы'), [])
+        self.assertEqual(len(self.found('ромашки')), 1)
+        # Изменение сохранено: его видит процесс, загрузивший индекс с диска
+        self.reset()
+        self.assertEqual(self.found('тюльпаны'), [product.id])
+
+    def test_missing_file(self):
+        with self.assertLogs('main.search', 'WARNING'):
+            self.assertEqual(len(search.get_index()), 0)
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.category = Category.objects.create(name='Розы')
+
+    def write_file(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='', encoding='utf-8') as fh:
+            fh.write(text)
+        return path
+
+    def import_file(self, path, *args):
+        out = StringIO()
+        call_command('import_catalog', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        create_product(self.category, name='Розы Гран-при 25 шт', description='"Гран-при", строка 1\nстрока 2; <b>&</b>')
+        create_product(Category.objects.create(name='Пионы'), name='Пионы', price=Decimal('2499.90'), stock_quantity=0)
+        fields = ['id', 'name', 'description', 'price', 'category_id', 'country', 'year', 'model', 'stock_quantity',
+                  'is_available', 'image']
+        expected = list(Product.objects.order_by('id').values(*fields))
+        for name in ('products.csv', 'products.jsonl'):
+            with self.subTest(name=name):
+                path = os.path.join(self.directory, name)
+                call_command('export_catalog', path, stdout=StringIO())
+                Product.objects.update(name='Изменено', description='Изменено', price=1, stock_quantity=7, is_available=True)
+                out = self.import_file(path)
+                self.assertIn('Загружено товаров: 2 (новых 0, обновлено 2), ошибок: 0', out)
+                self.assertEqual(list(Product.objects.order_by('id').values(*fields)), expected)
+
+    def test_validation_errors(self):
+        path = self.write_file('products.csv', (
+            'id,name,description,price,category,country,year,model,stock_quantity,image\n'
+            ',Пионы,Описание,abc,Розы,Россия,2024,M1,3,\n'
+            ',Пионы,Описание,100,Розы,Россия,2024,M1,-1,\n'
+            ',Пионы,Описание,100,Лилии,Россия,2024,M1,3,\n'
+            ',Пионы,Описание,100,,Россия,2024,M1,3,\n'
+            'x,Пионы,Описание,100,Розы,Россия,2024,M1,3,\n'
+            ',Ромашки,Описание,100,Розы,Россия,2024,M1,3,\n'
+        ))
+        out = self.import_file(path, '--no-create-categories')
+        for error in (
+            'строка 2: price:',
+            'строка 3: stock_quantity: Количество на складе не может быть отрицательным',
+            'строка 4: category: категория "Лилии" не найдена',
+            'строка 5: category: не указана категория',
+            'строка 6: id: "x" - не целое число',
+        ):
+            self.assertIn(error, out)
+        self.assertIn('Загружено товаров: 1 (новых 1, обновлено 0), ошибок: 5', out)
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Ромашки'])
+
+        path = self.write_file('products.jsonl', '{"name": "Пионы"\n[1, 2]\n{"name": "Пионы", "color": "red"}\n')
+        out = self.import_file(path, '--dry-run')
+        self.assertIn('строка 1: некорректный JSON', out)
+        self.assertIn('строка 2: ожидается объект JSON', out)
+        self.assertIn('строка 3: неизвестные колонки: color', out)
+
+    def test_is_available_recomputed(self):
+        product = create_product(self.category, stock_quantity=5)
+        self.assertTrue(product.is_available)
+        path = self.write_file('products.jsonl', (
+            f'{{"id": {product.id}, "name": "Букет", "description": "Описание", "price": "100", "category": "Розы",'
+            ' "country": "Россия", "year": 2024, "model": "M1", "stock_quantity": 0}\n'
+            '{"name": "Пионы", "description": "Описание", "price": "100", "category": "Пионы",'
+            ' "country": "Россия", "year": 2024, "model": "M1", "stock_quantity": 3}\n'
+        ))
+        self.import_file(path)
+        self.assertEqual(
+            dict(Product.objects.values_list('category__name', 'is_available')), {'Розы': False, 'Пионы': True},
+        )
+
+    def test_failed_batch_does_not_stop_import(self):
+        path = self.write_file('products.csv', (
+            'name,description,price,category,country,year,model,stock_quantity\n'
+            'Пионы,Описание,100,Розы,Россия,2024,M1,3\n'
+            'Ромашки,Описание,100,Розы,Россия,2024,M1,3\n'
+        ))
+        bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def failing_once(queryset, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_create(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'bulk_create', failing_once):
+            out = self.import_file(path, '--batch-size', '1')
+        self.assertIn('строка 2: строки 2-2 не записаны: UNIQUE constraint failed', out)
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Ромашки'])
+
+    def test_stdin_is_not_closed(self):
+        stdin = StringIO('name,description,price,category,country,year,model,stock_quantity\n'
+                         'Пионы,Описание,100,Розы,Россия,2024,M1,3\n')
+        with mock.patch('sys.stdin', stdin):
+            self.assertIn('Загружено товаров: 1', self.import_file('-'))
+        self.assertFalse(stdin.closed)
+
+
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        facets.invalidate()
+        self.addCleanup(facets.invalidate)
+        self.roses = Category.objects.create(name='Розы')
+        self.peonies = Category.objects.create(name='Пионы')
+        self.rose = create_product(self.roses, price=Decimal('900'))
+        create_product(self.roses, price=Decimal('1500'), country='Эквадор')
+        create_product(self.peonies, price=Decimal('1200'))
+
+    def test_counts(self):
+        index = facets.get_index()
+        counts = index.counts({'category': self.roses.id})
+        self.assertEqual(counts['category'], {self.roses.id: 2, self.peonies.id: 1})
+        self.assertEqual(counts['price'], {'0-1000': 1, '1000-2000': 1})
+        self.assertEqual(counts['country'], {'Россия': 1, 'Эквадор': 1})
+        self.assertEqual(index.count({'category': self.roses.id, 'price': '1000-2000'}), 1)
+        self.assertEqual(index.count({}, restrict_ids=[self.rose.id]), 1)
+
+    def test_stock_flip(self):
+        facets.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rose.stock_quantity = 0
+            self.rose.save()
+        counts = facets.get_index().counts({})
+        self.assertEqual(counts['category'], {self.roses.id: 1, self.peonies.id: 1})
+        self.assertNotIn('0-1000', counts['price'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rose.stock_quantity = 2
+            self.rose.save()
+        self.assertEqual(facets.get_index().counts({})['price']['0-1000'], 1)
+
+    def test_background_refresh_replays_changes(self):
+        stale = facets.get_index()
+        fresh = facets.build_index()
+        with override_settings(FACET_INDEX_TTL=0), mock.patch('threading.Thread') as thread:
+            self.assertIs(facets.get_index(), stale)
+        generation = thread.call_args.kwargs['args'][0]
+        # Товар ушел из продажи, пока индекс строился
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rose.stock_quantity = 0
+            self.rose.save()
+        with mock.patch.object(facets, 'build_index', return_value=fresh), mock.patch.object(facets, 'connection'):
+            facets._refresh(generation)
+        index = facets.get_index()
+        self.assertIs(index, fresh)
+        self.assertEqual(index.count({'category': self.roses.id}), 1)
+
+    def test_refresh_after_invalidate_is_discarded(self):
+        facets.get_index()
+        with override_settings(FACET_INDEX_TTL=0), mock.patch('threading.Thread') as thread:
+            facets.get_index()
+        generation = thread.call_args.kwargs['args'][0]
+        facets.invalidate()
+        with mock.patch.object(facets, 'build_index', return_value=facets.FacetIndex()), \
+                mock.patch.object(facets, 'connection'):
+            facets._refresh(generation)
+        self.assertEqual(facets.get_index().count({}), 3)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Розы')
+
+    def test_product_save_bumps_generation(self):
+        generation = catalog_cache.get_generation()
+        build = mock.Mock(side_effect=[1, 2])
+        self.assertEqual(catalog_cache.cached('popular', None, build), 1)
+        self.assertEqual(catalog_cache.cached('popular', None, build), 1)
+        modified = catalog_cache.get_modified()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_product(self.category)
+        self.assertGreater(catalog_cache.get_generation(), generation)
+        self.assertGreaterEqual(catalog_cache.get_modified(), modified)
+        self.assertEqual(catalog_cache.cached('popular', None, build), 2)
+        self.assertEqual(build.call_count, 2)
+
+    def test_params_are_part_of_key(self):
+        self.assertEqual(catalog_cache.make_key('catalog', {'a': '1', 'b': '2'}),
+                         catalog_cache.make_key('catalog', {'b': '2', 'a': '1'}))
+        self.assertNotEqual(catalog_cache.make_key('catalog', {'a': '1'}), catalog_cache.make_key('catalog', {'a': '2'}))
+
+    def test_evicted_generation_does_not_restart(self):
+        generation = catalog_cache.bump_generation()
+        cache.delete(catalog_cache.GENERATION_KEY)
+        later = catalog_cache.time.time() + 1
+        # Новое поколение - метка времени, а не 1: старые ключи не оживают
+        with mock.patch('time.time', return_value=later):
+            self.assertGreater(catalog_cache.get_generation(), generation)
+
+    def test_catalog_page_sees_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.category, name='Пионы')
+        self.assertContains(self.client.get('/catalog/'), 'Пионы')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Ромашки'
+            product.save()
+        response = self.client.get('/catalog/')
+        self.assertContains(response, 'Ромашки')
+        self.assertNotContains(response, 'Пионы')
+
+
+class SimilarProductsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        roses = Category.objects.create(name='Розы')
+        peonies = Category.objects.create(name='Пионы')
+        self.product = create_product(roses, price=Decimal('1000'))
+        self.twin = create_product(roses, price=Decimal('1000'))
+        self.imported = create_product(roses, price=Decimal('1100'), country='Эквадор')
+        self.neighbour = create_product(peonies, price=Decimal('1000'))
+        self.bought_together = create_product(peonies, price=Decimal('5000'), country='Кения')
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1')
+        for _ in range(recommendations.CO_PURCHASE_SATURATION):
+            order = Order.objects.create(user=user)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price=Decimal('1000'))
+            OrderItem.objects.create(order=order, product=self.bought_together, quantity=1, price=Decimal('5000'))
+
+    def ranking(self, product):
+        return list(SimilarProduct.objects.filter(product=product).values_list('similar_id', flat=True))
+
+    def test_ranking(self):
+        self.assertEqual(recommendations.rebuild_all(), 5)
+        # Совместные покупки весят больше категории, страны и цены
+        self.assertEqual(self.ranking(self.product), [
+            self.bought_together.id, self.twin.id, self.imported.id, self.neighbour.id,
+        ])
+        with self.assertNumQueries(1):
+            similar = recommendations.similar_products(self.product, limit=2)
+        self.assertEqual(similar, [self.bought_together, self.twin])
+
+    def test_refresh_matches_rebuild(self):
+        recommendations.rebuild_all()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.neighbour.price = Decimal('1050')
+            self.neighbour.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.twin.stock_quantity = 0
+            self.twin.save()
+        refreshed = {product.id: self.ranking(product) for product in Product.objects.all()}
+        self.assertNotIn(self.twin.id, refreshed[self.product.id])
+        self.assertEqual(refreshed[self.twin.id], [])
+        recommendations.rebuild_all()
+        self.assertEqual({product.id: self.ranking(product) for product in Product.objects.all()}, refreshed)
+
+    def test_product_page(self):
+        recommendations.rebuild_all()
+        response = self.client.get(f'/product/{self.product.id}/')
+        self.assertEqual(
+            [product.id for product in response.context['similar_products']],
+            [self.bought_together.id, self.twin.id, self.imported.id, self.neighbour.id],
+        )
+
+
+class ImageDerivativesTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings_override = override_settings(
+            MEDIA_ROOT=self.root, IMAGE_DERIVATIVES_ROOT=os.path.join(self.root, 'derivatives'),
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        images._lookup_cache.clear()
+        self.category = Category.objects.create(name='Розы')
+
+    def save_image(self, name, mode='RGB', size=(700, 350)):
+        os.makedirs(os.path.join(self.root, 'products'), exist_ok=True)
+        Image.new(mode, size, 'red').save(os.path.join(self.root, 'products', name))
+        return f'products/{name}'
+
+    def render(self, image):
+        template = Template(
+            '{% load image_tags %}{% picture image alt=alt sizes="50vw" width=300 class="card-img-top" %}'
+        )
+        return template.render(Context({'image': image, 'alt': 'Розы <b>'}))
+
+    def test_generate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.category, image=self.save_image('rose.jpg'))
+        manifest = images.get_manifest(product.image)
+        self.assertEqual(manifest['formats'][-2:], ['webp', 'jpeg'])
+        self.assertEqual(manifest['variants']['jpeg'], [
+            [160, 80, '160.jpg'], [320, 160, '320.jpg'], [640, 320, '640.jpg'], [700, 350, '700.jpg'],
+        ])
+        directory = os.path.join(self.root, 'derivatives', manifest['digest'][:2], manifest['digest'])
+        for fmt in manifest['formats']:
+            for width, height, filename in manifest['variants'][fmt]:
+                with Image.open(os.path.join(directory, filename)) as variant:
+                    self.assertEqual(variant.size, (width, height))
+
+        # Тот же файл под другим именем не обрабатывается второй раз
+        os.link(os.path.join(self.root, product.image.name), os.path.join(self.root, 'products', 'copy.jpg'))
+        with mock.patch.object(images, 'render_derivatives') as render:
+            copy = create_product(self.category, image='products/copy.jpg')
+            self.assertEqual(images.generate_for(copy.image)['digest'], manifest['digest'])
+        render.assert_not_called()
+
+    def test_transparent_png(self):
+        product = create_product(self.category, image=self.save_image('rose.png', 'RGBA', (100, 100)))
+        manifest = images.generate_for(product.image)
+        self.assertEqual(manifest['formats'][-1], 'png')
+        self.assertEqual(manifest['variants']['png'], [[100, 100, '100.png']])
+
+    def test_unreadable_file(self):
+        os.makedirs(os.path.join(self.root, 'products'))
+        with open(os.path.join(self.root, 'products', 'broken.jpg'), 'wb') as fh:
+            fh.write(b'not an image')
+        product = create_product(self.category, image='products/broken.jpg')
+        self.assertIsNone(images.generate_for(product.image))
+        self.assertIn('<img src="/media/products/broken.jpg"', self.render(product.image))
+
+    def test_picture_tag(self):
+        product = create_product(self.category, image=self.save_image('rose.jpg'))
+        # Копии еще не построены - исходный файл
+        self.assertHTMLEqual(
+            self.render(product.image),
+            '<img src="/media/products/rose.jpg" alt="Розы &lt;b&gt;" class="card-img-top" loading="lazy">',
+        )
+        manifest = images.generate_for(product.image)
+        url = f'/media/derivatives/{manifest["digest"][:2]}/{manifest["digest"]}/'
+        html = self.render(product.image)
+        self.assertInHTML(
+            f'<source type="image/webp" sizes="50vw" srcset="{url}160.webp 160w, {url}320.webp 320w, '
+            f'{url}640.webp 640w, {url}700.webp 700w">',
+            html,
+        )
+        self.assertInHTML(
+            f'<img src="{url}320.jpg" srcset="{url}160.jpg 160w, {url}320.jpg 320w, {url}640.jpg 640w, '
+            f'{url}700.jpg 700w" sizes="50vw" alt="Розы &lt;b&gt;" class="card-img-top" loading="lazy">',
+            html,
+        )
+        self.assertIn('src="/static/images/logo.png"', self.render(''))
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        facets.invalidate()
+        self.addCleanup(facets.invalidate)
+        self.category = Category.objects.create(name='Розы')
+        self.products = [
+            create_product(self.category, name=f'Букет {i}', price=Decimal(100 + i % 3)) for i in range(7)
+        ]
+        self.sold_out = create_product(self.category, name='Пионы', stock_quantity=0)
+
+    def get_json(self, url, params=None, status=200):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status)
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return response.json()
+
+    def test_fields(self):
+        data = self.get_json('/api/products/', {'fields': 'id, name,price', 'limit': 2})
+        self.assertEqual([set(row) for row in data['results']], [{'id', 'name', 'price'}] * 2)
+        row = self.get_json(f'/api/products/{self.sold_out.id}/', {'fields': 'name,is_available,category_name'})
+        self.assertEqual(row, {'name': 'Пионы', 'is_available': False, 'category_name': 'Розы'})
+        data = self.get_json('/api/products/', {'fields': 'id,secret'}, status=400)
+        self.assertEqual(data['error'], 'Неизвестные поля: secret')
+        self.get_json('/api/products/0/', status=404)
+
+    def test_stream(self):
+        data = self.get_json('/api/products/', {'sort': 'price', 'fields': 'id,price,image'})
+        expected = Product.objects.filter(is_available=True).order_by('price', 'id')
+        self.assertEqual([row['id'] for row in data['results']], [product.id for product in expected])
+        self.assertEqual(data['results'][0]['price'], '100.00')
+        self.assertEqual(data['results'][0]['image'], '/media/products/p.jpg')
+
+    def test_next_cursor(self):
+        ids, params = [], {'sort': 'price', 'limit': 3, 'fields': 'id'}
+        while True:
+            data = self.get_json('/api/products/', params)
+            ids.extend(row['id'] for row in data['results'])
+            if data['next'] is None:
+                break
+            params['cursor'] = data['next']
+        expected = Product.objects.filter(is_available=True).order_by('price', 'id')
+        self.assertEqual(ids, [product.id for product in expected])
+        self.assertEqual(len(data['results']), 1)
+        self.get_json('/api/products/', {'limit': 3, 'cursor': 'garbage'}, status=400)
+        self.get_json('/api/products/', {'limit': 0}, status=400)
+
+    def test_bulk(self):
+        first, second = self.products[:2]
+        ids = f'{second.id},{first.id},999999,{second.id},{self.sold_out.id}'
+        data = self.get_json('/api/products/bulk/', {'ids': ids, 'fields': 'name'})
+        self.assertEqual(data, {
+            'results': [{'name': second.name}, {'name': first.name}, {'name': 'Пионы'}],
+            'missing': [999999],
+        })
+        self.get_json('/api/products/bulk/', {'ids': '1,x'}, status=400)
+        self.get_json('/api/products/bulk/', status=400)
+        too_many = ','.join(str(i) for i in range(api.MAX_BULK_IDS + 1))
+        self.get_json('/api/products/bulk/', {'ids': too_many}, status=400)
+
+    def test_stock_and_categories(self):
+        data = self.get_json('/api/stock/', {'ids': f'{self.sold_out.id},{self.products[0].id}'})
+        self.assertEqual(data['results'], [
+            {'id': self.products[0].id, 'stock_quantity': 3, 'is_available': True},
+            {'id': self.sold_out.id, 'stock_quantity': 0, 'is_available': False},
+        ])
+        self.assertEqual(len(self.get_json('/api/stock/')['results']), 8)
+        data = self.get_json('/api/categories/')
+        self.assertEqual(data['results'], [
+            {'id': self.category.id, 'name': 'Розы', 'description': '', 'product_count': 7},
+        ])
@@ -1,10 +1,15 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('catalog/', views.catalog, name='catalog'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
     path('contacts/', views.contacts, name='contacts'),
+    path('api/products/', api.product_list, name='api_product_list'),
+    path('api/products/bulk/', api.product_bulk, name='api_product_bulk'),
+    path('api/products/<int:product_id>/', api.product_detail, name='api_product_detail'),
+    path('api/categories/', api.category_list, name='api_category_list'),
+    path('api/stock/', api.stock, name='api_stock'),
 ]
 
@@ -1,12 +1,76 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render
+from django.http import Http404
 from django.db.models import Q
 from .models import Product, Category, SliderImage, Contact
+from .pagination import KeysetPaginator, RankedPaginator, InvalidCursor
+from . import cache, facets, recommendations, search
+from .conditional import conditional_page
 
 
+# Сортировки каталога: значение параметра sort -> порядок выборки
+CATALOG_SORTS = {
+    'year': ['-year'],
+    'name': ['name'],
+    'price': ['price'],
+}
+CATALOG_DEFAULT_SORT = ['-created_at']  # По умолчанию по новизне
+CATALOG_PAGE_SIZE = 12
+
+
+def _page_query(request, cursor):
+    """Строка запроса для перехода на страницу с заданным курсором"""
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return params.urlencode()
+
+
+def _facet_groups(request, selected, counts, categories):
+    """Группы фильтров каталога со ссылками и количеством товаров"""
+    def option_query(name, value):
+        params = request.GET.copy()
+        params.pop('cursor', None)
+        if value is None or selected.get(name) == value:
+            params.pop(name, None)
+        else:
+            params[name] = str(value)
+        return params.urlencode()
+    
+    labels = {
+        'category': [(category.id, category.name) for category in categories],
+        'country': [(country, country) for country in sorted(counts['country'])],
+        'year': [(year, year) for year in sorted(counts['year'], reverse=True)],
+        'price': [(key, label) for key, (_, _, label) in facets.PRICE_BUCKETS.items()],
+    }
+    groups = []
+    for name, title in facets.FACETS.items():
+        options = [
+            {
+                'label': label,
+                'count': counts[name].get(value, 0),
+                'selected': selected.get(name) == value,
+                'query': option_query(name, value),
+            }
+            for value, label in labels[name]
+            if counts[name].get(value) or selected.get(name) == value
+        ]
+        groups.append({
+            'title': title,
+            'active': name in selected,
+            'reset_query': option_query(name, None),
+            'options': options,
+        })
+    return groups
+
+
+@conditional_page
 def home(request):
     """Главная страница"""
-    slider_images = SliderImage.objects.filter(is_active=True).order_by('order')
-    popular_products = Product.objects.filter(is_available=True).order_by('-created_at')[:4]
+    slider_images = cache.cached('slider', None, lambda: list(
+        SliderImage.objects.filter(is_active=True).order_by('order')
+    ))
+    popular_products = cache.cached('popular', None, lambda: list(
+        Product.objects.filter(is_available=True).select_related('category').order_by('-created_at')[:4]
+    ))
     context = {
         'slider_images': slider_images,
         'popular_products': popular_products,
@@ -14,43 +78,93 @@ def home(request):
     return render(request, 'main/home.html', context)
 
 
+def catalog_products(params):
+    """Товары каталога по фильтрам и поисковому запросу из GET-параметров
+
+    Возвращает (queryset, выбранные фасеты, запрос, id по релевантности или None).
+    Используется страницей каталога и API (main/api.py).
+    """
+    products = Product.objects.filter(is_available=True).select_related('category')
+    
+    # Фильтрация по фасетам: категория, страна, год, цена
+    selected = facets.selected_facets(params)
+    products = facets.filter_products(products, selected)
+    
+    # Полнотекстовый поиск
+    query = params.get('q', '').strip()
+    ranked_ids = None
+    if query:
+        ranked_ids = search.search_products(query)
+        products = products.filter(id__in=ranked_ids)
+    return products, selected, query, ranked_ids
+
+
+def catalog_paginator(products, ranked_ids, sort_by, per_page=CATALOG_PAGE_SIZE):
+    """Пагинатор каталога; при поиске без явной сортировки - по релевантности"""
+    if ranked_ids is not None and sort_by not in CATALOG_SORTS:
+        return RankedPaginator(products, ranked_ids, per_page=per_page)
+    return KeysetPaginator(
+        products,
+        CATALOG_SORTS.get(sort_by, CATALOG_DEFAULT_SORT),
+        per_page=per_page,
+    )
+
+
+@conditional_page
 def catalog(request):
     """Страница каталога"""
-    products = Product.objects.filter(is_available=True)
-    categories = Category.objects.all()
+    categories = cache.cached('categories', None, lambda: list(Category.objects.all()))
+    products, selected, query, ranked_ids = catalog_products(request.GET)
+    sort_by = request.GET.get('sort')
     
-    # Фильтрация по категории
-    category_id = request.GET.get('category')
-    if category_id:
-        products = products.filter(category_id=category_id)
+    # Количество товаров по фасетам считается по индексу в памяти
+    counts = facets.get_index().counts(selected, restrict_ids=ranked_ids)
     
-    # Сортировка
-    sort_by = request.GET.get('sort')
-    if sort_by == 'year':
-        products = products.order_by('-year')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    elif sort_by == 'price':
-        products = products.order_by('price')
-    else:
-        products = products.order_by('-created_at')  # По умолчанию по новизне
+    # Сортировка и постраничный вывод
+    paginator = catalog_paginator(products, ranked_ids, sort_by)
+    
+    def build_page():
+        try:
+            return paginator.get_page(request.GET.get('cursor'))
+        except InvalidCursor:
+            return paginator.get_page()
+    
+    # Страница зависит только от параметров запроса и поколения каталога
+    page = cache.cached('catalog', request.GET.dict(), build_page)
     
     context = {
-        'products': products,
+        'products': page.object_list,
+        'page': page,
+        'next_query': _page_query(request, page.next_cursor) if page.has_next else None,
+        'prev_query': _page_query(request, page.prev_cursor) if page.has_previous else None,
         'categories': categories,
-        'current_category': category_id,
+        'facet_groups': _facet_groups(request, selected, counts, categories),
+        'filter_params': [(name, request.GET[name]) for name in facets.FACETS if request.GET.get(name)],
         'current_sort': sort_by,
+        'query': query,
     }
     return render(request, 'main/catalog.html', context)
 
 
+@conditional_page
 def product_detail(request, product_id):
     """Страница товара"""
-    product = get_object_or_404(Product, id=product_id, is_available=True)
-    similar_products = Product.objects.filter(
-        category=product.category, 
-        is_available=True
-    ).exclude(id=product.id)[:4]
+    def build():
+        product = Product.objects.select_related('category').filter(id=product_id, is_available=True).first()
+        if product is None:
+            return None, []
+        similar_products = recommendations.similar_products(product)
+        if not similar_products:
+            # Рекомендации для товара еще не рассчитаны
+            similar_products = list(Product.objects.filter(
+                category=product.category, 
+                is_available=True
+            ).exclude(id=product.id)[:4])
+        return product, similar_products
+    
+    product, similar_products = cache.cached('product', {'id': product_id}, build)
+    if product is None:
+        raise Http404('Товар не найден')
     
     context = {
         'product': product,
@@ -59,6 +173,7 @@ def product_detail(request, product_id):
     return render(request, 'main/product_detail.html', context)
 
 
+@conditional_page
 def contacts(request):
     """Страница контактов"""
     contact_info = Contact.objects.first()
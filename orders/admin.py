@@ -1,6 +1,39 @@
 from django.contrib import admin
 from django.contrib.admin import actions
-from .models import Order, OrderItem
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+
+from .models import ArchivedOrder, DailySales, Order, OrderItem, StockMovement
+from . import analytics, export, inventory
+
+
+class TotalPriceFilter(admin.SimpleListFilter):
+    """Фильтр заказов по общей стоимости"""
+    title = 'Общая стоимость'
+    parameter_name = 'total'
+    RANGES = {
+        'lt1000': ('До 1000 руб.', None, 1000),
+        '1000-3000': ('1000 - 3000 руб.', 1000, 3000),
+        '3000-10000': ('3000 - 10000 руб.', 3000, 10000),
+        'gte10000': ('От 10000 руб.', 10000, None),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, (label, _, _) in self.RANGES.items()]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        _, low, high = self.RANGES[self.value()]
+        if low is not None:
+            queryset = queryset.filter(total_price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(total_price__lt=high)
+        return queryset
 
 
 class OrderItemInline(admin.TabularInline):
@@ -11,12 +44,13 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'status', 'total_quantity', 'total_price', 'created_at']
-    list_filter = ['status', 'created_at']
+    list_display = ['id', 'user', 'status', 'item_count', 'total_quantity', 'total_price_display', 'created_at']
+    list_filter = ['status', TotalPriceFilter, 'created_at']
+    list_select_related = ['user']
     search_fields = ['user__username', 'user__first_name', 'user__last_name']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'item_count', 'total_quantity', 'total_price']
     inlines = [OrderItemInline]
-    actions = [actions.delete_selected, 'confirm_orders', 'cancel_orders']
+    actions = [actions.delete_selected, 'confirm_orders', 'cancel_orders', 'export_csv', 'export_xlsx']
     
     class Media:
         js = ('admin/js/order_admin.js',)
@@ -26,20 +60,95 @@ class OrderAdmin(admin.ModelAdmin):
         fields = ['user', 'status', 'created_at', 'updated_at']
         if obj and obj.status == 'cancelled':
             fields.insert(2, 'cancellation_reason')
+        if obj:
+            fields += ['item_count', 'total_quantity', 'total_price']
         return fields
     
-    def total_quantity(self, obj):
-        return obj.total_quantity
-    total_quantity.short_description = 'Количество товаров'
-    
-    def total_price(self, obj):
+    def total_price_display(self, obj):
         return f"{obj.total_price:.2f} руб."
-    total_price.short_description = 'Общая стоимость'
+    total_price_display.short_description = 'Общая стоимость'
+    total_price_display.admin_order_field = 'total_price'
+    
+    def get_urls(self):
+        return [
+            path(
+                'export/<str:fmt>/', self.admin_site.admin_view(self.export_view),
+                name='orders_order_export',
+            ),
+        ] + super().get_urls()
+    
+    def export_response(self, queryset, fmt):
+        """Выгрузка заказов потоком (orders/export.py)"""
+        response = StreamingHttpResponse(export.stream(fmt, queryset), content_type=export.CONTENT_TYPES[fmt])
+        filename = f"orders-{timezone.localtime():%Y%m%d-%H%M}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    def export_view(self, request, fmt):
+        """Выгрузка всех заказов списка с текущими фильтрами и поиском"""
+        if fmt not in export.FORMATS:
+            raise Http404('Неизвестный формат выгрузки')
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        return self.export_response(self.get_changelist_instance(request).get_queryset(request), fmt)
+    
+    def export_csv(self, request, queryset):
+        """Выгрузить выбранные заказы в CSV"""
+        return self.export_response(queryset, 'csv')
+    export_csv.short_description = "Выгрузить в CSV"
+    export_csv.allowed_permissions = ('view',)
+    
+    def export_xlsx(self, request, queryset):
+        """Выгрузить выбранные заказы в XLSX"""
+        return self.export_response(queryset, 'xlsx')
+    export_xlsx.short_description = "Выгрузить в XLSX"
+    export_xlsx.allowed_permissions = ('view',)
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        """Заказ, перенесенный в архив, открывается по прежнему номеру в архиве"""
+        if (
+            object_id.isdigit() and not Order.objects.filter(pk=object_id).exists()
+            and ArchivedOrder.objects.filter(pk=object_id).exists()
+        ):
+            return redirect(reverse('admin:orders_archivedorder_change', args=[object_id]))
+        return super().change_view(request, object_id, form_url, extra_context)
+    
+    def save_model(self, request, obj, form, change):
+        """Подтверждение и отмена идут через склад (orders/inventory.py) - после
+        сохранения позиций, поэтому здесь заказ сохраняется с прежним статусом"""
+        previous = form.initial.get('status') if change else 'new'
+        obj._previous_status = previous if change else ''
+        if obj.status != previous and obj.status in ('confirmed', 'cancelled'):
+            obj._requested_status = obj.status
+            obj.status = previous
+        super().save_model(request, obj, form, change)
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        order = form.instance
+        status = getattr(order, '_requested_status', None)
+        # Оформление и смена статуса в обход склада попадают в журнал событий здесь,
+        # когда позиции уже сохранены; подтверждение и отмену записывает склад
+        if not change:
+            analytics.record_transitions([(order.id, '', 'new')])
+        elif not status:
+            analytics.record_transitions([(order.id, order._previous_status, order.status)])
+        if status == 'confirmed':
+            _, skipped = inventory.confirm_orders([order.id])
+            if skipped:
+                self.message_user(request, f'Заказ #{order.id} не подтвержден: {skipped[order.id]}', level='ERROR')
+        elif status == 'cancelled':
+            inventory.cancel_orders([order.id], order.cancellation_reason)
+        if status:
+            order.refresh_from_db()
     
     def confirm_orders(self, request, queryset):
         """Подтвердить выбранные заказы"""
-        updated = queryset.filter(status='new').update(status='confirmed')
-        self.message_user(request, f'Подтверждено {updated} заказов.')
+        confirmed, skipped = inventory.confirm_orders(queryset.filter(status='new').values_list('id', flat=True))
+        self.message_user(request, f'Подтверждено {len(confirmed)} заказов.')
+        if skipped:
+            details = '; '.join(f'#{order_id}: {reason}' for order_id, reason in list(skipped.items())[:10])
+            self.message_user(request, f'Не подтверждено {len(skipped)} заказов. {details}', level='WARNING')
     confirm_orders.short_description = "Подтвердить выбранные заказы"
     confirm_orders.allowed_permissions = ('change',)
     
@@ -64,10 +173,9 @@ class OrderAdmin(admin.ModelAdmin):
                     'action_name': 'cancel_orders',
                 })
             
-            # Используем queryset для обновления заказов
-            updated = queryset.filter(status__in=['new', 'confirmed']).update(
-                status='cancelled',
-                cancellation_reason=reason
+            # Списанные со склада товары возвращаются на склад
+            updated = inventory.cancel_orders(
+                queryset.filter(status__in=['new', 'confirmed']).values_list('id', flat=True), reason,
             )
             self.message_user(request, f'Отменено {updated} заказов с указанием причины.')
             # Возвращаем None - Django автоматически сделает редирект на changelist
@@ -82,3 +190,96 @@ class OrderAdmin(admin.ModelAdmin):
     cancel_orders.short_description = "Отменить заказ"
     cancel_orders.allowed_permissions = ('change',)
 
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    """Архив заказов только для чтения (orders/archive.py)"""
+    list_display = ['id', 'user', 'status', 'item_count', 'total_quantity', 'total_price_display', 'created_at', 'archived_at']
+    list_filter = ['status', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['=id', 'user__username', 'user__first_name', 'user__last_name']
+    fields = [
+        'id', 'user', 'status', 'cancellation_reason', 'created_at', 'updated_at', 'archived_at',
+        'item_count', 'total_quantity', 'total_price', 'items_display',
+    ]
+    readonly_fields = fields
+    
+    def total_price_display(self, obj):
+        return f"{obj.total_price:.2f} руб."
+    total_price_display.short_description = 'Общая стоимость'
+    total_price_display.admin_order_field = 'total_price'
+    
+    def items_display(self, obj):
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            ((item.product.name, item.quantity, item.price, item.get_total_price()) for item in obj.get_items()),
+        )
+        return format_html(
+            '<table><thead><tr><th>Товар</th><th>Количество</th><th>Цена</th><th>Сумма</th></tr></thead>'
+            '<tbody>{}</tbody></table>', rows,
+        )
+    items_display.short_description = 'Позиции'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """Журнал склада только для чтения: остаток меняется через товар и заказы"""
+    list_display = ['id', 'product', 'kind', 'quantity', 'reserved', 'order', 'comment', 'created_at']
+    list_filter = ['kind', 'created_at']
+    list_select_related = ['product', 'order__user']
+    search_fields = ['product__name', 'comment']
+    raw_id_fields = ['product', 'order']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """Сводка продаж по дням, категориям и товарам: читает только сводки (orders/analytics.py)"""
+    PERIODS = [7, 30, 90, 365]
+    DEFAULT_PERIOD = 30
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        try:
+            days = int(request.GET.get('days', self.DEFAULT_PERIOD))
+        except ValueError:
+            days = self.DEFAULT_PERIOD
+        if days not in self.PERIODS:
+            days = self.DEFAULT_PERIOD
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Сводка продаж',
+            'opts': self.model._meta,
+            'days': days,
+            'periods': self.PERIODS,
+            **analytics.dashboard(days),
+            **(extra_context or {}),
+        }
+        return render(request, 'admin/orders/sales_dashboard.html', context)
@@ -0,0 +1,247 @@
+"""
+Аналитика продаж: журнал событий заказов и дневные сводки.
+
+Каждый переход заказа в новый статус (оформлен, подтвержден, отменен)
+записывается строкой OrderEvent в той же транзакции, что и сам переход, -
+вместе с позициями заказа на этот момент. Сводки по дням, категориям и
+товарам (DailySales, CategorySales, ProductSales) досчитывает aggregate():
+берет события после отметки RollupWatermark, прибавляет их к сводкам и
+сдвигает отметку. Сводку ставит фоновая задача orders.aggregate_sales (не
+чаще раза в SALES_ROLLUP_INTERVAL секунд) и команда aggregate_sales, а
+страница сводки в админке читает только сводки - ее стоимость не зависит
+от числа заказов в истории.
+
+Событие попадает в день своего created_at: оформленные заказы и товары -
+в день оформления, выручка - в день подтверждения, отмена подтвержденного
+заказа вычитает выручку в день отмены.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from flower_shop import db
+from jobs import queue
+from main.models import Product
+from .models import CategorySales, DailySales, Order, OrderEvent, OrderItem, ProductSales, RollupWatermark
+
+WATERMARK = 'sales'
+METRICS = [
+    'orders_placed', 'orders_confirmed', 'orders_cancelled',
+    'ordered_quantity', 'sold_quantity', 'cancelled_quantity', 'revenue',
+]
+
+
+def event(order_id, previous, status, lines, created_at=None):
+    """Событие перехода заказа; lines - тройки (id товара, количество, цена)"""
+    lines = [[product_id, quantity, str(price)] for product_id, quantity, price in lines]
+    return OrderEvent(
+        order_id=order_id, previous_status=previous or '', status=status,
+        total_price=sum((quantity * Decimal(price) for _, quantity, price in lines), Decimal('0')),
+        lines=lines, created_at=created_at or timezone.now(),
+    )
+
+
+def _order_lines(order_ids):
+    """Позиции заказов: {id заказа: [(id товара, количество, цена)]}"""
+    lines = defaultdict(list)
+    for order_id, product_id, quantity, price in (
+        OrderItem.objects.filter(order_id__in=list(order_ids)).order_by('id')
+        .values_list('order_id', 'product_id', 'quantity', 'price')
+    ):
+        lines[order_id].append((product_id, quantity, price))
+    return lines
+
+
+def record(events):
+    """Добавляет события в журнал и ставит досчет сводок"""
+    events = list(events)
+    if not events:
+        return
+    OrderEvent.objects.bulk_create(events, batch_size=settings.SALES_ROLLUP_BATCH_SIZE)
+    # Одна задача на интервал: события, записанные за это время, сводятся вместе
+    interval = settings.SALES_ROLLUP_INTERVAL
+    slot = int(time.time() // interval) + 1
+    queue.enqueue(
+        'orders.aggregate_sales', key=f'orders.aggregate_sales:{slot}',
+        delay=slot * interval - time.time() + settings.SALES_ROLLUP_LAG,
+    )
+
+
+def record_transitions(transitions):
+    """Записывает переходы заказов; transitions - тройки (id заказа, прежний статус, новый статус)"""
+    transitions = [(order_id, previous, status) for order_id, previous, status in transitions if previous != status]
+    if not transitions:
+        return
+    lines = _order_lines(order_id for order_id, _, _ in transitions)
+    record(event(order_id, previous, status, lines[order_id]) for order_id, previous, status in transitions)
+
+
+def record_history(order_ids):
+    """События заказов, созданных в обход журнала (bulk_create): оформление в
+    created_at и текущий статус в updated_at"""
+    order_ids = list(order_ids)
+    batch_size = settings.SALES_ROLLUP_BATCH_SIZE
+    for start in range(0, len(order_ids), batch_size):
+        orders = list(
+            Order.objects.filter(id__in=order_ids[start:start + batch_size]).order_by('id')
+            .values_list('id', 'status', 'created_at', 'updated_at')
+        )
+        lines = _order_lines(order_id for order_id, _, _, _ in orders)
+        events = []
+        for order_id, status, created_at, updated_at in orders:
+            events.append(event(order_id, '', 'new', lines[order_id], created_at))
+            if status != 'new':
+                events.append(event(order_id, 'new', status, lines[order_id], updated_at))
+        record(events)
+
+
+def _contributions(event):
+    """Вклад события в показатели: (число заказов, {id товара: показатели товара})"""
+    placed = not event.previous_status
+    orders = {
+        'orders_placed': int(placed),
+        'orders_confirmed': int(event.status == 'confirmed'),
+        'orders_cancelled': int(event.status == 'cancelled'),
+    }
+    # Подтверждение добавляет продажу, уход из подтвержденного статуса - вычитает
+    sign = (event.status == 'confirmed') - (event.previous_status == 'confirmed')
+    products = defaultdict(lambda: defaultdict(int))
+    for product_id, quantity, price in event.lines:
+        metrics = products[product_id]
+        metrics['ordered_quantity'] += quantity if placed else 0
+        metrics['cancelled_quantity'] += quantity if event.status == 'cancelled' else 0
+        metrics['sold_quantity'] += sign * quantity
+        metrics['revenue'] += sign * quantity * Decimal(price)
+    return orders, products
+
+
+def _add(model, key_fields, deltas):
+    """Прибавляет показатели к строкам сводки; deltas - {ключ: показатели}.
+    Вызывается под блокировкой отметки, поэтому строки сводок никто не меняет"""
+    if not deltas:
+        return
+    # Строки читаются по дням: IN сразу по дням и товарам захватил бы строки
+    # всех товаров пачки за все ее дни
+    by_day = defaultdict(list)
+    for key in deltas:
+        by_day[key[0]].append(key)
+    current = {}
+    for day, keys in sorted(by_day.items()):
+        lookup = {f'{field}__in': {key[index] for key in keys} for index, field in enumerate(key_fields) if index}
+        for row in model.objects.filter(day=day, **lookup).values(*key_fields, *METRICS):
+            current[tuple(row[field] for field in key_fields)] = row
+    rows = []
+    for key, metrics in deltas.items():
+        row = model(**dict(zip(key_fields, key)))
+        for name in METRICS:
+            setattr(row, name, current.get(key, {}).get(name, 0) + metrics.get(name, 0))
+        rows.append(row)
+    # Новые строки добавляются, существующие получают новые суммы - одним INSERT ... ON CONFLICT
+    model.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=key_fields, update_fields=METRICS,
+        batch_size=settings.SALES_ROLLUP_BATCH_SIZE,
+    )
+
+
+def _aggregate_batch(batch_size):
+    """Сводит очередную пачку событий; возвращает их число"""
+    with transaction.atomic():
+        db.begin_write()
+        # Блокировка отметки: одновременные сводки не учтут события дважды
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        events = list(OrderEvent.objects.filter(id__gt=watermark.last_event_id).order_by('id')[:batch_size])
+        cutoff = timezone.now() - timedelta(seconds=settings.SALES_ROLLUP_LAG)
+        for index, item in enumerate(events):
+            if item.created_at > cutoff:
+                events = events[:index]
+                break
+        if not events:
+            return 0
+
+        categories = dict(
+            Product.objects.filter(id__in={line[0] for item in events for line in item.lines})
+            .values_list('id', 'category_id')
+        )
+        daily = defaultdict(lambda: defaultdict(int))
+        by_category = defaultdict(lambda: defaultdict(int))
+        by_product = defaultdict(lambda: defaultdict(int))
+        for item in events:
+            day = timezone.localdate(item.created_at)
+            orders, products = _contributions(item)
+            product_ids, category_ids = set(), set()
+            for product_id, metrics in products.items():
+                for name, value in metrics.items():
+                    daily[(day,)][name] += value
+                # Удаленные товары остаются только в сводке по дням
+                if product_id not in categories:
+                    continue
+                product_ids.add(product_id)
+                category_ids.add(categories[product_id])
+                for name, value in metrics.items():
+                    by_product[day, product_id][name] += value
+                    by_category[day, categories[product_id]][name] += value
+            # Заказ считается в товаре и категории один раз, сколько бы позиций в них ни было
+            for rollup, keys in (
+                (daily, [(day,)]),
+                (by_product, [(day, product_id) for product_id in product_ids]),
+                (by_category, [(day, category_id) for category_id in category_ids]),
+            ):
+                for key in keys:
+                    for name, value in orders.items():
+                        rollup[key][name] += value
+
+        _add(DailySales, ['day'], daily)
+        _add(CategorySales, ['day', 'category_id'], by_category)
+        _add(ProductSales, ['day', 'product_id'], by_product)
+        watermark.last_event_id = events[-1].id
+        watermark.save()
+    return len(events)
+
+
+def aggregate(batch_size=None):
+    """Сводит новые события в дневные сводки; возвращает число событий"""
+    batch_size = batch_size or settings.SALES_ROLLUP_BATCH_SIZE
+    processed = 0
+    while True:
+        count = _aggregate_batch(batch_size)
+        processed += count
+        if count < batch_size:
+            return processed
+
+
+def rebuild(batch_size=None):
+    """Пересчитывает сводки заново по всему журналу событий"""
+    with transaction.atomic():
+        RollupWatermark.objects.update_or_create(name=WATERMARK, defaults={'last_event_id': 0})
+        DailySales.objects.all().delete()
+        CategorySales.objects.all().delete()
+        ProductSales.objects.all().delete()
+    return aggregate(batch_size)
+
+
+def dashboard(days):
+    """Данные страницы сводки за последние days дней - только из сводок"""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    # Суммы называются total_*: имя аннотации не может совпадать с полем
+    sums = {f'total_{name}': Sum(name) for name in METRICS}
+    watermark = RollupWatermark.objects.filter(name=WATERMARK).first()
+    return {
+        'since': since,
+        'totals': DailySales.objects.filter(day__gte=since).aggregate(**sums),
+        'daily': list(DailySales.objects.filter(day__gte=since).order_by('-day')),
+        'categories': list(
+            CategorySales.objects.filter(day__gte=since).values('category_id', 'category__name')
+            .annotate(**sums).order_by('-total_revenue', 'category__name')
+        ),
+        'products': list(
+            ProductSales.objects.filter(day__gte=since).values('product_id', 'product__name')
+            .annotate(**sums).order_by('-total_revenue', 'product__name')[:50]
+        ),
+        'updated_at': watermark.updated_at if watermark else None,
+    }
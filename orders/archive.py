@@ -0,0 +1,85 @@
+"""
+Архив заказов.
+
+Подтвержденные и отмененные заказы старше ORDERS_ARCHIVE_AFTER_DAYS дней
+переносятся в ArchivedOrder: одна строка на заказ, позиции (с названиями
+товаров) - в JSON этой же строки. Перенос идет пачками, каждая пачка -
+отдельная короткая транзакция: заказы пачки блокируются, копируются в
+архив и удаляются вместе с позициями, так что рабочие таблицы Order и
+OrderItem содержат только свежие заказы.
+
+Архив читается по требованию: личный кабинет показывает его отдельной
+вкладкой, позиции архивного заказа отдает тот же адрес, что и позиции
+обычного, а админка открывает архивный заказ по его прежнему номеру.
+Журнал склада и события заказов остаются, но теряют ссылку на заказ.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from flower_shop import db
+from .models import ArchivedOrder, Order, OrderItem
+
+CLOSED_STATUSES = ['confirmed', 'cancelled']
+
+
+def archivable(days=None):
+    """Заказы, которые можно перенести в архив"""
+    cutoff = timezone.now() - timedelta(days=settings.ORDERS_ARCHIVE_AFTER_DAYS if days is None else days)
+    return Order.objects.filter(status__in=CLOSED_STATUSES, created_at__lt=cutoff)
+
+
+def _archive_batch(queryset, batch_size):
+    """Переносит в архив очередную пачку заказов; возвращает их число"""
+    with transaction.atomic():
+        db.begin_write()
+        orders = list(queryset.select_for_update().order_by('created_at', 'id')[:batch_size])
+        if not orders:
+            return 0
+        items = {order.id: [] for order in orders}
+        for order_id, product_id, name, quantity, price in (
+            OrderItem.objects.filter(order_id__in=list(items)).order_by('id')
+            .values_list('order_id', 'product_id', 'product__name', 'quantity', 'price')
+        ):
+            items[order_id].append([product_id, name, quantity, str(price)])
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=order.id, user_id=order.user_id, status=order.status, created_at=order.created_at,
+                updated_at=order.updated_at, cancellation_reason=order.cancellation_reason,
+                total_price=order.total_price, total_quantity=order.total_quantity,
+                item_count=order.item_count, items=items[order.id],
+            )
+            for order in orders
+        ])
+        # Позиции удаляются вместе с заказами; итоги не пересчитываются (см. update_order_totals)
+        Order.objects.filter(id__in=list(items)).delete()
+    return len(orders)
+
+
+def archive_orders(days=None, batch_size=None, pause=0, limit=None):
+    """Переносит закрытые заказы старше days дней в архив; возвращает число
+    перенесенных. pause - пауза между пачками (секунды), limit - не больше
+    limit заказов за запуск"""
+    batch_size = batch_size or settings.ORDERS_ARCHIVE_BATCH_SIZE
+    queryset = archivable(days)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        count = _archive_batch(queryset, size)
+        archived += count
+        if count < size:
+            break
+        if pause:
+            time.sleep(pause)
+    return archived
+
+
+def find_order(order_id, **filters):
+    """Заказ по номеру: рабочий (Order) или архивный (ArchivedOrder); None, если нет"""
+    return (
+        Order.objects.filter(id=order_id, **filters).first()
+        or ArchivedOrder.objects.filter(id=order_id, **filters).first()
+    )
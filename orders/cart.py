@@ -0,0 +1,360 @@
+"""
+Хранилища корзин.
+
+Представления работают с корзиной через get_cart(request), а где она
+хранится, задает настройка CART_STORAGE:
+
+- CacheCartStorage - корзина лежит в кеше CART_CACHE_ALIAS, изменение
+  корзины - одна запись в кеш. Корзины покупателей попадают в таблицу
+  Cart пачками (write-behind): измененные корзины отмечаются в списке
+  "грязных", и flush_dirty() записывает их разом - когда список дорос до
+  CART_FLUSH_BATCH_SIZE, прошло CART_FLUSH_INTERVAL секунд или запущена
+  команда flush_carts. Если корзины нет в кеше, она читается из таблицы.
+- DatabaseCartStorage - каждая запись сразу идет в таблицу Cart.
+
+Корзина анонимного посетителя живет в кеше (или в сессии при
+DatabaseCartStorage) и при входе складывается с корзиной покупателя.
+Оформление заказа получает корзину из хранилища и удаляет строки Cart
+покупателя, поэтому отложенная запись ему не нужна.
+
+CacheCartStorage нужен общий кеш (Redis, Memcached): с кешем в памяти
+процесса (LocMemCache) у каждого процесса свои корзины, поэтому по
+умолчанию с ним работает DatabaseCartStorage. Если кеш вытеснит корзину
+до записи, теряются изменения не больше чем за CART_FLUSH_INTERVAL
+секунд. Id анонимной корзины попадает в сессию только при первой записи:
+чтение пустой корзины не создает сессию.
+
+Значок корзины в шапке читает число позиций из cookie cart_count, а не
+запросом на каждой странице: его записывает CartCountMiddleware
+(orders/middleware.py) в ответ на изменение корзины, вход и выход.
+"""
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from flower_shop import db
+from main.models import Product
+from .models import Cart
+
+DIRTY_KEY = 'cart:dirty'
+FLUSHED_KEY = 'cart:flushed_at'
+# Ключ сессии с id анонимной корзины в кеше; id переживает смену ключа сессии при входе
+SESSION_CART_ID = 'cart_id'
+SESSION_CART = 'cart'
+# Cookie с числом позиций корзины для значка в шапке
+COUNT_COOKIE = 'cart_count'
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartLine:
+    """Позиция корзины: товар и количество"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def id(self):
+        return self.product.id
+
+    def get_total_price(self):
+        """Общая стоимость позиции"""
+        return self.quantity * self.product.price
+
+
+class BaseCartStorage:
+    """Корзина текущего посетителя: {id товара: количество} в порядке добавления"""
+
+    def __init__(self, request, user=None):
+        self.request = request
+        user = user or getattr(request, 'user', None)
+        self.user = user if user is not None and user.is_authenticated else None
+        self._items = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def write(self, items, changed):
+        """Сохраняет корзину items; changed - id товаров, которые изменились"""
+        raise NotImplementedError
+
+    def items(self):
+        if self._items is None:
+            self._items = self.load()
+        return self._items
+
+    def _save(self, items, changed):
+        self._items = items
+        self.write(items, changed)
+        remember_count(self.request, len(items))
+
+    def apply(self, changes):
+        """Задает количества товаров одной записью: {id товара: количество},
+        0 и меньше - удалить товар из корзины"""
+        items = dict(self.items())
+        for product_id, quantity in changes.items():
+            if quantity > 0:
+                items[product_id] = quantity
+            else:
+                items.pop(product_id, None)
+        self._save(items, list(changes))
+
+    def add(self, product_id, quantity):
+        self.apply({product_id: self.quantity(product_id) + quantity})
+
+    def update(self, product_id, quantity):
+        """Задает количество товара; 0 и меньше - удаляет товар из корзины"""
+        self.apply({product_id: quantity})
+
+    def remove(self, product_id):
+        self.update(product_id, 0)
+
+    def clear(self):
+        self._save({}, list(self.items()))
+
+    def merge(self, items):
+        """Добавляет товары другой корзины (анонимной - при входе)"""
+        if not items:
+            return
+        merged = dict(self.items())
+        for product_id, quantity in items.items():
+            merged[product_id] = merged.get(product_id, 0) + quantity
+        self._save(merged, list(items))
+
+    def quantity(self, product_id):
+        return self.items().get(product_id, 0)
+
+    def count(self):
+        """Число позиций в корзине"""
+        return len(self.items())
+
+    def summary(self):
+        """Число позиций, товаров и сумма корзины - одним агрегирующим запросом"""
+        items = self.items()
+        if not items:
+            return {'count': 0, 'quantity': 0, 'total': Decimal('0.00')}
+        # Количества известны только хранилищу: подставляются в запрос через CASE по id товара
+        quantities = [When(id=product_id, then=Value(quantity)) for product_id, quantity in items.items()]
+        row = Product.objects.filter(id__in=list(items)).aggregate(
+            count=Count('id'),
+            total_quantity=Sum(Case(*quantities, output_field=IntegerField())),
+            total=Sum(F('price') * Case(*quantities, output_field=IntegerField()), output_field=MONEY),
+        )
+        return _summary(row)
+
+    def lines(self):
+        """Позиции с товарами - одним запросом; снятые с продажи товары пропускаются"""
+        items = self.items()
+        products = Product.objects.select_related('category').in_bulk(list(items))
+        return [CartLine(products[product_id], quantity) for product_id, quantity in items.items() if product_id in products]
+
+    def flush(self):
+        """Записывает корзину покупателя в таблицу Cart"""
+
+    def pop_anonymous(self):
+        """Забирает анонимную корзину этой сессии (после входа); {} - если ее нет"""
+        items = self.request.session.pop(SESSION_CART, None) or {}
+        return {int(product_id): quantity for product_id, quantity in items.items()}
+
+    @classmethod
+    def flush_dirty(cls):
+        """Записывает в таблицу Cart все измененные корзины; возвращает их число"""
+        return 0
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    """Корзины покупателей - сразу в таблице Cart, анонимные - в сессии"""
+
+    def load(self):
+        if self.user is None:
+            return {int(product_id): quantity for product_id, quantity in self.request.session.get(SESSION_CART, {}).items()}
+        return dict(Cart.objects.filter(user=self.user).order_by('id').values_list('product_id', 'quantity'))
+
+    def summary(self):
+        if self.user is None:
+            return super().summary()
+        row = Cart.objects.filter(user=self.user).aggregate(
+            count=Count('id'), total_quantity=Sum('quantity'),
+            total=Sum(F('quantity') * F('product__price'), output_field=MONEY),
+        )
+        return _summary(row)
+
+    def write(self, items, changed):
+        if self.user is None:
+            self.request.session[SESSION_CART] = {str(product_id): quantity for product_id, quantity in items.items()}
+            return
+        if not items:
+            # Очистка (например, после оформления заказа) - один DELETE без сравнения строк
+            Cart.objects.filter(user=self.user).delete()
+            return
+        write_carts({self.user.id: items}, {self.user.id: changed})
+
+
+class CacheCartStorage(BaseCartStorage):
+    """Корзины в кеше, в таблицу Cart - пачками"""
+
+    def __init__(self, request, user=None):
+        super().__init__(request, user)
+        self.cache = caches[settings.CART_CACHE_ALIAS]
+
+    def key(self, create=False):
+        """Ключ корзины в кеше; None - у посетителя еще нет корзины (create - завести ее)"""
+        if self.user is not None:
+            return user_key(self.user.id)
+        cart_id = self.request.session.get(SESSION_CART_ID)
+        if cart_id is None:
+            if not create:
+                return None
+            cart_id = self.request.session[SESSION_CART_ID] = uuid.uuid4().hex
+        return f'cart:anonymous:{cart_id}'
+
+    def load(self):
+        key = self.key()
+        if key is None:
+            return {}
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry['items']
+        if self.user is None:
+            return {}
+        items = dict(Cart.objects.filter(user=self.user).order_by('id').values_list('product_id', 'quantity'))
+        # add(): корзина, уже записанная параллельным запросом, не затирается
+        self.cache.add(self.key(), {'items': items, 'version': 0, 'dirty': False}, settings.CART_CACHE_TIMEOUT)
+        return items
+
+    def write(self, items, changed):
+        key = self.key(create=True)
+        entry = self.cache.get(key) or {'version': 0}
+        self.cache.set(
+            key, {'items': items, 'version': entry['version'] + 1, 'dirty': self.user is not None},
+            settings.CART_CACHE_TIMEOUT,
+        )
+        if self.user is not None:
+            self._mark_dirty()
+
+    def _mark_dirty(self):
+        # Список обновляется без блокировки и может потерять id при гонке; отметка
+        # dirty в самой корзине остается, и следующая запись вернет id в список
+        dirty = self.cache.get(DIRTY_KEY) or set()
+        dirty.add(self.user.id)
+        self.cache.set(DIRTY_KEY, dirty, None)
+        flushed_at = self.cache.get(FLUSHED_KEY)
+        if flushed_at is None:
+            self.cache.add(FLUSHED_KEY, time.time(), None)
+        elif len(dirty) >= settings.CART_FLUSH_BATCH_SIZE or time.time() - flushed_at >= settings.CART_FLUSH_INTERVAL:
+            self.flush_dirty()
+
+    def flush(self):
+        if self.user is not None:
+            _flush(self.cache, [self.user.id])
+
+    def pop_anonymous(self):
+        cart_id = self.request.session.pop(SESSION_CART_ID, None)
+        if cart_id is None:
+            return {}
+        key = f'cart:anonymous:{cart_id}'
+        entry = self.cache.get(key)
+        self.cache.delete(key)
+        return entry['items'] if entry else {}
+
+    @classmethod
+    def flush_dirty(cls):
+        cache = caches[settings.CART_CACHE_ALIAS]
+        cache.set(FLUSHED_KEY, time.time(), None)
+        return _flush(cache, list(cache.get(DIRTY_KEY) or ()))
+
+
+def _summary(row):
+    total = (row['total'] or Decimal('0')).quantize(Decimal('0.01'))
+    return {'count': row['count'], 'quantity': row['total_quantity'] or 0, 'total': total}
+
+
+def user_key(user_id):
+    return f'cart:user:{user_id}'
+
+
+def _flush(cache, user_ids):
+    """Записывает корзины покупателей user_ids из кеша в таблицу Cart"""
+    if not user_ids:
+        return 0
+    entries = cache.get_many([user_key(user_id) for user_id in user_ids])
+    flushed = {
+        user_id: entries[user_key(user_id)] for user_id in user_ids
+        if user_key(user_id) in entries and entries[user_key(user_id)]['dirty']
+    }
+    write_carts({user_id: entry['items'] for user_id, entry in flushed.items()})
+
+    # Отметка снимается, только если корзину не изменили во время записи
+    current = cache.get_many([user_key(user_id) for user_id in flushed])
+    changed = {
+        user_id for user_id, entry in flushed.items()
+        if current.get(user_key(user_id), {}).get('version') != entry['version']
+    }
+    cache.set_many({
+        user_key(user_id): {**entry, 'dirty': False}
+        for user_id, entry in flushed.items() if user_id not in changed
+    }, settings.CART_CACHE_TIMEOUT)
+    dirty = cache.get(DIRTY_KEY) or set()
+    cache.set(DIRTY_KEY, dirty - (set(user_ids) - changed), None)
+    return len(flushed)
+
+
+def write_carts(carts, changed=None):
+    """Приводит строки Cart покупателей к carts ({id пользователя: {id товара: количество}})
+    тремя запросами на пачку: удаление, обновление, вставка.
+    changed ограничивает сравнение товарами, которые могли измениться."""
+    if not carts:
+        return
+    with transaction.atomic():
+        db.begin_write()
+        rows = Cart.objects.filter(user_id__in=list(carts))
+        if changed is not None:
+            product_ids = {product_id for ids in changed.values() for product_id in ids}
+            rows = rows.filter(product_id__in=product_ids)
+        existing = {(user_id, product_id): (row_id, quantity) for row_id, user_id, product_id, quantity in (
+            rows.values_list('id', 'user_id', 'product_id', 'quantity')
+        )}
+        now = timezone.now()
+        delete, update, create = [], [], []
+        for (user_id, product_id), (row_id, quantity) in existing.items():
+            wanted = carts[user_id].get(product_id, 0)
+            if wanted <= 0:
+                delete.append(row_id)
+            elif wanted != quantity:
+                update.append(Cart(id=row_id, quantity=wanted, updated_at=now))
+        for user_id, items in carts.items():
+            for product_id, quantity in items.items():
+                if quantity > 0 and (user_id, product_id) not in existing:
+                    if changed is None or product_id in changed[user_id]:
+                        create.append(Cart(user_id=user_id, product_id=product_id, quantity=quantity))
+        if create:
+            # Товар могли удалить из каталога, пока корзина ждала записи
+            products = set(Product.objects.filter(id__in={row.product_id for row in create}).values_list('id', flat=True))
+            create = [row for row in create if row.product_id in products]
+        Cart.objects.filter(id__in=delete).delete()
+        Cart.objects.bulk_update(update, ['quantity', 'updated_at'], batch_size=500)
+        # ignore_conflicts: ту же строку мог вставить параллельный запрос
+        Cart.objects.bulk_create(create, batch_size=500, ignore_conflicts=True)
+
+
+def remember_count(request, count):
+    """Число позиций корзины, которое CartCountMiddleware запишет в cookie"""
+    request._cart_count = count
+
+
+def storage_class():
+    return import_string(settings.CART_STORAGE)
+
+
+def get_cart(request):
+    """Корзина текущего посетителя; одна на запрос"""
+    if not hasattr(request, '_cart'):
+        request._cart = storage_class()(request)
+    return request._cart
@@ -0,0 +1,315 @@
+"""
+Складской учет: журнал движений, снимки остатков, подтверждение и отмена
+заказов.
+
+Любое изменение остатка - новая строка StockMovement: поступление,
+резерв под заказ при оформлении, списание при подтверждении, возврат при
+отмене, корректировка (изменение stock_quantity в админке). Строки только
+добавляются, поэтому запись не упирается в блокировку строки товара.
+
+Остаток товара - снимок StockSnapshot (суммы движений до
+last_movement_id) плюс движения после него. Снимки "докатывает"
+roll_forward() - фоновая задача orders.roll_forward, которая ставится в
+очередь (jobs) в той же транзакции, что и изменение остатка (одна задача
+на STOCK_ROLL_INTERVAL секунд докатывает все товары с движениями после
+отметки RollupWatermark "stock"), - и команда reconcile_inventory, так
+что хвост после снимка короткий и чтение остатка стоит постоянное число
+запросов. При докатке Product.stock_quantity и is_available получают
+значения из журнала: это копия для витрины, фильтров и админки.
+
+Флаг Order.stock_deducted делает операции с заказами идемпотентными:
+заказ списывается один раз, сколько бы раз его ни подтверждали, и
+возвращается на склад, только если был списан. Число запросов не зависит
+от числа заказов. Смена статуса записывается в журнал событий заказов
+(orders/analytics.py).
+
+Массовая запись stock_quantity в обход save() (импорт, генератор данных)
+не попадает в журнал; record_untracked_changes() превращает такие
+расхождения в корректировки. В PostgreSQL движение, закоммиченное позже
+докатки с большим id, может не попасть в снимок - такие расхождения
+находит и исправляет reconcile_inventory.
+"""
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from flower_shop import db
+from jobs import queue
+from main import bulk
+from main.models import Product
+from . import analytics
+from .models import Order, OrderItem, RollupWatermark, StockMovement, StockSnapshot
+
+# Товаров в одном запросе с IN (...) и в одном bulk_update()
+BATCH_SIZE = 2000
+# Отметка докатки: движения остатка до нее уже докатаны в снимки
+WATERMARK = 'stock'
+
+
+def _batches(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def _tail(product_ids, bound=None):
+    """Суммы движений после снимков: {id товара: (остаток, резерв)}"""
+    last = StockSnapshot.objects.filter(product=OuterRef('product_id')).values('last_movement_id')
+    movements = StockMovement.objects.filter(product_id__in=product_ids, id__gt=Coalesce(Subquery(last), Value(0)))
+    if bound is not None:
+        movements = movements.filter(id__lte=bound)
+    rows = movements.values('product_id').annotate(on_hand=Sum('quantity'), reserved=Sum('reserved')).order_by()
+    return {row['product_id']: (row['on_hand'], row['reserved']) for row in rows}
+
+
+def balances(product_ids):
+    """Точные остаток и резерв товаров: {id товара: (остаток, резерв)}"""
+    result = {}
+    for batch in _batches(product_ids):
+        result.update((product_id, (0, 0)) for product_id in batch)
+        for product_id, on_hand, reserved in (
+            StockSnapshot.objects.filter(product_id__in=batch).values_list('product_id', 'on_hand', 'reserved')
+        ):
+            result[product_id] = (on_hand, reserved)
+        for product_id, (on_hand, reserved) in _tail(batch).items():
+            result[product_id] = (result[product_id][0] + on_hand, result[product_id][1] + reserved)
+    return result
+
+
+def record(movements):
+    """Добавляет движения в журнал; снимки докатывает фоновая задача"""
+    movements = [movement for movement in movements if movement.quantity or movement.reserved]
+    if not movements:
+        return
+    StockMovement.objects.bulk_create(movements, batch_size=BATCH_SIZE)
+    # Резерв при оформлении не меняет остаток: его докатит следующее движение
+    # остатка или reconcile_inventory, а оформление заказа обходится без записи снимков
+    if any(movement.quantity for movement in movements):
+        # Одна задача на интервал: движения, записанные за это время, докатываются вместе
+        interval = settings.STOCK_ROLL_INTERVAL
+        slot = int(time.time() // interval) + 1
+        queue.enqueue('orders.roll_forward', key=f'orders.roll_forward:{slot}', delay=slot * interval - time.time())
+
+
+def roll_forward(product_ids=None):
+    """Переносит движения после снимков в снимки и stock_quantity товаров;
+    возвращает число обновленных снимков"""
+    with transaction.atomic():
+        db.begin_write()
+        if product_ids is None:
+            product_ids = Product.objects.values_list('id', flat=True)
+        rolled = 0
+        for batch in _batches(product_ids):
+            pending = list(_tail(batch))
+            if not pending:
+                continue
+            StockSnapshot.objects.bulk_create(
+                [StockSnapshot(product_id=product_id) for product_id in pending], ignore_conflicts=True,
+            )
+            # Блокировка снимков в порядке id: одновременная докатка не учтет движения дважды
+            snapshots = list(StockSnapshot.objects.select_for_update().filter(product_id__in=pending).order_by('product_id'))
+            # Граница - после блокировки: докатка, начатая раньше, но получившая
+            # блокировку позже, не сдвинет last_movement_id назад
+            bound = StockMovement.objects.aggregate(last=Max('id'))['last'] or 0
+            snapshots = [snapshot for snapshot in snapshots if snapshot.last_movement_id < bound]
+            tail = _tail(pending, bound)
+            for snapshot in snapshots:
+                on_hand, reserved = tail.get(snapshot.product_id, (0, 0))
+                snapshot.on_hand += on_hand
+                snapshot.reserved += reserved
+                snapshot.last_movement_id = max(snapshot.last_movement_id, bound)
+                snapshot.updated_at = timezone.now()
+            StockSnapshot.objects.bulk_update(snapshots, ['on_hand', 'reserved', 'last_movement_id', 'updated_at'])
+            rolled += len(snapshots)
+            _sync_products({snapshot.product_id: snapshot.on_hand for snapshot in snapshots})
+    return rolled
+
+
+def roll_forward_pending():
+    """Докатывает товары, остаток которых менялся после отметки докатки;
+    возвращает число обновленных снимков"""
+    with transaction.atomic():
+        db.begin_write()
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        bound = StockMovement.objects.aggregate(last=Max('id'))['last'] or 0
+        product_ids = (
+            StockMovement.objects.filter(id__gt=watermark.last_event_id, id__lte=bound).exclude(quantity=0)
+            .values_list('product_id', flat=True).distinct().order_by()
+        )
+        rolled = roll_forward(sorted(product_ids))
+        watermark.last_event_id = bound
+        watermark.save()
+    return rolled
+
+
+def _sync_products(on_hand):
+    """Копирует остатки из снимков в Product.stock_quantity и is_available"""
+    # Отрицательный остаток в журнале - ошибка учета, ее покажет reconcile_inventory
+    on_hand = {product_id: max(quantity, 0) for product_id, quantity in on_hand.items()}
+    current = list(Product.objects.filter(id__in=list(on_hand)).values_list('id', 'stock_quantity'))
+    changed = [
+        Product(id=product_id, stock_quantity=on_hand[product_id], is_available=on_hand[product_id] > 0)
+        for product_id, stock in current if stock != on_hand[product_id]
+    ]
+    if not changed:
+        return
+    Product.objects.bulk_update(changed, ['stock_quantity', 'is_available'])
+    stock = dict(current)
+    flipped = [product.id for product in changed if (stock[product.id] > 0) != product.is_available]
+    product_ids = [product.id for product in changed]
+    transaction.on_commit(lambda: bulk.stock_changed(product_ids, flipped))
+
+
+def adjust(product_id, quantity, comment=''):
+    """Корректировка: остаток товара становится равным quantity"""
+    on_hand, _ = balances([product_id])[product_id]
+    record([StockMovement(product_id=product_id, kind='adjustment', quantity=quantity - on_hand, comment=comment)])
+
+
+def untracked_changes(product_ids=None):
+    """Товары, у которых stock_quantity изменен в обход журнала (bulk_create,
+    update): {id товара: (stock_quantity, остаток по журналу)}"""
+    if product_ids is None:
+        product_ids = Product.objects.values_list('id', flat=True)
+    result = {}
+    for batch in _batches(product_ids):
+        ledger = balances(batch)
+        for product_id, stock in Product.objects.filter(id__in=batch).values_list('id', 'stock_quantity'):
+            if stock != ledger[product_id][0]:
+                result[product_id] = (stock, ledger[product_id][0])
+    return result
+
+
+def record_untracked_changes(product_ids=None):
+    """Записывает изменения stock_quantity в обход журнала корректировками;
+    возвращает число корректировок"""
+    changes = untracked_changes(product_ids)
+    record(
+        StockMovement(
+            product_id=product_id, kind='adjustment', quantity=stock - on_hand, comment='Изменение остатка вне журнала',
+        )
+        for product_id, (stock, on_hand) in changes.items()
+    )
+    return len(changes)
+
+
+def reserve(order, items):
+    """Резервирует товары под оформленный заказ; items - пары (id товара, количество)"""
+    record(
+        StockMovement(product_id=product_id, kind='reservation', reserved=quantity, order=order)
+        for product_id, quantity in items
+    )
+
+
+def _reserved_by_order(order_ids):
+    """Резерв заказов: {(id заказа, id товара): количество}"""
+    rows = (
+        StockMovement.objects.filter(order_id__in=order_ids)
+        .values('order_id', 'product_id').annotate(reserved=Sum('reserved')).order_by()
+    )
+    return {(row['order_id'], row['product_id']): row['reserved'] for row in rows if row['reserved']}
+
+
+def _lock_products(product_ids):
+    """Блокирует строки товаров в порядке id до конца транзакции"""
+    list(Product.objects.select_for_update().filter(id__in=list(product_ids)).order_by('id').values_list('id'))
+
+
+def confirm_orders(order_ids):
+    """Подтверждает заказы и списывает товары со склада.
+
+    Заказы подтверждаются по порядку id, пока товаров хватает; остальные
+    остаются как были. Возвращает (id подтвержденных заказов,
+    {id заказа: причина, по которой он не подтвержден}).
+    """
+    with transaction.atomic():
+        db.begin_write()
+        orders = list(
+            Order.objects.select_for_update().filter(id__in=list(order_ids))
+            .exclude(status='cancelled').order_by('id').values_list('id', 'stock_deducted', 'status')
+        )
+        statuses = {order_id: status for order_id, _, status in orders}
+        # Уже списанные заказы только меняют статус
+        confirmed = [order_id for order_id, deducted, _ in orders if deducted]
+        pending = [order_id for order_id, deducted, _ in orders if not deducted]
+
+        items = defaultdict(lambda: defaultdict(int))
+        for order_id, product_id, quantity in (
+            OrderItem.objects.filter(order_id__in=pending).values_list('order_id', 'product_id', 'quantity')
+        ):
+            items[order_id][product_id] += quantity
+        product_ids = {product_id for need in items.values() for product_id in need}
+        _lock_products(product_ids)
+        remaining = {product_id: on_hand for product_id, (on_hand, _) in balances(product_ids).items()}
+        reserved = _reserved_by_order(pending)
+
+        movements, deducted, skipped = [], [], {}
+        for order_id in pending:
+            need = items[order_id]
+            short = [product_id for product_id, quantity in need.items() if quantity > remaining.get(product_id, 0)]
+            if short:
+                skipped[order_id] = 'недостаточно товара на складе (id товаров: %s)' % ', '.join(map(str, short))
+                continue
+            for product_id, quantity in need.items():
+                remaining[product_id] -= quantity
+                movements.append(StockMovement(
+                    product_id=product_id, kind='confirmation', quantity=-quantity,
+                    reserved=-reserved.get((order_id, product_id), 0), order_id=order_id,
+                ))
+            deducted.append(order_id)
+
+        record(movements)
+        now = timezone.now()
+        Order.objects.filter(id__in=deducted).update(status='confirmed', stock_deducted=True, updated_at=now)
+        Order.objects.filter(id__in=confirmed).exclude(status='confirmed').update(status='confirmed', updated_at=now)
+        analytics.record_transitions(
+            (order_id, statuses[order_id], 'confirmed') for order_id in confirmed + deducted
+        )
+    return confirmed + deducted, skipped
+
+
+def _release_movements(order_ids, deducted_ids, link_orders=True):
+    """Движения отмены: снятие резерва и возврат списанных товаров"""
+    changes = defaultdict(lambda: [0, 0])
+    for key, reserved in _reserved_by_order(order_ids).items():
+        changes[key][1] -= reserved
+    for order_id, product_id, quantity in (
+        OrderItem.objects.filter(order_id__in=deducted_ids).values_list('order_id', 'product_id', 'quantity')
+    ):
+        changes[order_id, product_id][0] += quantity
+    return [
+        StockMovement(
+            product_id=product_id, kind='cancellation', quantity=quantity, reserved=reserved,
+            order_id=order_id if link_orders else None,
+            comment='' if link_orders else f'Заказ #{order_id} удален',
+        )
+        for (order_id, product_id), (quantity, reserved) in sorted(changes.items())
+    ]
+
+
+def cancel_orders(order_ids, reason=''):
+    """Отменяет заказы: снимает резерв и возвращает на склад списанные товары;
+    возвращает число отмененных"""
+    with transaction.atomic():
+        db.begin_write()
+        orders = list(
+            Order.objects.select_for_update().filter(id__in=list(order_ids))
+            .exclude(status='cancelled').order_by('id').values_list('id', 'stock_deducted', 'status')
+        )
+        ids = [order_id for order_id, _, _ in orders]
+        record(_release_movements(ids, [order_id for order_id, deducted, _ in orders if deducted]))
+        Order.objects.filter(id__in=ids).update(
+            status='cancelled', cancellation_reason=reason, stock_deducted=False, updated_at=timezone.now(),
+        )
+        analytics.record_transitions((order_id, status, 'cancelled') for order_id, _, status in orders)
+    return len(orders)
+
+
+def release_deleted(order_ids):
+    """Снимает резерв удаляемых заказов (движения не ссылаются на заказ)"""
+    record(_release_movements(order_ids, [], link_orders=False))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from orders import analytics
+
+
+class Command(BaseCommand):
+    help = 'Досчитывает дневные сводки продаж по новым событиям заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать сводки заново по всему журналу событий')
+        parser.add_argument('--batch-size', type=int, default=None, help='Событий в одной транзакции')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            processed = analytics.rebuild(options['batch_size'])
+        else:
+            processed = analytics.aggregate(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Учтено событий: {processed}'))
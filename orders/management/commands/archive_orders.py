@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from orders import archive
+
+
+class Command(BaseCommand):
+    help = 'Переносит подтвержденные и отмененные заказы старше заданного возраста в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help=f'Возраст заказа в днях (по умолчанию ORDERS_ARCHIVE_AFTER_DAYS = {settings.ORDERS_ARCHIVE_AFTER_DAYS})',
+        )
+        parser.add_argument('--batch-size', type=int, default=None, help='Заказов в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0, help='Пауза между пачками, с')
+        parser.add_argument('--limit', type=int, default=None, help='Перенести не больше N заказов')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать заказы для переноса')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archive.archivable(options['days']).count()
+            self.stdout.write(f'Заказов для переноса в архив: {count}')
+            return
+        archived = archive.archive_orders(
+            options['days'], options['batch_size'], options['pause'], options['limit'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив заказов: {archived}'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from orders.models import Order, order_totals_expressions, recalculate_order_totals
+
+FIELDS = ['total_price', 'total_quantity', 'item_count']
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохраненные итоги заказов с их позициями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Исправить расхождения')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Заказов в одном запросе')
+        parser.add_argument('--show', type=int, default=20, help='Сколько расхождений вывести')
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        expected = {f'expected_{name}': value for name, value in order_totals_expressions().items()}
+        rows = (
+            Order.objects.order_by().annotate(**expected)
+            .values_list('id', *FIELDS, *expected)
+            .iterator(chunk_size=batch_size)
+        )
+        # Сравнение в Python: значения приводятся к Decimal одинаково для обеих сторон
+        mismatched = []
+        checked = 0
+        for order_id, *values in rows:
+            checked += 1
+            stored, computed = values[:len(FIELDS)], values[len(FIELDS):]
+            if stored != computed:
+                if len(mismatched) < options['show']:
+                    self.stdout.write(f'Заказ #{order_id}: сохранено {stored}, по позициям {computed}')
+                mismatched.append(order_id)
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS(f'Проверено заказов: {checked}, расхождений нет'))
+            return
+        if not options['fix']:
+            raise CommandError(f'Проверено заказов: {checked}, расхождений: {len(mismatched)}')
+        fixed = 0
+        for start in range(0, len(mismatched), batch_size):
+            fixed += recalculate_order_totals(mismatched[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Проверено заказов: {checked}, исправлено: {fixed}'))
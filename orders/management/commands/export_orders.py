@@ -0,0 +1,54 @@
+import sys
+import time
+from datetime import datetime, time as dtime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from orders import export
+from orders.models import Order
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Дата должна быть в формате ГГГГ-ММ-ДД: {value}')
+
+
+class Command(BaseCommand):
+    help = 'Выгружает заказы с позициями в CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл для выгрузки; "-" - стандартный вывод')
+        parser.add_argument('--format', choices=export.FORMATS, help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--status', choices=[status for status, _ in Order.STATUS_CHOICES], help='Только заказы в этом статусе')
+        parser.add_argument('--since', help='Заказы, оформленные с этого дня (ГГГГ-ММ-ДД)')
+        parser.add_argument('--until', help='Заказы, оформленные по этот день включительно (ГГГГ-ММ-ДД)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = export.detect_format(path, options['format'])
+        queryset = Order.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(_date(options['since']), dtime.min)))
+        if options['until']:
+            queryset = queryset.filter(created_at__lte=timezone.make_aware(datetime.combine(_date(options['until']), dtime.max)))
+
+        started = time.monotonic()
+        count = queryset.count()
+        try:
+            file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        except OSError as exc:
+            raise CommandError(f'Не удалось открыть файл: {exc}')
+        with file:
+            for chunk in export.stream(fmt, queryset):
+                file.write(chunk)
+        elapsed = time.monotonic() - started
+
+        # При выводе в stdout итог пишем в stderr, чтобы не испортить выгрузку
+        out = self.stderr if path == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f'Выгружено заказов: {count} за {elapsed:.1f} с ({count / max(elapsed, 1e-6):.0f} заказов/с)'
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from orders.cart import storage_class
+
+
+class Command(BaseCommand):
+    help = 'Записывает в базу корзины, измененные в кеше (для запуска по расписанию и перед остановкой)'
+
+    def handle(self, *args, **options):
+        flushed = storage_class().flush_dirty()
+        self.stdout.write(self.style.SUCCESS(f'Записано корзин: {flushed}'))
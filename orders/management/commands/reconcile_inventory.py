@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import OuterRef, Subquery, Sum
+from orders import inventory
+from orders.models import StockMovement, StockSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Сверяет остатки товаров и снимки склада с журналом движений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Исправить расхождения и докатить снимки')
+        parser.add_argument('--show', type=int, default=20, help='Сколько расхождений вывести')
+
+    def handle(self, *args, **options):
+        # Изменения stock_quantity в обход журнала ищутся до докатки: она перезаписала бы их
+        untracked = inventory.untracked_changes()
+        for product_id, (stock, on_hand) in list(untracked.items())[:options['show']]:
+            self.stdout.write(f'Товар #{product_id}: stock_quantity {stock}, по журналу {on_hand}')
+
+        drifted = self.drifted_snapshots()
+        for product_id, stored, computed in drifted[:options['show']]:
+            self.stdout.write(f'Снимок товара #{product_id}: сохранено {stored}, по журналу {computed}')
+
+        summary = f'изменений вне журнала: {len(untracked)}, расхождений снимков: {len(drifted)}'
+        if options['fix']:
+            # Снимок без строки пересчитывается докаткой по всему журналу товара
+            rebuilt = [product_id for product_id, _, _ in drifted]
+            StockSnapshot.objects.filter(product_id__in=rebuilt).delete()
+            inventory.roll_forward(rebuilt)
+            # Докатка переписала stock_quantity, поэтому корректировки - от значений, найденных выше
+            ledger = inventory.balances(list(untracked))
+            inventory.record(
+                StockMovement(
+                    product_id=product_id, kind='adjustment', quantity=stock - ledger[product_id][0],
+                    comment='Изменение остатка вне журнала',
+                )
+                for product_id, (stock, _) in untracked.items()
+            )
+            rolled = inventory.roll_forward()
+            self.stdout.write(self.style.SUCCESS(f'Исправлено {summary}; обновлено снимков: {rolled}'))
+        elif untracked or drifted:
+            raise CommandError(f'Найдено {summary}')
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+
+        negative = StockSnapshot.objects.filter(on_hand__lt=0) | StockSnapshot.objects.filter(reserved__lt=0)
+        for product_id, on_hand, reserved in negative.values_list('product_id', 'on_hand', 'reserved')[:options['show']]:
+            self.stdout.write(self.style.WARNING(f'Товар #{product_id}: отрицательный остаток {on_hand} или резерв {reserved}'))
+
+    def drifted_snapshots(self):
+        """Снимки, не совпадающие с суммой движений до last_movement_id"""
+        last = StockSnapshot.objects.filter(product=OuterRef('product_id')).values('last_movement_id')
+        computed = {
+            row['product_id']: (row['on_hand'], row['reserved'])
+            for row in StockMovement.objects.filter(id__lte=Subquery(last))
+            .values('product_id').annotate(on_hand=Sum('quantity'), reserved=Sum('reserved')).order_by()
+        }
+        drifted = []
+        for product_id, on_hand, reserved in StockSnapshot.objects.order_by('product_id').values_list(
+            'product_id', 'on_hand', 'reserved',
+        ):
+            expected = computed.get(product_id, (0, 0))
+            if (on_hand, reserved) != expected:
+                drifted.append((product_id, (on_hand, reserved), expected))
+        return drifted
@@ -0,0 +1,18 @@
+from django.conf import settings
+
+from .cart import COUNT_COOKIE
+
+
+class CartCountMiddleware:
+    """Записывает в cookie число позиций корзины, если запрос его узнал (см. cart.remember_count)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        count = getattr(request, '_cart_count', None)
+        if count is not None and request.COOKIES.get(COUNT_COOKIE) != str(count):
+            # Cookie читает скрипт страницы, поэтому без HttpOnly
+            response.set_cookie(COUNT_COOKIE, str(count), max_age=settings.SESSION_COOKIE_AGE, samesite='Lax')
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+def mark_confirmed_deducted(apps, schema_editor):
+    # Подтвержденные заказы уже уменьшили остатки (сигналом при сохранении)
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(status='confirmed').update(stock_deducted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_deducted',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Списан со склада'),
+        ),
+        migrations.RunPython(mark_confirmed_deducted, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def opening_balances(apps, schema_editor):
+    # Начальный остаток - текущий stock_quantity; заказы, еще не списанные
+    # со склада, резервируют свои товары, чтобы отмена и подтверждение
+    # сняли ровно этот резерв
+    Product = apps.get_model('main', 'Product')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    StockMovement = apps.get_model('orders', 'StockMovement')
+    StockSnapshot = apps.get_model('orders', 'StockSnapshot')
+
+    movements = [
+        StockMovement(product_id=product_id, kind='adjustment', quantity=stock, comment='Начальный остаток')
+        for product_id, stock in Product.objects.order_by('id').values_list('id', 'stock_quantity')
+    ]
+    reserved = {}
+    for row in (
+        OrderItem.objects.filter(order__stock_deducted=False).exclude(order__status='cancelled')
+        .values('order_id', 'product_id').annotate(total=models.Sum('quantity')).order_by('order_id', 'product_id')
+    ):
+        movements.append(StockMovement(
+            product_id=row['product_id'], kind='reservation', reserved=row['total'], order_id=row['order_id'],
+        ))
+        reserved[row['product_id']] = reserved.get(row['product_id'], 0) + row['total']
+    StockMovement.objects.bulk_create(movements, batch_size=2000)
+    last = StockMovement.objects.aggregate(last=models.Max('id'))['last'] or 0
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(
+            product_id=movement.product_id, on_hand=movement.quantity,
+            reserved=reserved.get(movement.product_id, 0), last_movement_id=last,
+        )
+        for movement in movements if movement.kind == 'adjustment'
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_similar_products'),
+        ('orders', '0005_order_stock_deducted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_snapshot', serialize=False, to='main.product', verbose_name='Товар')),
+                ('on_hand', models.IntegerField(default=0, verbose_name='Остаток')),
+                ('reserved', models.IntegerField(default=0, verbose_name='Резерв')),
+                ('last_movement_id', models.BigIntegerField(default=0, verbose_name='Последнее учтенное движение')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Остаток товара',
+                'verbose_name_plural': 'Остатки товаров',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Поступление'), ('reservation', 'Резерв под заказ'), ('confirmation', 'Списание по заказу'), ('cancellation', 'Отмена заказа'), ('adjustment', 'Корректировка')], max_length=20, verbose_name='Тип')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Изменение остатка')),
+                ('reserved', models.IntegerField(default=0, verbose_name='Изменение резерва')),
+                ('comment', models.CharField(blank=True, max_length=255, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='orders.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Движение товара',
+                'verbose_name_plural': 'Движения товаров',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['product', 'id'], name='stock_movement_product_idx')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
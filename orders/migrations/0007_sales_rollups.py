@@ -0,0 +1,161 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:48
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def order_history(apps, schema_editor):
+    # Существующие заказы попадают в журнал событий: оформление в created_at
+    # и текущий статус в updated_at; сводки досчитывает команда aggregate_sales
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    OrderEvent = apps.get_model('orders', 'OrderEvent')
+
+    batch_size = 2000
+    last_id = 0
+    while True:
+        orders = list(
+            Order.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'status', 'created_at', 'updated_at')[:batch_size]
+        )
+        if not orders:
+            break
+        last_id = orders[-1][0]
+        lines = {}
+        for order_id, product_id, quantity, price in (
+            OrderItem.objects.filter(order_id__in=[order[0] for order in orders]).order_by('id')
+            .values_list('order_id', 'product_id', 'quantity', 'price')
+        ):
+            lines.setdefault(order_id, []).append((product_id, quantity, price))
+        events = []
+        for order_id, status, created_at, updated_at in orders:
+            total = sum((quantity * price for _, quantity, price in lines.get(order_id, [])), Decimal('0'))
+            items = [[product_id, quantity, str(price)] for product_id, quantity, price in lines.get(order_id, [])]
+            events.append(OrderEvent(
+                order_id=order_id, status='new', total_price=total, lines=items, created_at=created_at,
+            ))
+            if status != 'new':
+                events.append(OrderEvent(
+                    order_id=order_id, previous_status='new', status=status, total_price=total,
+                    lines=items, created_at=updated_at,
+                ))
+        OrderEvent.objects.bulk_create(events)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_similar_products'),
+        ('orders', '0006_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_placed', models.IntegerField(default=0, verbose_name='Оформлено заказов')),
+                ('orders_confirmed', models.IntegerField(default=0, verbose_name='Подтверждено заказов')),
+                ('orders_cancelled', models.IntegerField(default=0, verbose_name='Отменено заказов')),
+                ('ordered_quantity', models.IntegerField(default=0, verbose_name='Заказано товаров')),
+                ('sold_quantity', models.IntegerField(default=0, verbose_name='Продано товаров')),
+                ('cancelled_quantity', models.IntegerField(default=0, verbose_name='Отменено товаров')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи категории за день',
+                'verbose_name_plural': 'Продажи категорий по дням',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_placed', models.IntegerField(default=0, verbose_name='Оформлено заказов')),
+                ('orders_confirmed', models.IntegerField(default=0, verbose_name='Подтверждено заказов')),
+                ('orders_cancelled', models.IntegerField(default=0, verbose_name='Отменено заказов')),
+                ('ordered_quantity', models.IntegerField(default=0, verbose_name='Заказано товаров')),
+                ('sold_quantity', models.IntegerField(default=0, verbose_name='Продано товаров')),
+                ('cancelled_quantity', models.IntegerField(default=0, verbose_name='Отменено товаров')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Сводка продаж',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Сводка')),
+                ('last_event_id', models.BigIntegerField(default=0, verbose_name='Последнее учтенное событие')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Отметка сводки',
+                'verbose_name_plural': 'Отметки сводок',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('orders_placed', models.IntegerField(default=0, verbose_name='Оформлено заказов')),
+                ('orders_confirmed', models.IntegerField(default=0, verbose_name='Подтверждено заказов')),
+                ('orders_cancelled', models.IntegerField(default=0, verbose_name='Отменено заказов')),
+                ('ordered_quantity', models.IntegerField(default=0, verbose_name='Заказано товаров')),
+                ('sold_quantity', models.IntegerField(default=0, verbose_name='Продано товаров')),
+                ('cancelled_quantity', models.IntegerField(default=0, verbose_name='Отменено товаров')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_status', models.CharField(blank=True, choices=[('new', 'Новый'), ('confirmed', 'Подтвержден'), ('cancelled', 'Отменен')], max_length=20, verbose_name='Прежний статус')),
+                ('status', models.CharField(choices=[('new', 'Новый'), ('confirmed', 'Подтвержден'), ('cancelled', 'Отменен')], max_length=20, verbose_name='Статус')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма заказа')),
+                ('lines', models.JSONField(default=list, verbose_name='Позиции')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='orders.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Событие заказа',
+                'verbose_name_plural': 'События заказов',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('day',), name='daily_sales_day_uniq'),
+        ),
+        migrations.AddField(
+            model_name='categorysales',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.category', verbose_name='Категория'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsales',
+            constraint=models.UniqueConstraint(fields=('day', 'product'), name='product_sales_day_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category'), name='category_sales_day_uniq'),
+        ),
+        migrations.RunPython(order_history, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,14 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from main.models import Product
+from django.utils import timezone
+from main.models import Category, Product
 
 User = get_user_model()
 
@@ -20,24 +26,27 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
     cancellation_reason = models.TextField(blank=True, verbose_name='Причина отмены')
+    # Итоги по позициям; пересчитываются recalculate_order_totals() при изменении позиций
+    total_price = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0, editable=False, verbose_name='Общая стоимость',
+    )
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество товаров')
+    item_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Позиций')
+    # Товары списаны со склада; меняется только в orders/inventory.py
+    stock_deducted = models.BooleanField(default=False, editable=False, verbose_name='Списан со склада')
     
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            models.Index(fields=['total_price'], name='order_total_price_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
     
     def __str__(self):
         return f"Заказ #{self.id} - {self.user.get_full_name()}"
-    
-    @property
-    def total_quantity(self):
-        """Общее количество товаров в заказе"""
-        return sum(item.quantity for item in self.orderitem_set.all())
-    
-    @property
-    def total_price(self):
-        """Общая стоимость заказа"""
-        return sum(item.get_total_price() for item in self.orderitem_set.all())
 
 
 class OrderItem(models.Model):
@@ -65,6 +74,26 @@ class OrderItem(models.Model):
         return self.quantity * self.price
 
 
+def order_totals_expressions():
+    """Выражения итогов заказа по его позициям для update() и annotate()"""
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return {
+        'total_price': Coalesce(
+            Subquery(items.annotate(value=Sum(F('quantity') * F('price'), output_field=money)).values('value')),
+            Value(Decimal('0')), output_field=money,
+        ),
+        'total_quantity': Coalesce(Subquery(items.annotate(value=Sum('quantity')).values('value')), Value(0)),
+        'item_count': Coalesce(Subquery(items.annotate(value=Count('id')).values('value')), Value(0)),
+    }
+
+
+def recalculate_order_totals(order_ids):
+    """Пересчитывает итоги заказов одним UPDATE; нужен после bulk_create(),
+    update() и delete() позиций через QuerySet - они не вызывают сигналы"""
+    return Order.objects.filter(id__in=order_ids).update(**order_totals_expressions())
+
+
 class Cart(models.Model):
     """Модель корзины"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
@@ -86,15 +115,246 @@ class Cart(models.Model):
         return self.quantity * self.product.price
 
 
-@receiver(post_save, sender=Order)
-def update_stock_on_order_confirmation(sender, instance, created, **kwargs):
-    """Уменьшает количество товаров на складе при подтверждении заказа"""
-    if not created and instance.status == 'confirmed':
-        # Проверяем, не был ли заказ уже подтвержден ранее
-        if Order.objects.filter(id=instance.id, status='confirmed').exists():
-            # Уменьшаем количество товаров на складе
-            for item in instance.orderitem_set.all():
-                item.product.stock_quantity -= item.quantity
-                if item.product.stock_quantity < 0:
-                    item.product.stock_quantity = 0
-                item.product.save()
\ No newline at end of file
+class StockMovement(models.Model):
+    """Движение товара на складе; записи только добавляются (см. orders/inventory.py)"""
+    KIND_CHOICES = [
+        ('receipt', 'Поступление'),
+        ('reservation', 'Резерв под заказ'),
+        ('confirmation', 'Списание по заказу'),
+        ('cancellation', 'Отмена заказа'),
+        ('adjustment', 'Корректировка'),
+    ]
+    
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='stock_movements', verbose_name='Товар',
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип')
+    quantity = models.IntegerField(default=0, verbose_name='Изменение остатка')
+    reserved = models.IntegerField(default=0, verbose_name='Изменение резерва')
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, verbose_name='Заказ')
+    comment = models.CharField(max_length=255, blank=True, verbose_name='Комментарий')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата')
+    
+    class Meta:
+        verbose_name = 'Движение товара'
+        verbose_name_plural = 'Движения товаров'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stock_movement_product_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.product_id} ({self.quantity:+d})"
+
+
+class StockSnapshot(models.Model):
+    """Остаток и резерв товара по движениям с id не больше last_movement_id"""
+    product = models.OneToOneField(
+        Product, primary_key=True, on_delete=models.CASCADE, related_name='stock_snapshot', verbose_name='Товар',
+    )
+    on_hand = models.IntegerField(default=0, verbose_name='Остаток')
+    reserved = models.IntegerField(default=0, verbose_name='Резерв')
+    last_movement_id = models.BigIntegerField(default=0, verbose_name='Последнее учтенное движение')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    
+    class Meta:
+        verbose_name = 'Остаток товара'
+        verbose_name_plural = 'Остатки товаров'
+    
+    def __str__(self):
+        return f"{self.product_id}: {self.on_hand} (резерв {self.reserved})"
+
+
+class ArchivedOrderItem:
+    """Позиция архивного заказа; product - несохраненный товар только с id и названием"""
+    
+    def __init__(self, product_id, product_name, quantity, price):
+        self.product = Product(id=product_id, name=product_name)
+        self.quantity = quantity
+        self.price = Decimal(price)
+    
+    def __str__(self):
+        return f"{self.product.name} - {self.quantity} шт."
+    
+    def get_total_price(self):
+        """Общая стоимость элемента заказа"""
+        return self.quantity * self.price
+
+
+class ArchivedOrder(models.Model):
+    """Закрытый заказ, перенесенный в архив (см. orders/archive.py); позиции
+    хранятся в той же строке"""
+    id = models.BigIntegerField(primary_key=True, verbose_name='Номер заказа')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='archived_orders', verbose_name='Пользователь',
+    )
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Статус')
+    created_at = models.DateTimeField(verbose_name='Дата создания')
+    updated_at = models.DateTimeField(verbose_name='Дата обновления')
+    cancellation_reason = models.TextField(blank=True, verbose_name='Причина отмены')
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Общая стоимость')
+    total_quantity = models.PositiveIntegerField(default=0, verbose_name='Количество товаров')
+    item_count = models.PositiveIntegerField(default=0, verbose_name='Позиций')
+    # [[id товара, название, количество, "цена"], ...] на момент переноса
+    items = models.JSONField(default=list, verbose_name='Позиции')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата переноса в архив')
+    
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архив заказов'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_order_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Заказ #{self.id} (архив)"
+    
+    def get_items(self):
+        """Позиции заказа в том же виде, что OrderItem для шаблонов"""
+        return [ArchivedOrderItem(*item) for item in self.items]
+
+
+class OrderEvent(models.Model):
+    """Переход заказа в новый статус; записи только добавляются (см. orders/analytics.py)"""
+    order = models.ForeignKey(
+        Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='events', verbose_name='Заказ',
+    )
+    previous_status = models.CharField(
+        max_length=20, choices=Order.STATUS_CHOICES, blank=True, verbose_name='Прежний статус',
+    )
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, verbose_name='Статус')
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='Сумма заказа')
+    # Позиции на момент перехода: [[id товара, количество, "цена"], ...]
+    lines = models.JSONField(default=list, verbose_name='Позиции')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='Дата')
+    
+    class Meta:
+        verbose_name = 'Событие заказа'
+        verbose_name_plural = 'События заказов'
+        ordering = ['-id']
+    
+    def __str__(self):
+        return f"Заказ #{self.order_id}: {self.previous_status or '-'} -> {self.status}"
+
+
+class SalesRollup(models.Model):
+    """Показатели продаж за день по событиям заказов.
+
+    Число заказов - события за день; проданное количество и выручка - за
+    вычетом отмен подтвержденных заказов (в день отмены).
+    """
+    day = models.DateField(verbose_name='День')
+    orders_placed = models.IntegerField(default=0, verbose_name='Оформлено заказов')
+    orders_confirmed = models.IntegerField(default=0, verbose_name='Подтверждено заказов')
+    orders_cancelled = models.IntegerField(default=0, verbose_name='Отменено заказов')
+    ordered_quantity = models.IntegerField(default=0, verbose_name='Заказано товаров')
+    sold_quantity = models.IntegerField(default=0, verbose_name='Продано товаров')
+    cancelled_quantity = models.IntegerField(default=0, verbose_name='Отменено товаров')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+    
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    """Продажи магазина за день"""
+    
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Сводка продаж'
+        ordering = ['-day']
+        constraints = [models.UniqueConstraint(fields=['day'], name='daily_sales_day_uniq')]
+    
+    def __str__(self):
+        return f"{self.day}: {self.revenue}"
+
+
+class CategorySales(SalesRollup):
+    """Продажи категории за день"""
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Категория')
+    
+    class Meta:
+        verbose_name = 'Продажи категории за день'
+        verbose_name_plural = 'Продажи категорий по дням'
+        ordering = ['-day']
+        constraints = [models.UniqueConstraint(fields=['day', 'category'], name='category_sales_day_uniq')]
+    
+    def __str__(self):
+        return f"{self.day} {self.category_id}: {self.revenue}"
+
+
+class ProductSales(SalesRollup):
+    """Продажи товара за день"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар')
+    
+    class Meta:
+        verbose_name = 'Продажи товара за день'
+        verbose_name_plural = 'Продажи товаров по дням'
+        ordering = ['-day']
+        constraints = [models.UniqueConstraint(fields=['day', 'product'], name='product_sales_day_uniq')]
+    
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.revenue}"
+
+
+class RollupWatermark(models.Model):
+    """Последнее событие, учтенное в сводках"""
+    name = models.CharField(max_length=50, primary_key=True, verbose_name='Сводка')
+    last_event_id = models.BigIntegerField(default=0, verbose_name='Последнее учтенное событие')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    
+    class Meta:
+        verbose_name = 'Отметка сводки'
+        verbose_name_plural = 'Отметки сводок'
+    
+    def __str__(self):
+        return f"{self.name}: {self.last_event_id}"
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, origin=None, **kwargs):
+    """Пересчитывает итоги заказа в той же транзакции, что и изменение позиции"""
+    # Позиции, удаляемые вместе с заказом, не пересчитывают его итоги
+    if isinstance(origin, Order) or getattr(origin, 'model', None) is Order:
+        return
+    recalculate_order_totals([instance.order_id])
+
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, **kwargs):
+    """Изменение остатка в админке или через save() записывается в журнал склада"""
+    if created or instance.fields_changed('stock_quantity'):
+        from . import inventory
+        inventory.adjust(instance.id, instance.stock_quantity, 'Изменение остатка товара')
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_reservation(sender, instance, **kwargs):
+    """Удаленный заказ освобождает свой резерв (позиции удаляются вместе с ним)"""
+    if not instance.stock_deducted and instance.status != 'cancelled':
+        from . import inventory
+        inventory.release_deleted([instance.id])
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Корзина, собранная до входа, складывается с корзиной покупателя"""
+    if request is None or not hasattr(request, 'session'):
+        return
+    from .cart import remember_count, storage_class
+    # Корзина, созданная в этом запросе до входа, была анонимной
+    cart = request._cart = storage_class()(request, user)
+    cart.merge(cart.pop_anonymous())
+    # Значок в шапке показывает корзину покупателя, даже если анонимная была пуста
+    remember_count(request, cart.count())
+
+
+@receiver(user_logged_out)
+def reset_cart_count(sender, request, user, **kwargs):
+    """После выхода корзина в шапке пуста: сессия с анонимной корзиной удаляется"""
+    if request is None:
+        return
+    from .cart import remember_count
+    remember_count(request, 0)
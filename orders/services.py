@@ -0,0 +1,86 @@
+"""
+Оформление заказа.
+
+Весь заказ оформляется постоянным числом запросов независимо от размера
+корзины: строки корзины читаются одним запросом, товары - одним
+SELECT ... FOR UPDATE (блокировки берутся в порядке id, поэтому два
+одновременных оформления не блокируют друг друга крест-накрест), позиции
+создаются одним bulk_create(). Корзину передает хранилище корзин
+(orders/cart.py); без нее читается таблица Cart.
+
+Оформленный заказ резервирует товары в журнале склада
+(orders/inventory.py), списываются они при подтверждении, поэтому при
+оформлении доступно остаток минус резерв. Строка товара заблокирована до
+конца транзакции, так что второе одновременное оформление того же букета
+увидит уже записанный резерв. В SQLite блокировок строк нет: оформление
+начинается с блокировки записи всей базы (flower_shop/db.py), иначе
+одновременное оформление упало бы с database is locked при первой записи.
+"""
+from django.db import transaction
+
+from flower_shop import db
+from main.models import Product
+from . import analytics, inventory
+from .models import Cart, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    """Заказ нельзя оформить"""
+
+    def __init__(self, message, problems=None):
+        super().__init__(message)
+        self.problems = problems or []
+
+
+def place_order(user, items=None):
+    """Оформляет заказ из корзины пользователя ({id товара: количество} или
+    таблица Cart); CheckoutError, если товара не хватает"""
+    with transaction.atomic():
+        db.begin_write()
+        if items is None:
+            items = dict(Cart.objects.filter(user=user).order_by('id').values_list('product_id', 'quantity'))
+        cart = list(items.items())
+        if not cart:
+            raise CheckoutError('Корзина пуста')
+
+        product_ids = sorted(items)
+        products = {
+            product.id: product
+            for product in Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+            .only('id', 'name', 'price', 'is_available')
+        }
+        stock = inventory.balances(product_ids)
+
+        problems = []
+        for product_id, quantity in cart:
+            product = products.get(product_id)
+            if product is None or not product.is_available:
+                problems.append(f'Товар "{product.name}" больше не продается' if product else 'Товар больше не продается')
+                continue
+            on_hand, reserved = stock[product_id]
+            available = max(on_hand - reserved, 0)
+            if quantity > available:
+                problems.append(f'Недостаточно товара "{product.name}". Доступно: {available}')
+        if problems:
+            raise CheckoutError(' '.join(problems), problems)
+
+        items = [
+            OrderItem(product_id=product_id, quantity=quantity, price=products[product_id].price)
+            for product_id, quantity in cart
+        ]
+        # Итоги известны заранее: bulk_create() не вызывает сигналы пересчета
+        order = Order.objects.create(
+            user=user,
+            total_price=sum(item.get_total_price() for item in items),
+            total_quantity=sum(item.quantity for item in items),
+            item_count=len(items),
+        )
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+        inventory.reserve(order, [(item.product_id, item.quantity) for item in items])
+        analytics.record([
+            analytics.event(order.id, '', 'new', [(item.product_id, item.quantity, item.price) for item in items]),
+        ])
+        Cart.objects.filter(user=user).delete()
+    return order
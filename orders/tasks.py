@@ -0,0 +1,21 @@
+"""
+Фоновые задачи заказов (см. jobs/queue.py).
+"""
+from jobs import queue
+from . import analytics, inventory
+
+
+@queue.task('orders.roll_forward')
+def roll_forward(product_ids=None):
+    """Докатка снимков склада, stock_quantity товаров и данных витрины после движений товаров"""
+    # Задачи, поставленные со списком товаров, докатывают только его
+    if product_ids is None:
+        inventory.roll_forward_pending()
+    else:
+        inventory.roll_forward(product_ids)
+
+
+@queue.task('orders.aggregate_sales')
+def aggregate_sales():
+    """Досчет сводок продаж по новым событиям заказов"""
+    analytics.aggregate()
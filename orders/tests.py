@@ -1,3 +1,545 @@
-from django.test import TestCase
-
-# Create your tests here.
+import csv
+import io
+import json
+import threading
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.models import Max
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from jobs.models import Job
+from main.models import Category, Product
+from . import analytics, archive, export, inventory, services, tasks, views
+from .models import (
+    ArchivedOrder, Cart, CategorySales, DailySales, Order, OrderEvent, OrderItem, ProductSales, StockMovement,
+    StockSnapshot,
+)
+
+User = get_user_model()
+
+
+def create_products(count, stock_quantity=5, price='10.50'):
+    category = Category.objects.create(name='Розы')
+    return [
+        Product.objects.create(
+            name=f'Букет {i}', description='Описание', price=Decimal(price), category=category,
+            country='Россия', year=2024, model='M1', stock_quantity=stock_quantity, image='products/p.jpg',
+        )
+        for i in range(count)
+    ]
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1')
+        self.other = User.objects.create_user('other', 'other@example.com', 'secret-pass-1')
+        self.products = create_products(3)
+
+    def test_order_totals(self):
+        for product in self.products:
+            Cart.objects.create(user=self.user, product=product, quantity=2)
+        order = services.place_order(self.user)
+        order.refresh_from_db()
+        self.assertEqual((order.item_count, order.total_quantity, order.total_price), (3, 6, Decimal('63.00')))
+        self.assertEqual(order.orderitem_set.count(), 3)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_reserved_stock_is_not_available(self):
+        product = self.products[0]
+        services.place_order(self.user, {product.id: 3})
+        Cart.objects.create(user=self.other, product=product, quantity=3)
+        with self.assertRaises(services.CheckoutError) as error:
+            services.place_order(self.other)
+        self.assertIn('Доступно: 2', str(error.exception))
+        # Заказ не создан, корзина не тронута
+        self.assertEqual(Order.objects.filter(user=self.other).count(), 0)
+        self.assertTrue(Cart.objects.filter(user=self.other).exists())
+
+    def test_unavailable_product(self):
+        product = self.products[1]
+        product.stock_quantity = 0
+        product.save()
+        with self.assertRaises(services.CheckoutError) as error:
+            services.place_order(self.user, {product.id: 1})
+        self.assertIn('больше не продается', str(error.exception))
+
+    def test_empty_cart(self):
+        with self.assertRaises(services.CheckoutError):
+            services.place_order(self.user)
+
+    def test_checkout_view(self):
+        self.client.force_login(self.user)
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=9)
+        response = self.client.post('/orders/checkout/', {'password': 'wrong'})
+        self.assertIn('errors', response.json())
+        response = self.client.post('/orders/checkout/', {'password': 'secret-pass-1'})
+        self.assertFalse(response.json()['success'])
+        self.assertIn('Недостаточно', response.json()['message'])
+
+        Cart.objects.update(quantity=1)
+        response = self.client.post('/orders/checkout/', {'password': 'secret-pass-1'})
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(Order.objects.get(user=self.user).total_quantity, 1)
+
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1')
+        self.roses, self.lilies, self.sold_out = create_products(3, stock_quantity=5)
+        Product.objects.filter(id=self.sold_out.id).update(stock_quantity=0, is_available=False)
+
+    def batch(self, *operations, status=200):
+        response = self.client.post(
+            '/orders/cart/batch/', json.dumps({'operations': operations}), content_type='application/json',
+        )
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def cart(self):
+        response = self.client.get('/orders/cart/')
+        return {line.product.id: line.quantity for line in response.context['cart_items']}
+
+    def test_operations(self):
+        data = self.batch(
+            {'op': 'add', 'product_id': self.roses.id, 'quantity': 2},
+            {'op': 'add', 'product_id': self.lilies.id},
+            {'op': 'add', 'product_id': self.roses.id, 'quantity': 1},
+        )
+        self.assertEqual(data['message'], 'Товары добавлены в корзину')
+        self.assertEqual(data['summary'], {'count': 2, 'quantity': 4, 'total': '42.00'})
+        self.assertEqual(self.cart(), {self.roses.id: 3, self.lilies.id: 1})
+
+        data = self.batch(
+            {'op': 'set', 'product_id': self.roses.id, 'quantity': 5},
+            {'op': 'remove', 'product_id': self.lilies.id},
+        )
+        self.assertEqual(data['message'], 'Корзина обновлена')
+        self.assertEqual(self.cart(), {self.roses.id: 5})
+
+    def test_all_or_nothing(self):
+        self.batch({'op': 'add', 'product_id': self.roses.id, 'quantity': 4})
+        data = self.batch(
+            {'op': 'add', 'product_id': self.lilies.id},
+            {'op': 'add', 'product_id': self.roses.id, 'quantity': 2},
+            {'op': 'add', 'product_id': self.sold_out.id},
+            {'op': 'set', 'product_id': 999999, 'quantity': 1},
+        )
+        self.assertFalse(data['success'])
+        self.assertEqual([(error['index'], error['product_id']) for error in data['errors']], [
+            (1, self.roses.id), (2, self.sold_out.id), (3, 999999),
+        ])
+        self.assertEqual(data['errors'][0]['message'], 'Недостаточно товара "Букет 0" на складе. Доступно: 5')
+        self.assertEqual(data['errors'][1]['message'], 'Товар не найден')
+        self.assertEqual(self.cart(), {self.roses.id: 4})
+
+    def test_saved_cart(self):
+        self.client.force_login(self.user)
+        self.batch(
+            {'op': 'add', 'product_id': self.roses.id, 'quantity': 2},
+            {'op': 'set', 'product_id': self.lilies.id, 'quantity': 3},
+            {'op': 'set', 'product_id': self.lilies.id, 'quantity': 0},
+        )
+        self.assertEqual(dict(Cart.objects.filter(user=self.user).values_list('product_id', 'quantity')), {
+            self.roses.id: 2,
+        })
+
+    def test_bad_requests(self):
+        product_id = self.roses.id
+        for body in (
+            'not json',
+            json.dumps({}),
+            json.dumps({'operations': []}),
+            json.dumps({'operations': {'op': 'add'}}),
+            json.dumps({'operations': [{'op': 'buy', 'product_id': product_id}]}),
+            json.dumps({'operations': [{'op': 'add', 'product_id': product_id, 'quantity': 0}]}),
+            json.dumps({'operations': [{'op': 'add', 'product_id': 'x'}]}),
+            json.dumps({'operations': [{'op': 'add'}]}),
+            json.dumps({'operations': [{'op': 'add', 'product_id': product_id}] * (views.CART_BATCH_LIMIT + 1)}),
+        ):
+            with self.subTest(body=body[:60]):
+                response = self.client.post('/orders/cart/batch/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/orders/cart/batch/').status_code, 405)
+        self.assertEqual(self.cart(), {})
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_last_items_are_sold_once(self):
+        users = [User.objects.create_user(f'buyer{i}', f'buyer{i}@example.com', 'secret') for i in range(6)]
+        product = create_products(1, stock_quantity=4)[0]
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                services.place_order(user, {product.id: 1})
+                results.append('ok')
+            except services.CheckoutError:
+                results.append('short')
+            except Exception as exc:
+                results.append(repr(exc))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Ни database is locked, ни продажи сверх остатка
+        self.assertEqual(sorted(results), ['ok'] * 4 + ['short'] * 2)
+        self.assertEqual(inventory.balances([product.id])[product.id], (4, 4))
+        self.assertEqual(Order.objects.count(), 4)
+
+
+@override_settings(JOBS_EAGER=False)
+class RollForwardTests(TestCase):
+    def setUp(self):
+        self.product = create_products(1, stock_quantity=0)[0]
+
+    def receipt(self, quantity):
+        inventory.record([StockMovement(product_id=self.product.id, kind='receipt', quantity=quantity)])
+
+    def snapshot(self):
+        snapshot = StockSnapshot.objects.get(product=self.product)
+        return snapshot.on_hand, snapshot.reserved, snapshot.last_movement_id
+
+    def test_one_job_per_interval(self):
+        for _ in range(5):
+            self.receipt(3)
+        self.assertEqual(Job.objects.filter(name='orders.roll_forward').count(), 1)
+        tasks.roll_forward()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_quantity, self.product.is_available), (15, True))
+
+    def test_repeated_roll_forward_changes_nothing(self):
+        self.receipt(5)
+        self.receipt(-2)
+        self.assertEqual(inventory.roll_forward([self.product.id]), 1)
+        last = StockMovement.objects.aggregate(last=Max('id'))['last']
+        self.assertEqual(self.snapshot(), (3, 0, last))
+        # Задача может выполниться повторно (истекла аренда воркера) - результат тот же
+        self.assertEqual(inventory.roll_forward([self.product.id]), 0)
+        self.assertEqual(inventory.roll_forward(), 0)
+        self.assertEqual(self.snapshot(), (3, 0, last))
+        self.assertEqual(inventory.balances([self.product.id])[self.product.id], (3, 0))
+
+    def test_pending_rolls_each_movement_once(self):
+        self.receipt(4)
+        self.assertEqual(inventory.roll_forward_pending(), 1)
+        self.assertEqual(inventory.roll_forward_pending(), 0)
+        self.receipt(1)
+        self.assertEqual(inventory.roll_forward_pending(), 1)
+        self.assertEqual(self.snapshot()[0], 5)
+
+    def test_snapshot_ahead_of_bound_is_kept(self):
+        self.receipt(5)
+        inventory.roll_forward([self.product.id])
+        on_hand, reserved, last = self.snapshot()
+        # Снимок уже докатила более поздняя задача: отметка не сдвигается назад, движения не считаются дважды
+        StockSnapshot.objects.filter(product=self.product).update(last_movement_id=last + 100)
+        self.receipt(2)
+        inventory.roll_forward([self.product.id])
+        self.assertEqual(self.snapshot(), (on_hand, reserved, last + 100))
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        self.roses, self.lilies, self.tulips = create_products(3, stock_quantity=50)
+        Product.objects.filter(id=self.lilies.id).update(price=Decimal('5.50'))
+        self.tulips.category = Category.objects.create(name='Тюльпаны')
+        self.tulips.save()
+
+    def place(self, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            return services.place_order(self.user, items)
+
+    def test_totals_after_confirm_and_cancel(self):
+        first = self.place({self.roses.id: 2, self.lilies.id: 1, self.tulips.id: 1})
+        second = self.place({self.roses.id: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.confirm_orders([first.id, second.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.cancel_orders([second.id], 'Передумал')
+
+        self.assertEqual(
+            list(OrderEvent.objects.order_by('id').values_list('order_id', 'previous_status', 'status')),
+            [(first.id, '', 'new'), (second.id, '', 'new'), (first.id, 'new', 'confirmed'),
+             (second.id, 'new', 'confirmed'), (second.id, 'confirmed', 'cancelled')],
+        )
+        day = DailySales.objects.get()
+        self.assertEqual(
+            (day.orders_placed, day.orders_confirmed, day.orders_cancelled,
+             day.ordered_quantity, day.sold_quantity, day.cancelled_quantity, day.revenue),
+            (2, 2, 1, 5, 4, 1, Decimal('37.00')),
+        )
+        roses = CategorySales.objects.get(category=self.roses.category)
+        self.assertEqual((roses.ordered_quantity, roses.sold_quantity, roses.revenue), (4, 3, Decimal('26.50')))
+        product = ProductSales.objects.get(product=self.roses)
+        self.assertEqual(
+            (product.orders_placed, product.orders_confirmed, product.orders_cancelled, product.sold_quantity, product.revenue),
+            (2, 2, 1, 2, Decimal('21.00')),
+        )
+
+        # Пересчет с нуля дает те же итоги
+        analytics.rebuild()
+        self.assertEqual(DailySales.objects.get().revenue, Decimal('37.00'))
+        self.assertEqual(CategorySales.objects.get(category=self.roses.category).revenue, Decimal('26.50'))
+
+    @override_settings(JOBS_EAGER=False)
+    def test_events_are_aggregated_once(self):
+        services.place_order(self.user, {self.roses.id: 1})
+        services.place_order(self.user, {self.roses.id: 1})
+        self.assertEqual(Job.objects.filter(name='orders.aggregate_sales').count(), 1)
+        analytics.aggregate()
+        analytics.aggregate()
+        self.assertEqual(DailySales.objects.get().orders_placed, 2)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret')
+        self.other = User.objects.create_user('other', 'other@example.com', 'secret')
+        self.roses, self.lilies = create_products(2, stock_quantity=100)
+
+    def order(self, status, age_days, user=None):
+        order = services.place_order(user or self.user, {self.roses.id: 1, self.lilies.id: 2})
+        if status == 'confirmed':
+            inventory.confirm_orders([order.id])
+        elif status == 'cancelled':
+            inventory.cancel_orders([order.id], 'Передумал')
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=age_days))
+        return order.id
+
+    def test_archive_moves_old_closed_orders(self):
+        old = [self.order('confirmed', 400), self.order('cancelled', 500), self.order('confirmed', 400)]
+        kept = [self.order('new', 400), self.order('confirmed', 10)]
+        stock = inventory.balances([self.roses.id])
+
+        self.assertEqual(archive.archive_orders(batch_size=2), 3)
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), sorted(kept))
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), sorted(old))
+        self.assertFalse(OrderItem.objects.filter(order_id__in=old).exists())
+        # Журнал склада не меняется
+        self.assertEqual(inventory.balances([self.roses.id]), stock)
+        self.assertEqual(archive.archive_orders(), 0)
+
+        archived = ArchivedOrder.objects.get(id=old[0])
+        self.assertEqual(
+            (archived.status, archived.total_price, archived.item_count, archived.total_quantity),
+            ('confirmed', Decimal('31.50'), 2, 3),
+        )
+        self.assertEqual(
+            [(item.product.name, item.quantity, item.get_total_price()) for item in archived.get_items()],
+            [('Букет 0', 1, Decimal('10.50')), ('Букет 1', 2, Decimal('21.00'))],
+        )
+
+    def test_find_order_reads_through(self):
+        archived_id = self.order('confirmed', 400)
+        current_id = self.order('new', 1)
+        archive.archive_orders()
+        self.assertIsInstance(archive.find_order(current_id), Order)
+        self.assertIsInstance(archive.find_order(archived_id, user=self.user), ArchivedOrder)
+        self.assertIsNone(archive.find_order(archived_id, user=self.other))
+        self.assertIsNone(archive.find_order(0))
+
+    def test_profile_reads_archive(self):
+        archived_id = self.order('confirmed', 400)
+        foreign_id = self.order('confirmed', 400, user=self.other)
+        archive.archive_orders()
+        self.client.force_login(self.user)
+
+        response = self.client.get('/auth/profile/')
+        self.assertNotContains(response, f'Заказ #{archived_id}<')
+        response = self.client.get('/auth/profile/', {'archive': '1'})
+        self.assertContains(response, f'Заказ #{archived_id}')
+        self.assertNotContains(response, f'Заказ #{foreign_id}')
+
+        response = self.client.get(f'/auth/profile/orders/{archived_id}/items/')
+        self.assertContains(response, 'Букет 1')
+        self.assertEqual(self.client.get(f'/auth/profile/orders/{foreign_id}/items/').status_code, 404)
+
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.roses, self.lilies, self.peonies = create_products(3, stock_quantity=100)
+        self.order = services.place_order(self.user, {self.roses.id: 1, self.lilies.id: 2})
+
+    def totals(self, order):
+        order.refresh_from_db()
+        return order.total_price, order.total_quantity, order.item_count
+
+    def test_item_changes(self):
+        self.assertEqual(self.totals(self.order), (Decimal('31.50'), 3, 2))
+        item = OrderItem.objects.get(order=self.order, product=self.roses)
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.totals(self.order), (Decimal('63.00'), 6, 2))
+        item.delete()
+        self.assertEqual(self.totals(self.order), (Decimal('21.00'), 2, 1))
+        # Цена позиции по умолчанию - цена товара
+        OrderItem.objects.create(order=self.order, product=self.peonies, quantity=1, price=0)
+        self.assertEqual(self.totals(self.order), (Decimal('31.50'), 3, 2))
+
+    def test_admin_inline_edit(self):
+        roses_item, lilies_item = OrderItem.objects.filter(order=self.order).order_by('product_id')
+        self.client.force_login(self.user)
+        response = self.client.post(f'/admin/orders/order/{self.order.id}/change/', {
+            'user': self.user.id,
+            'status': 'new',
+            'orderitem_set-TOTAL_FORMS': 3,
+            'orderitem_set-INITIAL_FORMS': 2,
+            'orderitem_set-0-id': roses_item.id,
+            'orderitem_set-0-order': self.order.id,
+            'orderitem_set-0-product': self.roses.id,
+            'orderitem_set-0-quantity': 5,
+            'orderitem_set-0-price': '10.50',
+            'orderitem_set-1-id': lilies_item.id,
+            'orderitem_set-1-order': self.order.id,
+            'orderitem_set-1-product': self.lilies.id,
+            'orderitem_set-1-quantity': 2,
+            'orderitem_set-1-price': '10.50',
+            'orderitem_set-1-DELETE': 'on',
+            'orderitem_set-2-order': self.order.id,
+            'orderitem_set-2-product': self.peonies.id,
+            'orderitem_set-2-quantity': 1,
+            'orderitem_set-2-price': '99.99',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(self.order), (Decimal('152.49'), 6, 2))
+
+    def test_deleting_order(self):
+        self.order.delete()
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_check_and_fix(self):
+        other = services.place_order(self.user, {self.peonies.id: 3})
+        out = io.StringIO()
+        call_command('check_order_totals', stdout=out)
+        self.assertIn('Проверено заказов: 2, расхождений нет', out.getvalue())
+
+        # Позиции, измененные через QuerySet, не пересчитывают итоги
+        OrderItem.objects.filter(order=other).update(quantity=1)
+        Order.objects.filter(id=self.order.id).update(total_price=0, item_count=0)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, 'Проверено заказов: 2, расхождений: 2'):
+            call_command('check_order_totals', stdout=out)
+        self.assertIn(f'Заказ #{other.id}: сохранено', out.getvalue())
+
+        call_command('check_order_totals', '--fix', stdout=io.StringIO())
+        self.assertEqual(self.totals(self.order), (Decimal('31.50'), 3, 2))
+        self.assertEqual(self.totals(other), (Decimal('10.50'), 1, 1))
+
+    def test_backfill(self):
+        Order.objects.update(total_price=0, total_quantity=0, item_count=0)
+        empty = Order.objects.create(user=self.user)
+        out = io.StringIO()
+        call_command('backfill_order_totals', '--batch-size', '1', stdout=out)
+        self.assertIn('Итоги пересчитаны для 2 заказов', out.getvalue())
+        self.assertEqual(self.totals(self.order), (Decimal('31.50'), 3, 2))
+        self.assertEqual(self.totals(empty), (Decimal('0'), 0, 0))
+
+class CsvExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'secret', last_name='Иванов', first_name='Иван', patronymic='Иванович',
+        )
+        self.roses, self.lilies = create_products(2, stock_quantity=100)
+        # Запятая, кавычки и перевод строки должны пережить CSV
+        Product.objects.filter(id=self.lilies.id).update(name='Лилии, "белые"\nкрупные')
+        self.first = services.place_order(self.user, {self.roses.id: 1, self.lilies.id: 2})
+        self.second = services.place_order(self.user, {self.roses.id: 3})
+        inventory.confirm_orders([self.second.id])
+        self.empty = Order.objects.create(user=self.user)
+
+    def parse(self, chunks):
+        text = b''.join(chunks).decode('utf-8')
+        self.assertTrue(text.startswith('\ufeff'))
+        return list(csv.reader(io.StringIO(text[1:])))
+
+    def test_rows(self):
+        header, *rows = self.parse(export.stream('csv'))
+        self.assertEqual(header, export.COLUMNS)
+        self.assertEqual([row[0] for row in rows], [str(self.first.id)] * 2 + [str(self.second.id), str(self.empty.id)])
+        self.assertEqual(rows[0][2:7], ['Новый', 'Иванов Иван Иванович', '2', '3', '31.50'])
+        self.assertEqual(rows[1][7:], ['Лилии, "белые"\nкрупные', '2', '10.50', '21.00'])
+        self.assertEqual(rows[2][2], 'Подтвержден')
+        self.assertEqual(rows[2][7:], ['Букет 0', '3', '10.50', '31.50'])
+        # Заказ без позиций - одна строка с пустыми колонками позиции
+        self.assertEqual(rows[3][7:], ['', '', '', ''])
+
+    def test_chunks_do_not_change_rows(self):
+        self.assertEqual(list(export.rows(chunk_size=1)), list(export.rows()))
+
+    def test_admin_export_respects_filters(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/orders/order/export/csv/', {'status__exact': 'confirmed'})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        _, *rows = self.parse(response.streaming_content)
+        self.assertEqual([row[0] for row in rows], [str(self.second.id)])
+        self.assertEqual(self.client.get('/admin/orders/order/export/pdf/').status_code, 404)
+
+
+class XlsxExportTests(TestCase):
+    NS = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1', last_name='Петров')
+        self.roses, self.lilies = create_products(2, stock_quantity=100)
+        # Разметка, амперсанд и управляющий символ должны быть экранированы или убраны
+        Product.objects.filter(id=self.lilies.id).update(name='Лилии <белые> & "крупные"\x01')
+        self.order = services.place_order(self.user, {self.roses.id: 1, self.lilies.id: 2})
+        self.empty = Order.objects.create(user=self.user)
+
+    def open_book(self, chunks):
+        book = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertIsNone(book.testzip())
+        return book
+
+    def sheet_rows(self, book):
+        root = ElementTree.fromstring(book.read('xl/worksheets/sheet1.xml'))
+        return [
+            [''.join(cell.itertext()) for cell in row.findall('s:c', self.NS)]
+            for row in root.find('s:sheetData', self.NS).findall('s:row', self.NS)
+        ]
+
+    def test_sheet(self):
+        # По одной строке в пачке: строки пишутся в лист частями
+        with mock.patch.object(export, 'WRITE_BATCH', 1):
+            book = self.open_book(export.stream('xlsx'))
+        self.assertEqual(set(book.namelist()), {*export.XLSX_PARTS, 'xl/worksheets/sheet1.xml'})
+        xml = book.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertIn('Лилии &lt;белые&gt; &amp; "крупные"</t>', xml)
+        self.assertIn(f'<c><v>{self.order.id}</v></c>', xml)
+
+        header, *rows = self.sheet_rows(book)
+        self.assertEqual(header, export.COLUMNS)
+        self.assertEqual([row[0] for row in rows], [str(self.order.id)] * 2 + [str(self.empty.id)])
+        self.assertEqual(rows[1][7:], ['Лилии <белые> & "крупные"', '2', '10.50', '21.00'])
+        self.assertEqual(rows[0][2:7], ['Новый', 'Петров', '2', '3', '31.50'])
+        self.assertEqual(rows[2][7:], ['', '', '', ''])
+
+    def test_admin_action(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin)
+        response = self.client.post('/admin/orders/order/', {
+            'action': 'export_xlsx', '_selected_action': [self.order.id],
+        })
+        self.assertEqual(response['Content-Type'], export.CONTENT_TYPES['xlsx'])
+        self.assertTrue(response['Content-Disposition'].endswith('.xlsx"'))
+        _, *rows = self.sheet_rows(self.open_book(response.streaming_content))
+        self.assertEqual([row[0] for row in rows], [str(self.order.id)] * 2)
@@ -3,9 +3,11 @@ from . import views
 
 urlpatterns = [
     path('cart/', views.cart_view, name='cart'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('update-cart/<int:cart_item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('remove-from-cart/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('update-cart/<int:product_id>/', views.update_cart_item, name='update_cart_item'),
+    path('remove-from-cart/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('cancel-order/<int:order_id>/', views.cancel_order, name='cancel_order'),
     path('admin/get-product-price/<int:product_id>/', views.get_product_price, name='get_product_price'),
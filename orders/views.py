@@ -1,18 +1,24 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.http import require_http_methods
 from django.db import transaction
-from .models import Cart, Order, OrderItem
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_http_methods
+from .cart import get_cart, remember_count
+from .models import Order
 from .forms import OrderConfirmationForm, OrderStatusForm
+from . import inventory, services
 from main.models import Product
 
+# Операций в одном пакетном запросе к корзине
+CART_BATCH_LIMIT = 100
+
 
-@login_required
 def cart_view(request):
-    """Корзина пользователя"""
-    cart_items = Cart.objects.filter(user=request.user)
+    """Корзина посетителя"""
+    cart_items = get_cart(request).lines()
     total_price = sum(item.get_total_price() for item in cart_items)
     
     context = {
@@ -22,33 +28,20 @@ def cart_view(request):
     return render(request, 'orders/cart.html', context)
 
 
-@login_required
 @require_http_methods(["POST"])
 def add_to_cart(request, product_id):
     """Добавление товара в корзину"""
     product = get_object_or_404(Product, id=product_id, is_available=True)
     quantity = int(request.POST.get('quantity', 1))
+    cart = get_cart(request)
     
-    if quantity > product.stock_quantity:
+    if cart.quantity(product.id) + quantity > product.stock_quantity:
         return JsonResponse({
-            'success': False, 
+            'success': False,
             'message': f'Недостаточно товара на складе. Доступно: {product.stock_quantity}'
         })
     
-    cart_item, created = Cart.objects.get_or_create(
-        user=request.user,
-        product=product,
-        defaults={'quantity': quantity}
-    )
-    
-    if not created:
-        if cart_item.quantity + quantity > product.stock_quantity:
-            return JsonResponse({
-                'success': False,
-                'message': f'Недостаточно товара на складе. Доступно: {product.stock_quantity}'
-            })
-        cart_item.quantity += quantity
-        cart_item.save()
+    cart.add(product.id, quantity)
     
     return JsonResponse({
         'success': True,
@@ -56,73 +49,144 @@ def add_to_cart(request, product_id):
     })
 
 
-@login_required
 @require_http_methods(["POST"])
-def update_cart_item(request, cart_item_id):
+def update_cart_item(request, product_id):
     """Обновление количества товара в корзине"""
-    cart_item = get_object_or_404(Cart, id=cart_item_id, user=request.user)
+    cart = get_cart(request)
+    if not cart.quantity(product_id):
+        raise Http404('Товара нет в корзине')
     quantity = int(request.POST.get('quantity', 1))
     
     if quantity <= 0:
-        cart_item.delete()
+        cart.remove(product_id)
         return JsonResponse({'success': True, 'message': 'Товар удален из корзины'})
     
-    if quantity > cart_item.product.stock_quantity:
+    product = get_object_or_404(Product, id=product_id)
+    if quantity > product.stock_quantity:
         return JsonResponse({
             'success': False,
-            'message': f'Недостаточно товара на складе. Доступно: {cart_item.product.stock_quantity}'
+            'message': f'Недостаточно товара на складе. Доступно: {product.stock_quantity}'
         })
     
-    cart_item.quantity = quantity
-    cart_item.save()
+    cart.update(product_id, quantity)
     
     return JsonResponse({'success': True, 'message': 'Количество обновлено'})
 
 
-@login_required
 @require_http_methods(["POST"])
-def remove_from_cart(request, cart_item_id):
+def remove_from_cart(request, product_id):
     """Удаление товара из корзины"""
-    cart_item = get_object_or_404(Cart, id=cart_item_id, user=request.user)
-    cart_item.delete()
+    cart = get_cart(request)
+    if not cart.quantity(product_id):
+        raise Http404('Товара нет в корзине')
+    cart.remove(product_id)
     return JsonResponse({'success': True, 'message': 'Товар удален из корзины'})
 
 
+def _summary_json(cart):
+    summary = cart.summary()
+    return {'count': summary['count'], 'quantity': summary['quantity'], 'total': str(summary['total'])}
+
+
+def _parse_operations(body):
+    """Операции пакетного изменения корзины: [(операция, id товара, количество)]"""
+    operations = json.loads(body)['operations']
+    if not isinstance(operations, list) or not 0 < len(operations) <= CART_BATCH_LIMIT:
+        raise ValueError
+    parsed = []
+    for operation in operations:
+        op = operation['op']
+        if op not in ('add', 'set', 'remove'):
+            raise ValueError
+        quantity = int(operation.get('quantity', 1)) if op != 'remove' else 0
+        if op == 'add' and quantity <= 0:
+            raise ValueError
+        parsed.append((op, int(operation['product_id']), quantity))
+    return parsed
+
+
+@require_http_methods(["POST"])
+def cart_batch(request):
+    """Несколько изменений корзины одним запросом.
+
+    Тело - JSON {"operations": [{"op": "add" | "set" | "remove", "product_id": 1,
+    "quantity": 2}, ...]}. Операции применяются по порядку и все вместе:
+    если хотя бы одна невозможна, корзина не меняется.
+    """
+    try:
+        operations = _parse_operations(request.body)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Неверный формат запроса'}, status=400)
+    
+    cart = get_cart(request)
+    products = Product.objects.only('id', 'name', 'stock_quantity', 'is_available').in_bulk(
+        {product_id for _, product_id, _ in operations}
+    )
+    changes, errors = {}, []
+    for index, (op, product_id, quantity) in enumerate(operations):
+        if op == 'remove':
+            changes[product_id] = 0
+            continue
+        if op == 'add':
+            quantity += changes.get(product_id, cart.quantity(product_id))
+        product = products.get(product_id)
+        if quantity <= 0:
+            changes[product_id] = 0
+        elif product is None or not product.is_available:
+            errors.append({'index': index, 'product_id': product_id, 'message': 'Товар не найден'})
+        elif quantity > product.stock_quantity:
+            errors.append({
+                'index': index, 'product_id': product_id,
+                'message': f'Недостаточно товара "{product.name}" на складе. Доступно: {product.stock_quantity}',
+            })
+        else:
+            changes[product_id] = quantity
+    if errors:
+        return JsonResponse({'success': False, 'message': errors[0]['message'], 'errors': errors})
+    
+    with transaction.atomic():
+        cart.apply(changes)
+    
+    if all(op == 'add' for op, _, _ in operations):
+        message = 'Товар добавлен в корзину' if len(operations) == 1 else 'Товары добавлены в корзину'
+    else:
+        message = 'Корзина обновлена'
+    return JsonResponse({'success': True, 'message': message, 'summary': _summary_json(cart)})
+
+
+def cart_summary(request):
+    """Число позиций, товаров и сумма корзины"""
+    summary = _summary_json(get_cart(request))
+    remember_count(request, summary['count'])
+    return JsonResponse(summary)
+
+
 @login_required
 def checkout(request):
     """Оформление заказа"""
-    cart_items = Cart.objects.filter(user=request.user)
+    cart = get_cart(request)
     
-    if not cart_items.exists():
+    # Оформлению хватает id и количеств; товары загружаются только для страницы
+    if not cart.items():
         messages.warning(request, 'Корзина пуста')
         return redirect('cart')
     
     if request.method == 'POST':
         form = OrderConfirmationForm(request.user, request.POST)
-        if form.is_valid():
-            with transaction.atomic():
-                # Создаем заказ
-                order = Order.objects.create(user=request.user)
-                
-                # Добавляем товары в заказ
-                for cart_item in cart_items:
-                    OrderItem.objects.create(
-                        order=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.product.price
-                    )
-                    
-                    # НЕ уменьшаем количество на складе - это будет происходить только при подтверждении заказа
-                
-                # Очищаем корзину
-                cart_items.delete()
-                
-                messages.success(request, 'Заказ успешно оформлен!')
-                return JsonResponse({'success': True, 'message': 'Заказ успешно оформлен!', 'redirect': '/auth/profile/'})
+        if not form.is_valid():
+            return JsonResponse({'success': False, 'errors': form.errors})
+        try:
+            services.place_order(request.user, cart.items())
+        except services.CheckoutError as exc:
+            return JsonResponse({'success': False, 'message': str(exc)})
+        cart.clear()
+        
+        messages.success(request, 'Заказ успешно оформлен!')
+        return JsonResponse({'success': True, 'message': 'Заказ успешно оформлен!', 'redirect': '/auth/profile/'})
     else:
         form = OrderConfirmationForm(request.user)
     
+    cart_items = cart.lines()
     total_price = sum(item.get_total_price() for item in cart_items)
     
     context = {
@@ -138,17 +202,8 @@ def checkout(request):
 def cancel_order(request, order_id):
     """Отмена заказа пользователем"""
     order = get_object_or_404(Order, id=order_id, user=request.user, status='new')
-    
-    with transaction.atomic():
-        # Возвращаем товары на склад
-        for item in order.orderitem_set.all():
-            item.product.stock_quantity += item.quantity
-            item.product.save()
-        
-        # Отменяем заказ
-        order.status = 'cancelled'
-        order.cancellation_reason = 'Отменен пользователем'
-        order.save()
+    # Новый заказ еще не списан со склада; если списан - товары вернутся
+    inventory.cancel_orders([order.id], 'Отменен пользователем')
     
     messages.success(request, 'Заказ отменен')
     return redirect('profile')
@@ -49,8 +49,37 @@ document.addEventListener('DOMContentLoaded', function() {
             removeFromCart(cartItemId);
         });
     });
+    
+    // Счетчик корзины в шапке
+    updateCartCounter();
+    
+    // Позиции старых заказов в личном кабинете загружаются при раскрытии заказа
+    document.querySelectorAll('.order-items[data-items-url]').forEach(container => {
+        const collapse = container.closest('.accordion-collapse');
+        if (collapse) {
+            collapse.addEventListener('show.bs.collapse', () => loadOrderItems(container), { once: true });
+        }
+    });
 });
 
+// Функция загрузки позиций заказа
+function loadOrderItems(container) {
+    fetch(container.dataset.itemsUrl)
+    .then(response => {
+        if (!response.ok) {
+            throw new Error(response.status);
+        }
+        return response.text();
+    })
+    .then(html => {
+        container.innerHTML = html;
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        container.innerHTML = '<div class="text-danger small">Не удалось загрузить товары заказа</div>';
+    });
+}
+
 // Функция обработки отправки форм
 function handleFormSubmit(form, url) {
     const formData = new FormData(form);
@@ -99,15 +128,27 @@ function handleFormSubmit(form, url) {
     });
 }
 
-// Функция добавления товара в корзину
-function addToCart(productId, quantity) {
-    const formData = new FormData();
-    formData.append('quantity', quantity);
+// Изменения корзины копятся CART_BATCH_DELAY мс и уходят одним запросом
+const CART_BATCH_DELAY = 300;
+let cartOperations = [];
+let cartBatchTimer = null;
+
+function queueCartOperation(operation) {
+    cartOperations.push(operation);
+    clearTimeout(cartBatchTimer);
+    cartBatchTimer = setTimeout(sendCartOperations, CART_BATCH_DELAY);
+}
+
+// Функция отправки накопленных изменений корзины
+function sendCartOperations() {
+    const operations = cartOperations;
+    cartOperations = [];
     
-    fetch(`/orders/add-to-cart/${productId}/`, {
+    fetch('/orders/cart/batch/', {
         method: 'POST',
-        body: formData,
+        body: JSON.stringify({ operations: operations }),
         headers: {
+            'Content-Type': 'application/json',
             'X-CSRFToken': getCookie('csrftoken')
         }
     })
@@ -115,46 +156,31 @@ function addToCart(productId, quantity) {
     .then(data => {
         if (data.success) {
             showAlert('success', data.message);
-            // Обновляем счетчик корзины если есть
-            updateCartCounter();
+            renderCartSummary(data.summary);
+            // На странице корзины перезагружаем страницу для обновления общей суммы
+            if (document.querySelector('.cart-item')) {
+                setTimeout(() => {
+                    window.location.reload();
+                }, 1000);
+            }
         } else {
             showAlert('danger', data.message);
         }
     })
     .catch(error => {
         console.error('Error:', error);
-        showAlert('danger', 'Произошла ошибка при добавлении товара в корзину');
+        showAlert('danger', 'Произошла ошибка при обновлении корзины');
     });
 }
 
+// Функция добавления товара в корзину
+function addToCart(productId, quantity) {
+    queueCartOperation({ op: 'add', product_id: Number(productId), quantity: Number(quantity) });
+}
+
 // Функция обновления количества товара в корзине
 function updateCartItem(cartItemId, quantity) {
-    const formData = new FormData();
-    formData.append('quantity', quantity);
-    
-    fetch(`/orders/update-cart/${cartItemId}/`, {
-        method: 'POST',
-        body: formData,
-        headers: {
-            'X-CSRFToken': getCookie('csrftoken')
-        }
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            showAlert('success', data.message);
-            // Перезагружаем страницу для обновления общей суммы
-            setTimeout(() => {
-                window.location.reload();
-            }, 1000);
-        } else {
-            showAlert('danger', data.message);
-        }
-    })
-    .catch(error => {
-        console.error('Error:', error);
-        showAlert('danger', 'Произошла ошибка при обновлении корзины');
-    });
+    queueCartOperation({ op: 'set', product_id: Number(cartItemId), quantity: Number(quantity) });
 }
 
 // Функция удаления товара из корзины
@@ -163,33 +189,12 @@ function removeFromCart(cartItemId) {
         return;
     }
     
-    fetch(`/orders/remove-from-cart/${cartItemId}/`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': getCookie('csrftoken')
-        }
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            showAlert('success', data.message);
-            // Удаляем элемент из DOM
-            const cartItem = document.querySelector(`[data-cart-item-id="${cartItemId}"]`);
-            if (cartItem) {
-                cartItem.remove();
-            }
-            // Перезагружаем страницу для обновления общей суммы
-            setTimeout(() => {
-                window.location.reload();
-            }, 1000);
-        } else {
-            showAlert('danger', data.message);
-        }
-    })
-    .catch(error => {
-        console.error('Error:', error);
-        showAlert('danger', 'Произошла ошибка при удалении товара из корзины');
-    });
+    // Удаляем элемент из DOM сразу, запрос уйдет вместе с остальными изменениями
+    const cartItem = document.querySelector(`.cart-item[data-cart-item-id="${cartItemId}"]`);
+    if (cartItem) {
+        cartItem.remove();
+    }
+    queueCartOperation({ op: 'remove', product_id: Number(cartItemId) });
 }
 
 // Функция отображения ошибок формы
@@ -264,9 +269,32 @@ function getCookie(name) {
     return cookieValue;
 }
 
-// Функция обновления счетчика корзины
+// Функция обновления счетчика корзины: число позиций хранится в cookie,
+// которую сервер обновляет при изменении корзины, входе и выходе
 function updateCartCounter() {
-    // Здесь можно добавить логику обновления счетчика корзины
-    // Например, через AJAX запрос для получения количества товаров в корзине
+    if (!document.querySelector('.cart-count')) {
+        return;
+    }
+    const count = getCookie('cart_count');
+    if (count !== null) {
+        renderCartSummary({ count: parseInt(count, 10) || 0 });
+        return;
+    }
+    // Без cookie корзина пуста; только у вошедшего раньше покупателя ее нужно запросить один раз
+    if (!document.body.dataset.cartSync) {
+        return;
+    }
+    fetch('/orders/cart/summary/')
+    .then(response => response.json())
+    .then(renderCartSummary)
+    .catch(error => console.error('Error:', error));
+}
+
+// Функция отображения числа позиций корзины в шапке
+function renderCartSummary(summary) {
+    document.querySelectorAll('.cart-count').forEach(badge => {
+        badge.textContent = summary.count;
+        badge.classList.toggle('d-none', !summary.count);
+    });
 }
 
@@ -1,3 +1,66 @@
-from django.test import TestCase
-
-# Create your tests here.
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from main.models import Category, Product
+from orders.cart import COUNT_COOKIE
+from orders.models import Cart
+from .models import CustomUser
+
+
+class LoginCartMergeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-1')
+        category = Category.objects.create(name='Розы')
+        self.products = [
+            Product.objects.create(
+                name=f'Букет {i}', description='Описание', price=Decimal('100'), category=category,
+                country='Россия', year=2024, model='M1', stock_quantity=5, image='products/p.jpg',
+            )
+            for i in range(3)
+        ]
+
+    def add_anonymously(self, product, quantity):
+        response = self.client.post(f'/orders/add-to-cart/{product.id}/', {'quantity': quantity})
+        self.assertTrue(response.json()['success'])
+
+    def login(self):
+        response = self.client.post('/auth/login/', {'username': 'buyer', 'password': 'secret-pass-1'})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        return response
+
+    def cart(self):
+        response = self.client.get('/orders/cart/')
+        return {line.product.id: line.quantity for line in response.context['cart_items']}
+
+    def test_anonymous_cart_is_added_to_saved_cart(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=1)
+        Cart.objects.create(user=self.user, product=self.products[1], quantity=1)
+        self.add_anonymously(self.products[0], 2)
+        self.add_anonymously(self.products[2], 1)
+
+        response = self.login()
+        self.assertEqual(response.cookies[COUNT_COOKIE].value, '3')
+        expected = {self.products[0].id: 3, self.products[1].id: 1, self.products[2].id: 1}
+        self.assertEqual(self.cart(), expected)
+        self.assertEqual(dict(Cart.objects.filter(user=self.user).values_list('product_id', 'quantity')), expected)
+
+        # Анонимная корзина забрана из сессии: повторный вход ее не добавит
+        self.client.post('/auth/logout/')
+        self.login()
+        self.assertEqual(self.cart(), expected)
+
+    def test_saved_cart_without_anonymous_one(self):
+        Cart.objects.create(user=self.user, product=self.products[1], quantity=2)
+        response = self.login()
+        self.assertEqual(response.cookies[COUNT_COOKIE].value, '1')
+        self.assertEqual(self.cart(), {self.products[1].id: 2})
+
+    @override_settings(CART_STORAGE='orders.cart.CacheCartStorage')
+    def test_cache_storage(self):
+        Cart.objects.create(user=self.user, product=self.products[0], quantity=1)
+        self.add_anonymously(self.products[0], 2)
+        self.login()
+        self.assertEqual(self.cart(), {self.products[0].id: 3})
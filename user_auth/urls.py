@@ -6,5 +6,6 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('profile/', views.profile, name='profile'),
+    path('profile/orders/<int:order_id>/items/', views.profile_order_items, name='profile_order_items'),
 ]
 
@@ -1,10 +1,15 @@
 from django.shortcuts import render, redirect
+from django.conf import settings
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import Http404, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from main.pagination import InvalidCursor, KeysetPaginator
+from orders import archive
+from orders.models import ArchivedOrder, Order, OrderItem
 from .forms import RegistrationForm, LoginForm
 
 
@@ -47,14 +52,51 @@ def logout_view(request):
     return redirect('home')
 
 
+def _items_prefetch():
+    """Позиции заказов вместе с товарами - одним запросом на все заказы страницы"""
+    return Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product').order_by('id'))
+
+
 @login_required
 def profile(request):
     """Личный кабинет пользователя"""
-    from orders.models import Order
-    
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    # Архив заказов (orders/archive.py) читается только на своей вкладке
+    archived = request.GET.get('archive') == '1'
+    queryset = ArchivedOrder.objects.filter(user=request.user) if archived else Order.objects.filter(user=request.user)
+    paginator = KeysetPaginator(queryset, ['-created_at'], per_page=settings.PROFILE_ORDERS_PER_PAGE)
+    cursor = request.GET.get('cursor')
+    try:
+        page = paginator.get_page(cursor)
+    except InvalidCursor:
+        cursor = None
+        page = paginator.get_page()
+    # Позиции последних заказов показываются сразу, более старых - по запросу (profile_order_items);
+    # позиции архивного заказа хранятся в его строке
+    if archived:
+        for order in page.object_list:
+            order.item_list = order.get_items()
+    elif not cursor:
+        prefetch_related_objects(page.object_list, _items_prefetch())
+        for order in page.object_list:
+            order.item_list = order.orderitem_set.all()
     
     context = {
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
+        'items_loaded': archived or not cursor,
+        'archived': archived,
     }
-    return render(request, 'user_auth/profile.html', context)
\ No newline at end of file
+    return render(request, 'user_auth/profile.html', context)
+
+
+@login_required
+def profile_order_items(request, order_id):
+    """Позиции заказа для раскрывающегося блока в личном кабинете"""
+    order = archive.find_order(order_id, user=request.user)
+    if order is None:
+        raise Http404('Заказ не найден')
+    if isinstance(order, ArchivedOrder):
+        items = order.get_items()
+    else:
+        items = order.orderitem_set.select_related('product').order_by('id')
+    return render(request, 'user_auth/order_items.html', {'items': items})